@@ -1,13 +1,24 @@
 import os
 import sqlite3
+import time
+import threading
+import asyncio
 import json
-from flask import Flask, render_template, request, redirect, url_for, session, flash
-from flask_sqlalchemy import SQLAlchemy
+import uuid
+import click
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, abort, Response, g
 from werkzeug.security import generate_password_hash, check_password_hash
 from dotenv import load_dotenv
-from src.agents.assistant_agent import AssistantAgent
-from src.agents.testing_agent import TestingAgent
-from src.agents.tutoring_agent import TutoringAgent
+from src.pipeline import generate_course, agenerate_course, PipelineProgress, MultiProgress
+from src.jobs import JobQueue
+from src.models import db, User, Course, CourseContent, Lesson, add_missing_columns, add_missing_indexes, migrate_lessons_to_rows, import_compression_dictionaries, compress_stored_content
+from src.database import init_database, init_schema
+from src.course_cache import CourseCache, cache_key
+from src.checkpoint import CheckpointStore
+from src.rag import get_lesson_index, sync_from_database
+from src.agents.registry import registry
+from src.tracing import metrics, start_trace
+from src.logger import log_context, bind_log_context
 
 # Load environment variables
 load_dotenv()
@@ -16,36 +27,20 @@ app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "super_secret_dev_key")
 
 # --- Database Config ---
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///users.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
-
-# --- Database Models ---
-class User(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(150), unique=True, nullable=False)
-    password = db.Column(db.String(150), nullable=False)
-    # Relationship to access courses easily
-    courses = db.relationship('Course', backref='author', lazy=True)
-
-class Course(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    topic = db.Column(db.String(150), nullable=False)
-    subject = db.Column(db.String(150), nullable=False)
-    standard = db.Column(db.Integer, nullable=False)
-    
-    # Storing large text content
-    intro = db.Column(db.Text, nullable=True)
-    links = db.Column(db.Text, nullable=True)
-    
-    # Storing Dicts as JSON strings
-    lessons_json = db.Column(db.Text, nullable=True) 
-    tests_json = db.Column(db.Text, nullable=True)
+# DATABASE_URL, WAL/busy timeout for SQLite and pool sizing live in src/database.py
+init_database(app)
+
+# Initialize Database (tables, then migrations for databases created by older versions)
+init_schema(app, add_missing_columns, add_missing_indexes, migrate_lessons_to_rows, import_compression_dictionaries)
+
+DASHBOARD_PAGE_SIZE = int(os.getenv("DASHBOARD_PAGE_SIZE", "24"))
 
-# Initialize Database within Application Context
-with app.app_context():
-    db.create_all()
+# Keep the span trace of each generated course, shown at /course/<id>/trace
+TRACE_COURSES = os.getenv("TRACE_COURSES", "0") == "1"
+
+# An open event stream holds one WSGI worker thread; it is closed after this long and the browser
+# reconnects with Last-Event-ID, so a stalled job or an abandoned tab cannot pin a thread forever
+STREAM_MAX_SECONDS = float(os.getenv("STREAM_MAX_SECONDS", "300"))
 
 # --- Helpers ---
 def check_auth():
@@ -54,8 +49,218 @@ def check_auth():
         return False
     return True
 
+# --- Background Course Generation ---
+class CourseWriter(PipelineProgress):
+    """Writes streamed lessons and tests into the shared content's lesson rows as they arrive."""
+    def __init__(self, content_id):
+        self.content_id = content_id
+        self.ordinals = {}
+        # Tests complete on scheduler threads, so writes are serialised
+        self.lock = threading.Lock()
+
+    def save(self, **values):
+        with app.app_context():
+            db.session.execute(db.update(CourseContent).where(CourseContent.id == self.content_id).values(**values))
+            db.session.commit()
+
+    def save_lessons(self, lessons, tests):
+        """Replace the lesson rows with `lessons` (title -> content) in order."""
+        self.ordinals = {title: ordinal for ordinal, title in enumerate(lessons)}
+        with app.app_context():
+            db.session.execute(db.delete(Lesson).where(Lesson.content_id == self.content_id))
+            db.session.add_all([
+                Lesson(content_id=self.content_id, ordinal=ordinal, title=title, content=content, test=tests.get(title))
+                for ordinal, (title, content) in enumerate(lessons.items())
+            ])
+            db.session.commit()
+
+    def save_lesson(self, title, **values):
+        with app.app_context():
+            db.session.execute(db.update(Lesson).where(
+                Lesson.content_id == self.content_id,
+                Lesson.ordinal == self.ordinals[title]
+            ).values(**values))
+            db.session.commit()
+
+    def overview(self, topic_intro, study_links):
+        self.save(intro=topic_intro, links=study_links)
+
+    def plan(self, lesson_list):
+        with self.lock:
+            # Duplicate titles collapse into one lesson, as in the finished course
+            self.save_lessons(dict.fromkeys(lesson_list), {})
+
+    def lesson(self, title, content):
+        with self.lock:
+            if title in self.ordinals:
+                self.save_lesson(title, content=content)
+
+    def test(self, title, test):
+        with self.lock:
+            if title in self.ordinals:
+                self.save_lesson(title, test=test)
+
+def prepare_course_job(params):
+    """Writer for the job's content row and the course's checkpoint, with the lesson index brought up to date."""
+    writer = CourseWriter(params['content_id'])
+
+    # Pick up courses finished since the last job (also by other processes) and drop expired ones before reusing lessons
+    lesson_index = get_lesson_index()
+    if lesson_index is not None:
+        with app.app_context():
+            sync_from_database(lesson_index, course_cache)
+
+    # Keyed on the course, not the content row - retrying a failed course reserves a new row
+    checkpoint = checkpoints.thread(cache_key(params['topic'], params['subject'], params['standard'])) if checkpoints else None
+
+    return writer, checkpoint
+
+def finish_course_job(writer, course, progress, trace=None, checkpoint=None):
+    progress.stage("saving")
+
+    # Final write in planning order, so the rows match the finished course exactly
+    with writer.lock:
+        writer.save_lessons(course['lessons'], course['tests'])
+        writer.save(
+            intro=course['topic_intro'],
+            links=course['study_links'],
+            status='ready',
+            generation_mode=course.get('mode'),
+            plan=json.dumps(course.get('plan') or []),
+            **({'trace': trace.to_json()} if TRACE_COURSES and trace else {})
+        )
+
+    # The course is saved whole, its checkpoint is no longer needed
+    if checkpoint is not None:
+        checkpoint.clear()
+
+    return {"content_id": writer.content_id}
+
+def run_course_job(params, progress):
+    """Job handler - runs all Agents and streams the course into its (already reserved) content row."""
+    with log_context(course_id=params['content_id'], request_id=params.get('request_id')):
+        return _run_course_job(params, progress)
+
+def _run_course_job(params, progress):
+    writer, checkpoint = prepare_course_job(params)
+
+    try:
+        with start_trace() as trace:
+            course = generate_course(
+                params['topic'],
+                params['subject'],
+                int(params['standard']),
+                progress=MultiProgress(progress, writer),
+                checkpoint=checkpoint
+            )
+    except Exception:
+        writer.save(status='failed')
+        raise
+
+    return finish_course_job(writer, course, progress, trace, checkpoint)
+
+async def run_course_job_async(params, progress):
+    """run_course_job() on the shared event loop - the LLM calls are awaited, database writes run in threads."""
+    with log_context(course_id=params['content_id'], request_id=params.get('request_id')):
+        return await _run_course_job_async(params, progress)
+
+async def _run_course_job_async(params, progress):
+    writer, checkpoint = await asyncio.to_thread(prepare_course_job, params)
+
+    try:
+        with start_trace() as trace:
+            course = await agenerate_course(
+                params['topic'],
+                params['subject'],
+                int(params['standard']),
+                progress=MultiProgress(progress, writer),
+                checkpoint=checkpoint
+            )
+    except Exception:
+        await asyncio.to_thread(writer.save, status='failed')
+        raise
+
+    return await asyncio.to_thread(finish_course_job, writer, course, progress, trace, checkpoint)
+
+os.makedirs(app.instance_path, exist_ok=True)
+
+# Finished steps, lessons and tests of unfinished generations, so a failed or interrupted course resumes (CHECKPOINTS=0 disables)
+checkpoints = CheckpointStore(
+    os.getenv("CHECKPOINT_DB_PATH", os.path.join(app.instance_path, "checkpoints.db")),
+    ttl=float(os.getenv("CHECKPOINT_TTL_DAYS", "7")) * 86400
+) if os.getenv("CHECKPOINTS", "1") == "1" else None
+
+# Serve with a WSGI server, e.g. `gunicorn app:app --workers 2 --threads 16`. Views only reserve and
+# enqueue work, course generation runs on this queue: with ASYNC_GENERATION=1 up to ASYNC_JOB_CONCURRENCY
+# courses are in flight on one event loop, otherwise each course runs on one of JOB_WORKERS threads
+jobs = JobQueue(
+    os.getenv("JOBS_DB_PATH", os.path.join(app.instance_path, "jobs.db")),
+    run_course_job_async if os.getenv("ASYNC_GENERATION", "0") == "1" else run_course_job,
+    workers=int(os.getenv("JOB_WORKERS", "4")),
+    max_in_flight=int(os.getenv("ASYNC_JOB_CONCURRENCY", "100"))
+)
+jobs.start()
+
+# Reservations are checked against their job, so one whose job died or was never submitted is retried
+course_cache = CourseCache(jobs=jobs)
+
+# Build agents (graphs, LLM clients, search tool) once per process, off the request path
+if os.getenv("WARM_UP_AGENTS", "1") != "0":
+    threading.Thread(target=registry.warm_up, name="agent-warm-up", daemon=True).start()
+
+def get_user_job(job_id):
+    """Fetch a job and the user's course waiting on it, aborting unless the user has one."""
+    course = Course.query.join(CourseContent, Course.content_id == CourseContent.id).filter(
+        Course.user_id == session['user_id'],
+        CourseContent.job_id == job_id
+    ).first()
+    job = jobs.get(job_id) if course else None
+    if job is None:
+        abort(404)
+    return job, course
+
+def start_generation(content):
+    """Queue the job that fills in content this request reserved, and record it on the content row."""
+    content.job_id = jobs.submit({
+        "content_id": content.id,
+        "topic": content.topic,
+        "subject": content.subject,
+        "standard": content.standard,
+        "request_id": g.request_id
+    }, user_id=session['user_id'])
+    db.session.commit()
+
+# --- Request Ids ---
+@app.before_request
+def tag_request():
+    """Tag the request's log records (and any job it submits) with the proxy's X-Request-ID, or a new id"""
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    bind_log_context(request_id=g.request_id)
+
+@app.after_request
+def return_request_id(response):
+    response.headers['X-Request-ID'] = g.request_id
+    return response
+
 # --- Routes ---
 
+@app.route('/healthz')
+def healthz():
+    """Health check - agent registry state and job queue reachability"""
+    health = registry.health()
+    try:
+        jobs.get('healthz')
+        health['jobs'] = 'ok'
+    except Exception as e:
+        health['jobs'] = str(e)
+        health['status'] = 'degraded'
+    return jsonify(health), 200 if health['status'] == 'ok' else 503
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Agent node, LLM and search call metrics in the Prometheus text format (per process)"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def home():
     """Landing Page"""
@@ -126,10 +331,21 @@ def dashboard():
         flash("Please login to access the dashboard.", "error")
         return redirect(url_for('login'))
     
-    # Fetch user's previous courses (Newest first)
-    user_courses = Course.query.filter_by(user_id=session['user_id']).order_by(Course.id.desc()).all()
-    
-    return render_template('dashboard.html', user=session.get('username'), courses=user_courses)
+    # Fetch user's previous courses (Newest first) - summary columns only, one page at a time.
+    # Keyset pagination on id rides the (user_id, id) index, so every page costs the same
+    query = Course.query.options(db.load_only(Course.id, Course.topic, Course.subject, Course.standard)).filter(
+        Course.user_id == session['user_id']
+    )
+    before = request.args.get('before', type=int)
+    if before:
+        query = query.filter(Course.id < before)
+    user_courses = query.order_by(Course.id.desc()).limit(DASHBOARD_PAGE_SIZE + 1).all()
+
+    # One extra row tells whether an older page exists
+    older = user_courses[DASHBOARD_PAGE_SIZE - 1].id if len(user_courses) > DASHBOARD_PAGE_SIZE else None
+    user_courses = user_courses[:DASHBOARD_PAGE_SIZE]
+
+    return render_template('dashboard.html', user=session.get('username'), courses=user_courses, older=older, paged=bool(before))
 
 @app.route('/course/<int:course_id>')
 def view_course(course_id):
@@ -145,21 +361,80 @@ def view_course(course_id):
         flash("Unauthorized access.", "error")
         return redirect(url_for('dashboard'))
     
-    # Deserialize JSON strings back to Dicts
-    lessons = json.loads(course.lessons_json) if course.lessons_json else {}
-    tests = json.loads(course.tests_json) if course.tests_json else {}
-    
+    # Still generating - render the shell and stream lessons in as they complete
+    if course.status == 'generating':
+        job = jobs.get(course.content.job_id) if course.content.job_id else None
+        if job is None and not course_cache.reservation_alive(course.content):
+            # The job was never submitted or is gone - reserve the course again and link this course to it
+            content, created = course_cache.get_or_reserve(course.topic, course.subject, course.standard)
+            course.content_id = content.id
+            db.session.commit()
+            if created:
+                start_generation(content)
+            return redirect(url_for('view_course', course_id=course.id))
+        return render_template(
+            'product.html',
+            topic=course.topic,
+            subject=course.subject,
+            standard=course.standard,
+            intro=None,
+            links=None,
+            course_id=course.id,
+            lessons=[],
+            first_lesson=None,
+            job=job,
+            # Reserved a moment ago and the job is still being submitted, the page reloads until it is
+            pending=job is None
+        )
+
+    if course.status == 'failed':
+        flash("Generation of this course did not finish. Showing what was saved.", "error")
+
+    # Shared content for new courses, inline columns for older ones
+    source = course.source
+
+    # Table of contents only, lesson bodies are fetched one at a time from course_lesson
+    lessons = course.lesson_query().options(db.load_only(Lesson.ordinal, Lesson.title)).all()
+    first_lesson = course.lesson_query().first()
+
     return render_template(
         'product.html',
         topic=course.topic,
         subject=course.subject,
         standard=course.standard,
-        intro=course.intro,
-        links=course.links,
+        intro=source.intro,
+        links=source.links,
+        course_id=course.id,
         lessons=lessons,
-        tests=tests
+        first_lesson=first_lesson
     )
 
+@app.route('/course/<int:course_id>/lessons/<int:ordinal>')
+def course_lesson(course_id, ordinal):
+    """One lesson and its test as JSON, loaded when the student opens it"""
+    if not check_auth():
+        abort(401)
+    course = Course.query.get_or_404(course_id)
+    if course.user_id != session['user_id']:
+        abort(404)
+    lesson = course.lesson_query().filter(Lesson.ordinal == ordinal).first_or_404()
+    return jsonify({
+        "ordinal": lesson.ordinal,
+        "title": lesson.title,
+        "content": lesson.content,
+        "test": lesson.test
+    })
+
+@app.route('/course/<int:course_id>/trace')
+def course_trace(course_id):
+    """Spans recorded while the course was generated, when TRACE_COURSES=1 was set"""
+    if not check_auth():
+        abort(401)
+    course = Course.query.get_or_404(course_id)
+    if course.user_id != session['user_id'] or course.content is None or not course.content.trace:
+        abort(404)
+    return jsonify(json.loads(course.content.trace))
+
 @app.route('/product', methods=['POST'])
 def product():
     """Product Page - Orchestrates all Agents"""
@@ -185,59 +460,104 @@ def product():
         standard=int(standard)
     ).first()
     
-    if existing_course:
+    if existing_course and existing_course.status == 'failed':
+        # A failed generation is retried rather than served from history
+        db.session.delete(existing_course)
+        db.session.commit()
+    elif existing_course:
         flash("Loaded course from your history!", "success")
         return redirect(url_for('view_course', course_id=existing_course.id))
 
+    # --- CHECK SHARED CACHE ---
+    # Content generated (or being generated) for anyone else is linked instead of regenerated
+    content, created = course_cache.get_or_reserve(topic, subject, int(standard))
+
+    new_course = Course(
+        user_id=session['user_id'],
+        topic=topic,
+        subject=subject,
+        standard=int(standard),
+        content_id=content.id
+    )
+    db.session.add(new_course)
+    db.session.commit()
+
+    # --- QUEUE GENERATION ---
+    # Only the request that reserved the content starts a job, the content row is filled in as lessons complete
+    if created:
+        start_generation(content)
+    elif content.status == 'ready':
+        flash("Loaded course from the shared library!", "success")
+
+    return redirect(url_for('view_course', course_id=new_course.id))
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """JSON progress of a generation job, per stage and per lesson"""
+    if not check_auth():
+        abort(401)
+
+    job, course = get_user_job(job_id)
+
+    if job['status'] == 'done':
+        job['course_url'] = url_for('view_course', course_id=course.id)
+
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/stream')
+def job_stream(job_id):
+    """Server-sent events - pushes the overview, plan, each lesson and each test as they complete"""
+    if not check_auth():
+        abort(401)
+
+    get_user_job(job_id)
+
+    # Browsers resend the last seen id on reconnect, so nothing is replayed twice
+    # A malformed id (a proxy, a hand-written client) just replays the stream from the start
     try:
-        # --- AGENT 1: ASSISTANT AGENT ---
-        assistant = AssistantAgent()
-        initial_state = {"standard": str(standard), "subject": subject, "topic": topic}
-        assistant_output = assistant.graph.invoke(initial_state)
-        
-        instructions = assistant_output['instructions']
-        topic_intro = assistant_output.get('topic_intro', 'No intro generated.')
-        study_links = assistant_output.get('study_links', 'No links found.')
+        last_id = max(int(request.headers.get('Last-Event-ID', 0)), 0)
+    except ValueError:
+        last_id = 0
 
-        # --- AGENT 2: TUTORING AGENT ---
-        tutor = TutoringAgent()
-        lessons = tutor.run(instructions, int(standard), subject, topic)
+    def events(last_id):
+        idle_polls = 0
+        deadline = time.monotonic() + STREAM_MAX_SECONDS
+        while time.monotonic() < deadline:
+            new_events = jobs.events(job_id, after=last_id)
+            for event_id, event, data in new_events:
+                last_id = event_id
+                yield f"id: {event_id}\nevent: {event}\ndata: {data}\n\n"
+                if event in ('done', 'failed'):
+                    return
+            idle_polls = 0 if new_events else idle_polls + 1
+            if idle_polls and idle_polls % 30 == 0:
+                # Comment line keeps proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+            time.sleep(0.5)
 
-        # --- AGENT 3: TESTING AGENT ---
-        tester = TestingAgent()
-        tests = tester.run(lessons)
-        
-        # --- SAVE TO DATABASE ---
-        new_course = Course(
-            user_id=session['user_id'],
-            topic=topic,
-            subject=subject,
-            standard=int(standard),
-            intro=topic_intro,
-            links=study_links,
-            lessons_json=json.dumps(lessons), # Serialize dict to string
-            tests_json=json.dumps(tests)      # Serialize dict to string
-        )
-        db.session.add(new_course)
-        db.session.commit()
-        
-        flash("Course generated and saved to your history!", "success")
+    return Response(
+        events(last_id),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
-        return render_template(
-            'product.html',
-            topic=topic,
-            subject=subject,
-            standard=standard,
-            intro=topic_intro,
-            links=study_links,
-            lessons=lessons,
-            tests=tests
-        )
+# --- Maintenance Commands ---
 
-    except Exception as e:
-        flash(f"An error occurred during generation: {str(e)}", "error")
-        print(f"Error: {e}")
-        return redirect(url_for('dashboard'))
+@app.cli.command('compress-content')
+@click.option('--train-dictionary', is_flag=True, help='Train a shared dictionary on existing lessons first.')
+@click.option('--recompress', is_flag=True, help='Also rewrite rows that are already compressed.')
+def compress_content(train_dictionary, recompress):
+    """Compress stored course content in place and report the compression ratio"""
+    report = compress_stored_content(train=train_dictionary, recompress=recompress)
+    total_before = sum(before for before, after in report.values())
+    total_after = sum(after for before, after in report.values())
+    for column, (before, after) in report.items():
+        if before:
+            click.echo(f"{column}: {before:,} -> {after:,} bytes ({before / after:.2f}x)")
+    if total_after:
+        click.echo(f"Total: {total_before:,} -> {total_after:,} bytes ({total_before / total_after:.2f}x)")
+    else:
+        click.echo("Nothing to compress.")
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
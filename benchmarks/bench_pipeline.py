@@ -0,0 +1,328 @@
+"""
+Offline benchmark of course generation against the simulated backends in src/fakes.py.
+
+No Groq or Tavily quota is used: LLM_BACKEND=fake swaps in local stand-ins whose latency, output rate,
+429 and failure rates are set with the FAKE_* variables (see src/fakes.py). N concurrent users each
+generate a distinct course, through one of three targets:
+
+    agents    AssistantAgent.run, TutoringAgent.run and TestingAgent.run, timed separately
+    pipeline  src.pipeline.generate_course (or agenerate_course with --async)
+    product   the /product route and the job queue, as a browser would use them
+
+Reports p50/p95 course latency, time to first lesson, LLM/search calls per course and throughput, and
+saves them as JSON. Pass --compare with an earlier result to see the change.
+
+    python benchmarks/bench_pipeline.py --target pipeline --users 8
+    FAKE_RATE_LIMIT_RATE=0.05 python benchmarks/bench_pipeline.py --target product --users 4 --compare old.json
+    python benchmarks/bench_pipeline.py --mode fused --compare benchmarks/results/pipeline-separate.json
+    python benchmarks/bench_pipeline.py --router --standard 12
+    FAKE_LATENCY_SIGMA=1.0 HEDGE_MIN_DELAY_SECONDS=0.2 python benchmarks/bench_pipeline.py --hedge --compare unhedged.json
+"""
+
+import threading
+import argparse
+import tempfile
+import asyncio
+import json
+import time
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def configure_environment():
+
+    # Must happen before any src module is imported, settings are read at import and construction time
+    os.environ["LLM_BACKEND"] = "fake"
+    os.environ.setdefault("LESSON_REUSE", "0")
+    os.environ.setdefault("WARM_UP_AGENTS", "0")
+    scratch = tempfile.mkdtemp(prefix = "bench-")
+    os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(scratch, "users.db"))
+    os.environ.setdefault("JOBS_DB_PATH", os.path.join(scratch, "jobs.db"))
+    os.environ.setdefault("LLM_CACHE_PATH", os.path.join(scratch, "llm_cache.db"))
+    os.environ.setdefault("SEARCH_CACHE_PATH", os.path.join(scratch, "search_cache.db"))
+    os.environ.setdefault("CHECKPOINT_DB_PATH", os.path.join(scratch, "checkpoints.db"))
+    sys.path.insert(0, ROOT)
+
+def summary(values: list) -> dict:
+
+    if not values:
+
+        return {"count": 0, "p50": None, "p95": None, "max": None}
+
+    values = sorted(values)
+
+    def at(fraction):
+
+        return round(values[min(len(values) - 1, int(len(values) * fraction))], 3)
+
+    return {"count": len(values), "p50": at(0.5), "p95": at(0.95), "max": round(values[-1], 3)}
+
+def run_concurrently(users: int, task) -> list:
+
+    """Run task(index) for every user on its own thread; returns each result or the exception raised."""
+
+    results = [None] * users
+
+    def run(index):
+
+        try:
+
+            results[index] = task(index)
+
+        except Exception as e:
+
+            results[index] = e
+
+    threads = [threading.Thread(target = run, args = (index,)) for index in range(users)]
+
+    for thread in threads:
+
+        thread.start()
+
+    for thread in threads:
+
+        thread.join()
+
+    return results
+
+def bench_agents(args) -> dict:
+
+    from src.agents.registry import registry
+
+    timings = {"assistant": [], "tutoring": [], "testing": []}
+    lock = threading.Lock()
+
+    def course(index):
+
+        topic = f"Benchmark topic {index}"
+        started = time.perf_counter()
+        instructions = registry.assistant.run(topic, "Mathematics", args.standard)
+        assistant_done = time.perf_counter()
+        lessons = registry.tutor.run(instructions, args.standard, "Mathematics", topic)
+        tutoring_done = time.perf_counter()
+        registry.tester.run(lessons)
+        finished = time.perf_counter()
+
+        with lock:
+
+            timings["assistant"].append(assistant_done - started)
+            timings["tutoring"].append(tutoring_done - assistant_done)
+            timings["testing"].append(finished - tutoring_done)
+
+        # The standalone agents only return at the end, so the first lesson arrives with the last one
+        return {"latency": finished - started, "first_lesson": tutoring_done - started}
+
+    results = run_concurrently(args.users, course)
+
+    return {"results": results, "agents": {name: summary(values) for name, values in timings.items()}}
+
+def bench_pipeline(args) -> dict:
+
+    from src.pipeline import generate_course, agenerate_course, PipelineProgress
+    from src.event_loop import run_coroutine
+
+    class FirstLesson(PipelineProgress):
+
+        def __init__(self):
+
+            self.started = time.perf_counter()
+            self.first_lesson = None
+
+        def lesson(self, title, content):
+
+            if self.first_lesson is None:
+
+                self.first_lesson = time.perf_counter() - self.started
+
+    def course(index):
+
+        progress = FirstLesson()
+        topic = f"Benchmark topic {index}"
+
+        if args.use_async:
+
+            run_coroutine(agenerate_course(topic, "Mathematics", args.standard, progress = progress)).result()
+
+        else:
+
+            generate_course(topic, "Mathematics", args.standard, progress = progress)
+
+        return {"latency": time.perf_counter() - progress.started, "first_lesson": progress.first_lesson}
+
+    return {"results": run_concurrently(args.users, course)}
+
+def bench_product(args) -> dict:
+
+    if args.use_async:
+
+        os.environ["ASYNC_GENERATION"] = "1"
+
+    import app as application
+
+    def course(index):
+
+        client = application.app.test_client()
+        client.post('/register', data = {"username": f"bench-{index}", "password": "bench"})
+        client.post('/login', data = {"username": f"bench-{index}", "password": "bench"})
+
+        started = time.perf_counter()
+        response = client.post('/product', data = {"topic": f"Benchmark topic {index}", "subject": "Mathematics", "standard": str(args.standard)})
+        course_id = int(response.location.rstrip('/').split('/')[-1])
+
+        with application.app.app_context():
+
+            job_id = application.db.session.get(application.Course, course_id).content.job_id
+
+        first_lesson = None
+
+        while True:
+
+            job = application.jobs.get(job_id)
+
+            if first_lesson is None and job["completed_lessons"]:
+
+                first_lesson = time.perf_counter() - started
+
+            if job["status"] in ("done", "failed"):
+
+                break
+
+            time.sleep(0.05)
+
+        if job["status"] == "failed":
+
+            raise RuntimeError(job["error"])
+
+        return {"latency": time.perf_counter() - started, "first_lesson": first_lesson}
+
+    return {"results": run_concurrently(args.users, course)}
+
+def compare(report: dict, baseline_path: str):
+
+    with open(baseline_path) as f:
+
+        baseline = json.load(f)
+
+    print(f"\nCompared with {baseline_path}:")
+
+    for metric in ("course_latency_s", "time_to_first_lesson_s"):
+
+        for stat in ("p50", "p95"):
+
+            old, new = baseline[metric][stat], report[metric][stat]
+
+            if old and new is not None:
+
+                print(f"  {metric} {stat}: {old} -> {new} ({(new - old) / old * 100:+.1f}%)")
+
+    old, new = baseline["throughput_courses_per_min"], report["throughput_courses_per_min"]
+
+    if old:
+
+        print(f"  throughput_courses_per_min: {old} -> {new} ({(new - old) / old * 100:+.1f}%)")
+
+def main():
+
+    parser = argparse.ArgumentParser(description = __doc__.strip().splitlines()[0])
+    parser.add_argument("--target", choices = ["agents", "pipeline", "product"], default = "pipeline")
+    parser.add_argument("--users", type = int, default = 4, help = "concurrent users, one course each")
+    parser.add_argument("--standard", type = int, default = 8)
+    parser.add_argument("--async", dest = "use_async", action = "store_true", help = "use the async generation path")
+    parser.add_argument("--mode", choices = ["separate", "fused", "ab"], help = "GENERATION_MODE for the run (default from the environment)")
+    parser.add_argument("--router", action = "store_true", help = "route each lesson and test by difficulty (MODEL_ROUTER=1)")
+    parser.add_argument("--hedge", action = "store_true", help = "duplicate slow LLM calls on the other key (LLM_HEDGING=1)")
+    parser.add_argument("--output", help = "where to save the JSON result (default benchmarks/results/)")
+    parser.add_argument("--compare", help = "earlier JSON result to compare against")
+    args = parser.parse_args()
+
+    configure_environment()
+
+    if args.mode:
+
+        os.environ["GENERATION_MODE"] = args.mode
+
+    if args.router:
+
+        os.environ["MODEL_ROUTER"] = "1"
+
+    if args.hedge:
+
+        os.environ["LLM_HEDGING"] = "1"
+
+    from src import fakes
+
+    started = time.perf_counter()
+    outcome = {"agents": bench_agents, "pipeline": bench_pipeline, "product": bench_product}[args.target](args)
+    elapsed = time.perf_counter() - started
+
+    finished = [result for result in outcome["results"] if isinstance(result, dict)]
+    failures = [f"{type(result).__name__}: {result}" for result in outcome["results"] if isinstance(result, Exception)]
+    calls = fakes.stats.snapshot()
+
+    report = {
+        "target": args.target,
+        "users": args.users,
+        "async": args.use_async,
+        "mode": os.getenv("GENERATION_MODE", "separate"),
+        "router": os.getenv("MODEL_ROUTER", "0") == "1",
+        "hedging": os.getenv("LLM_HEDGING", "0") == "1",
+        "profile": {name: value for name, value in sorted(os.environ.items()) if name.startswith("FAKE_")},
+        "seconds": round(elapsed, 2),
+        "courses": len(finished),
+        "failures": failures,
+        "course_latency_s": summary([result["latency"] for result in finished]),
+        "time_to_first_lesson_s": summary([result["first_lesson"] for result in finished if result["first_lesson"] is not None]),
+        "calls_per_course": {name: round(count / max(1, len(finished)), 1) for name, count in sorted(calls.items())},
+        "throughput_courses_per_min": round(len(finished) / elapsed * 60, 2) if elapsed else 0.0
+    }
+
+    if "agents" in outcome:
+
+        report["agents_s"] = outcome["agents"]
+
+    if args.router:
+
+        from src.tracing import metrics
+
+        routes = {}
+
+        for (router, tier, reason), count in metrics.routes.series.items():
+
+            routes.setdefault(router, {}).setdefault(tier, 0)
+            routes[router][tier] += count
+
+        report["routes"] = routes
+
+    if args.hedge:
+
+        from src.tracing import metrics
+
+        hedges = {}
+
+        for (model, result), count in metrics.hedges.series.items():
+
+            hedges[result] = hedges.get(result, 0) + count
+
+        report["hedges"] = hedges
+
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", f"{args.target}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok = True)
+
+    with open(output, "w") as f:
+
+        json.dump(report, f, indent = 2)
+
+    print(json.dumps(report, indent = 2))
+    print(f"\nSaved to {output}")
+
+    if args.compare:
+
+        compare(report, args.compare)
+
+    # Leave the job queue and event loop daemon threads behind instead of waiting on them
+    os._exit(1 if failures else 0)
+
+if __name__ == "__main__":
+
+    main()
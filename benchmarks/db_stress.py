@@ -0,0 +1,196 @@
+"""
+Concurrency stress run of the database setup in src/database.py.
+
+Starts several processes (like gunicorn workers), each with several threads, that register and log in
+users through the Flask app and save finished courses through the same write path as the job workers.
+Reports throughput, latency percentiles and every error, e.g. "database is locked".
+
+    python benchmarks/db_stress.py --processes 4 --threads 4 --courses 10
+    DATABASE_URL=postgresql://... python benchmarks/db_stress.py
+
+Only the database is exercised - no LLM or search calls are made.
+"""
+
+import multiprocessing
+import argparse
+import tempfile
+import json
+import time
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def percentile(values, fraction):
+
+    if not values:
+
+        return None
+
+    values = sorted(values)
+
+    return round(values[min(len(values) - 1, int(len(values) * fraction))] * 1000, 1)
+
+def worker(process_index, threads, courses, lessons, results):
+
+    try:
+
+        run_worker(process_index, threads, courses, lessons, results)
+
+    except Exception as e:
+
+        # A worker that cannot even start (e.g. schema setup failing) is an error too, not a hang
+        results.put({"timings": {}, "errors": [f"worker {process_index} crashed: {type(e).__name__}: {e}"]})
+
+def run_worker(process_index, threads, courses, lessons, results):
+
+    import threading
+
+    sys.path.insert(0, ROOT)
+
+    import app as application
+
+    timings = {"register": [], "login": [], "save_course": []}
+    errors = []
+    lock = threading.Lock()
+
+    def timed(operation, function):
+
+        started = time.perf_counter()
+
+        try:
+
+            function()
+
+        except Exception as e:
+
+            with lock:
+
+                errors.append(f"{operation}: {type(e).__name__}: {e}")
+
+            return
+
+        with lock:
+
+            timings[operation].append(time.perf_counter() - started)
+
+    def save_course(user_id, index):
+
+        with application.app.app_context():
+
+            content, created = application.course_cache.get_or_reserve(f"Stress topic {index}", "Stress", 5)
+            course = application.Course(user_id = user_id, topic = content.topic, subject = content.subject, standard = 5, content_id = content.id)
+            application.db.session.add(course)
+            application.db.session.commit()
+            content_id = content.id
+
+        if created:
+
+            writer = application.CourseWriter(content_id)
+            body = "<h2>Lesson</h2><p>" + "Stress lesson content. " * 200 + "</p>"
+            writer.save_lessons({f"Lesson {n}": body for n in range(lessons)}, {f"Lesson {n}": "<p>Quiz</p>" for n in range(lessons)})
+            writer.save(intro = "<p>Intro</p>", links = "https://example.com", status = 'ready')
+
+    def session(thread_index):
+
+        client = application.app.test_client()
+        username = f"stress-{os.getpid()}-{thread_index}"
+
+        def register():
+
+            response = client.post('/register', data = {"username": username, "password": "stress"})
+
+            if response.status_code != 302:
+
+                raise RuntimeError(f"register returned {response.status_code}")
+
+        def login():
+
+            response = client.post('/login', data = {"username": username, "password": "stress"})
+
+            if response.status_code != 302:
+
+                raise RuntimeError(f"login returned {response.status_code}")
+
+        timed("register", register)
+        timed("login", login)
+
+        with client.session_transaction() as flask_session:
+
+            user_id = flask_session.get('user_id')
+
+        if user_id is None:
+
+            return
+
+        for index in range(courses):
+
+            # Overlapping topics across processes also exercise the shared cache's unique key
+            timed("save_course", lambda: save_course(user_id, (process_index * threads + thread_index + index) % (threads * 2)))
+
+    pool = [threading.Thread(target = session, args = (index,)) for index in range(threads)]
+
+    for thread in pool:
+
+        thread.start()
+
+    for thread in pool:
+
+        thread.join()
+
+    results.put({"timings": timings, "errors": errors})
+
+def main():
+
+    parser = argparse.ArgumentParser(description = __doc__.strip().splitlines()[0])
+    parser.add_argument("--processes", type = int, default = 4)
+    parser.add_argument("--threads", type = int, default = 4)
+    parser.add_argument("--courses", type = int, default = 10, help = "courses saved per thread")
+    parser.add_argument("--lessons", type = int, default = 20, help = "lessons per saved course")
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix = "db-stress-")
+    os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(scratch, "users.db"))
+    os.environ["JOBS_DB_PATH"] = os.path.join(scratch, "jobs.db")
+    os.environ["WARM_UP_AGENTS"] = "0"
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    started = time.perf_counter()
+    processes = [
+        context.Process(target = worker, args = (index, args.threads, args.courses, args.lessons, results))
+        for index in range(args.processes)
+    ]
+
+    for process in processes:
+
+        process.start()
+
+    collected = [results.get() for _ in processes]
+
+    for process in processes:
+
+        process.join()
+
+    elapsed = time.perf_counter() - started
+    report = {"database": os.environ["DATABASE_URL"], "seconds": round(elapsed, 2), "operations": {}, "errors": []}
+
+    for operation in ("register", "login", "save_course"):
+
+        timings = [value for result in collected for value in result["timings"].get(operation, [])]
+        report["operations"][operation] = {
+            "count": len(timings),
+            "p50_ms": percentile(timings, 0.5),
+            "p95_ms": percentile(timings, 0.95),
+            "max_ms": percentile(timings, 1.0)
+        }
+
+    report["errors"] = [error for result in collected for error in result["errors"]]
+
+    print(json.dumps(report, indent = 2))
+
+    sys.exit(1 if report["errors"] else 0)
+
+if __name__ == "__main__":
+
+    main()
@@ -1,11 +1,12 @@
-from src.utils import get_llm_1, get_llm_lite_1
+from src.utils import get_llm_1, get_llm_lite_1, llm_cache_enabled, get_search_tool
 from src.logger import logging
 from src.exception import CustomException
+from src.tracing import traced_node
+from src.prompting import fit, compact_search_results, log_prompt
 from langgraph.graph import StateGraph, END, START
-from langchain_tavily import TavilySearch
 from langchain_core.messages import SystemMessage
+from langchain_core.runnables import RunnableLambda
 import sys
-import os
 from typing import TypedDict
 
 class AgentState(TypedDict):
@@ -15,29 +16,29 @@ class AgentState(TypedDict):
     instructions: str
     topic_intro: str
     study_links: str
+    search_context: str
     topic: str
 
 class AssistantAgent:
 
-    def __init__(self):
+    def __init__(self, use_cache: bool = None):
 
-        self.llm_lite = get_llm_lite_1()
-        self.llm = get_llm_1()
+        # Response caching is opt-in, see LLM_CACHE_AGENTS
+        use_cache = llm_cache_enabled("assistant") if use_cache is None else use_cache
+        self.llm_lite = get_llm_lite_1(cached = use_cache)
+        self.llm = get_llm_1(cached = use_cache)
         self.graph = self._build_graph()
-        self.tool = [TavilySearch(
-            max_results = 5,
-            topic = "general",
-            api_key = os.getenv("TAVILY_API_KEY")
-        )]
+        self.tool = [get_search_tool(max_results = 5)]
 
     def _build_graph(self):
 
         graph = StateGraph(AgentState)
 
         # Graph Logic and Structure will go here
-        graph.add_node("generate_instructions", self._generate_instructions)
-        graph.add_node("user_interaction", self._user_interaction)
-        graph.add_node("generate_study_links", self._generate_study_links)
+        # Each node has a sync and an async body: graph.invoke runs the first, graph.ainvoke the second
+        graph.add_node("generate_instructions", RunnableLambda(self._generate_instructions, afunc = self._agenerate_instructions))
+        graph.add_node("user_interaction", RunnableLambda(self._user_interaction, afunc = self._auser_interaction))
+        graph.add_node("generate_study_links", RunnableLambda(self._generate_study_links, afunc = self._agenerate_study_links))
 
         graph.add_edge(START, "generate_study_links")
         graph.add_edge("generate_study_links", "user_interaction")
@@ -45,48 +46,75 @@ class AssistantAgent:
         graph.add_edge("generate_instructions", END)
         return graph.compile()
     
+    def _user_interaction_prompt(self, state: AgentState) -> list:
+
+        topic = state["topic"]
+        subject = state["subject"]
+        standard = state["standard"]
+        # Titles and snippets of the search results, trimmed to the stage's token budget
+        study_links = fit("user_interaction", search_results = state.get("search_context") or state["study_links"])["search_results"]
+
+        prompt = f"""
+
+        You are a manager and a teacher. Your task is to provide the instructions to the user for a particular topic.
+        You will give a general idea about the topic like how difficult it is and what are the pre-requisites to study the topic.
+        You will also give a brief introduction on this topic to the user.
+        
+        These are the general instructions provided by the user:-
+
+        1. The topic that is needed to be taught to the user is :- {topic}
+        2. The subject that is needed to be taught to the user is :- {subject}
+        3. The standard that the user currently is in with respect to Indian standard (School) :- {standard}
+
+        These are the study materials and general intro provided by the user:-
+
+        {study_links}
+
+        So provide the links of the study materials and intro to the study materials as well along with the general intro to the topic.
+        Also add tips for learning the topic.
+
+        IMPORTANT FORMATTING INSTRUCTIONS:
+        - The output MUST be in HTML format.
+        - Use <h3> tags for main headings.
+        - Use <b> tags for bold text (do not use asterisks **).
+        - Use <p> tags for paragraphs.
+        - Use <ul> and <li> tags for lists.
+        - Ensure the content is visually structured and easy to read.
+        - Do NOT use Markdown syntax (like #, *, -).
+
+        """
+
+        return [SystemMessage(content=prompt)]
+
+    @traced_node("user_interaction")
     def _user_interaction(self, state: AgentState) -> dict:
 
         try:
 
             logging.info("Agent is generating initial contents for the user...")
 
-            topic = state["topic"]
-            subject = state["subject"]
-            standard = state["standard"]
-            study_links = state["study_links"]
-
-            prompt = f"""
+            prompt = self._user_interaction_prompt(state)
+            log_prompt("user_interaction", prompt)
+            response = self.llm_lite.invoke(prompt)
 
-            You are a manager and a teacher. Your task is to provide the instructions to the user for a particular topic.
-            You will give a general idea about the topic like how difficult it is and what are the pre-requisites to study the topic.
-            You will also give a brief introduction on this topic to the user.
-            
-            These are the general instructions provided by the user:-
+            logging.info("Agent has generated initial contents for the user...")
 
-            1. The topic that is needed to be taught to the user is :- {topic}
-            2. The subject that is needed to be taught to the user is :- {subject}
-            3. The standard that the user currently is in with respect to Indian standard (School) :- {standard}
+            return {"topic_intro": response.content}
 
-            These are the study materials and general intro provided by the user:-
+        except Exception as e:
 
-            {study_links}
+            raise CustomException(e, sys)
 
-            So provide the links of the study materials and intro to the study materials as well along with the general intro to the topic.
-            Also add tips for learning the topic.
+    @traced_node("user_interaction")
+    async def _auser_interaction(self, state: AgentState) -> dict:
 
-            IMPORTANT FORMATTING INSTRUCTIONS:
-            - The output MUST be in HTML format.
-            - Use <h3> tags for main headings.
-            - Use <b> tags for bold text (do not use asterisks **).
-            - Use <p> tags for paragraphs.
-            - Use <ul> and <li> tags for lists.
-            - Ensure the content is visually structured and easy to read.
-            - Do NOT use Markdown syntax (like #, *, -).
+        try:
 
-            """
+            logging.info("Agent is generating initial contents for the user...")
 
-            response = self.llm_lite.invoke([SystemMessage(content=prompt)])
+            prompt = self._user_interaction_prompt(state)
+            log_prompt("user_interaction", prompt)
+            response = await self.llm_lite.ainvoke(prompt)
 
             logging.info("Agent has generated initial contents for the user...")
 
@@ -96,42 +124,72 @@ class AssistantAgent:
 
             raise CustomException(e, sys)
 
+    def _instructions_prompt(self, state: AgentState) -> str:
+
+        standard = state["standard"]
+        subject = state["subject"]
+        topic = state["topic"]
+
+        # The intro was written from the search results, so lines they share are kept once, then both are trimmed to budget
+        context = fit("instructions", topic_intro = state["topic_intro"], study_materials = state.get("search_context") or state["study_links"])
+        topic_intro = context["topic_intro"]
+        study_links = context["study_materials"]
+
+        prompt = f"""
+
+        You are an agent manager and your task is to write a detailed prompt for an agent whose task is to plan lessons based on:-
+
+        1. The topic that is needed to be taught to the user is :- {topic}
+        2. The subject that is needed to be taught to the user is :- {subject}
+        3. The standard that the user currently is in with respect to Indian standard (School) :- {standard}
+        4. The study materials and general intro provided for the user:- {study_links}
+        5. The general intro provided for the user: {topic_intro}
+        
+        Give explicit prompt for the planning agent only, the agent should plan the lessons step by step and in comprehensive way so that even user will get time to be comfortable with the topics.
+        Your instructions should be in separate sections like this:-
+        
+        1. This section will contain a short summary of the topic intro (point 5 above).
+        2. This section will contain general info about the user's requests i.e. topic, subject and standard (points 1 to 3 above).
+        3. This section must include the study links urls from point 4 above for the planning agent.
+        4. This section will contain the pre requisites and difficulty level for the topic.
+        5. This section will contain explicit prompt for the planning agent, the agent should plan the lessons step by step and in comprehensive way (35 - 50 lessons) so that even user will get time to be comfortable with the topics.
+
+        You must only give the prompt for the planning agent and you do not have to plan the lessons.
+        Keep the prompt concise, do not repeat the intro or the study materials in full.
+
+        """
+
+        return prompt
+
+    @traced_node("generate_instructions")
     def _generate_instructions(self, state: AgentState) -> dict:
 
         try:
             
             logging.info("Agent is generating instructions for the agents...")
 
-            standard = state["standard"]
-            subject = state["subject"]
-            topic_intro = state["topic_intro"]
-            study_links = state["study_links"]
-            topic = state["topic"]
+            prompt = self._instructions_prompt(state)
+            log_prompt("instructions", prompt)
+            response = self.llm.invoke(prompt)
 
-            prompt = f"""
+            logging.info("Agent has generated instructions for the agents...")
 
-            You are an agent manager and your task is to write a detailed prompt for an agent whose task is to plan lessons based on:-
+            return {"instructions": response.content}
 
-            1. The topic that is needed to be taught to the user is :- {topic}
-            2. The subject that is needed to be taught to the user is :- {subject}
-            3. The standard that the user currently is in with respect to Indian standard (School) :- {standard}
-            4. The study materials and general intro provided for the user:- {study_links}
-            5. The general intro provided for the user: {topic_intro}
-            
-            Give explicit prompt for the planning agent only, the agent should plan the lessons step by step and in comprehensive way so that even user will get time to be comfortable with the topics.
-            Your instructions should be in separate sections like this:-
-            
-            1. This section will contain the topic intro: {topic_intro}
-            2. This section will contain general info about the user's requests i.e. topic: {topic}, subject: {subject}, standard: {standard}
-            3. This section must include the study links url ({study_links}) for the planning agent.
-            4. This section will contain the pre requisites and difficulty level for the topic.
-            5. This section will contain explicit prompt for the planning agent, the agent should plan the lessons step by step and in comprehensive way (35 - 50 lessons) so that even user will get time to be comfortable with the topics.
+        except Exception as e:
+
+            raise CustomException(e, sys)
 
-            You must only give the prompt for the planning agent and you do not have to plan the lessons.
+    @traced_node("generate_instructions")
+    async def _agenerate_instructions(self, state: AgentState) -> dict:
 
-            """
+        try:
+            
+            logging.info("Agent is generating instructions for the agents...")
 
-            response = self.llm.invoke(prompt)
+            prompt = self._instructions_prompt(state)
+            log_prompt("instructions", prompt)
+            response = await self.llm.ainvoke(prompt)
 
             logging.info("Agent has generated instructions for the agents...")
 
@@ -141,40 +199,73 @@ class AssistantAgent:
 
             raise CustomException(e, sys)
 
+    def _study_links_query(self, state: AgentState) -> str:
+
+        topic = state["topic"]
+        subject = state["subject"]
+        standard = state["standard"]
+
+        prompt = f"""
+
+        Give me a study materials, youtube video links and general intro on the topic: {topic} from the subject: {subject} for the student of standard: {standard}.
+
+        """
+
+        return prompt
+
+    @staticmethod
+    def _format_search_results(response) -> str:
+
+        # TavilySearch returns {"query": ..., "results": [...]}, only the results are links
+        if isinstance(response, dict) and "results" in response:
+            response = response["results"]
+
+        # Defensive check: Ensure response is a string
+        if not isinstance(response, str):
+            if isinstance(response, list):
+                items = []
+                for item in response:
+                    if isinstance(item, dict):
+                        items.append(f"{item.get('url', str(item))}")
+                    else:
+                        items.append(str(item))
+                response = "\n".join(items)
+            else:
+                response = str(response)
+
+        return response
+
+    @traced_node("generate_study_links")
     def _generate_study_links(self, state: AgentState) -> str:
 
         try:
 
             logging.info("Agent is generating study materials and general intro for the user...")
 
-            topic = state["topic"]
-            subject = state["subject"]
-            standard = state["standard"]
+            response = self.tool[0].invoke(self._study_links_query(state))
+
+            logging.info("Agent has generated study materials and general intro for the user...")
+
+            # The links are shown to the student as they are, the prompts get the compact titles and snippets
+            return {"study_links": self._format_search_results(response), "search_context": compact_search_results(response)}
+        
+        except Exception as e:
 
-            prompt = f"""
+            raise CustomException(e, sys)
 
-            Give me a study materials, youtube video links and general intro on the topic: {topic} from the subject: {subject} for the student of standard: {standard}.
+    @traced_node("generate_study_links")
+    async def _agenerate_study_links(self, state: AgentState) -> str:
 
-            """
+        try:
 
-            response = self.tool[0].invoke(prompt)
+            logging.info("Agent is generating study materials and general intro for the user...")
 
-            # Defensive check: Ensure response is a string
-            if not isinstance(response, str):
-                if isinstance(response, list):
-                    items = []
-                    for item in response:
-                        if isinstance(item, dict):
-                            items.append(f"{item.get('url', str(item))}")
-                        else:
-                            items.append(str(item))
-                    response = "\n".join(items)
-                else:
-                    response = str(response)
+            response = await self.tool[0].ainvoke(self._study_links_query(state))
 
             logging.info("Agent has generated study materials and general intro for the user...")
 
-            return {"study_links": response}
+            # The links are shown to the student as they are, the prompts get the compact titles and snippets
+            return {"study_links": self._format_search_results(response), "search_context": compact_search_results(response)}
         
         except Exception as e:
 
@@ -193,6 +284,23 @@ class AssistantAgent:
 
             return final_state["instructions"]
         
+        except Exception as e:
+
+            raise CustomException(e, sys)
+
+    async def arun(self, topic: str, subject: str, standard: int):
+
+        try:
+
+            logging.info("Running Manager Agent...")
+
+            initial_state = {"standard": standard, "subject": subject, "topic": topic}
+            final_state = await self.graph.ainvoke(input = initial_state)
+
+            logging.info("Manager Agent's work Finished...")
+
+            return final_state["instructions"]
+        
         except Exception as e:
 
             raise CustomException(e, sys)
\ No newline at end of file
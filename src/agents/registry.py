@@ -0,0 +1,114 @@
+from src.agents.assistant_agent import AssistantAgent
+from src.agents.tutoring_agent import TutoringAgent
+from src.agents.testing_agent import TestingAgent
+from src.rag import get_lesson_index
+from src.logger import logging
+import threading
+import time
+
+class AgentRegistry:
+
+    """
+    Process level registry that builds each agent once and shares it across requests.
+
+    Agents keep no per-request state (everything flows through the graph state), so one instance
+    each - with its compiled graph, ChatGroq clients and their HTTP connection pools - serves every
+    request. The TestingAgent scheduler being shared also makes its rate budgets process wide.
+    """
+
+    factories = {
+        "assistant": AssistantAgent,
+        "tutoring": lambda: TutoringAgent(lesson_index = get_lesson_index()),
+        "testing": TestingAgent
+    }
+
+    def __init__(self):
+
+        self.agents = {}
+        self.errors = {}
+        self.build_seconds = {}
+        self.lock = threading.Lock()
+
+    def get(self, name: str):
+
+        agent = self.agents.get(name)
+
+        if agent is not None:
+
+            return agent
+
+        with self.lock:
+
+            # Re-check under the lock, another thread may have built it meanwhile
+            if name not in self.agents:
+
+                started = time.perf_counter()
+
+                try:
+
+                    self.agents[name] = self.factories[name]()
+                    self.errors.pop(name, None)
+
+                except Exception as e:
+
+                    self.errors[name] = str(e)
+                    raise
+
+                self.build_seconds[name] = round(time.perf_counter() - started, 3)
+
+                logging.info(f"Built {name} agent in {self.build_seconds[name]}s")
+
+            return self.agents[name]
+
+    @property
+    def assistant(self) -> AssistantAgent:
+
+        return self.get("assistant")
+
+    @property
+    def tutor(self) -> TutoringAgent:
+
+        return self.get("tutoring")
+
+    @property
+    def tester(self) -> TestingAgent:
+
+        return self.get("testing")
+
+    def warm_up(self):
+
+        """Build every agent ahead of the first request; failures are recorded for health()."""
+
+        for name in self.factories:
+
+            try:
+
+                self.get(name)
+
+            except Exception as e:
+
+                logging.info(f"Warm-up of {name} agent failed: {e}")
+
+    def health(self) -> dict:
+
+        agents = {}
+
+        for name in self.factories:
+
+            if name in self.agents:
+
+                agents[name] = {"status": "ready", "build_seconds": self.build_seconds.get(name)}
+
+            elif name in self.errors:
+
+                agents[name] = {"status": "error", "error": self.errors[name]}
+
+            else:
+
+                agents[name] = {"status": "not_built"}
+
+        healthy = all(agent["status"] != "error" for agent in agents.values())
+
+        return {"status": "ok" if healthy else "degraded", "agents": agents}
+
+registry = AgentRegistry()
@@ -1,9 +1,17 @@
-from src.utils import get_llm_2, get_llm_lite_2
+from src.utils import get_llm_2, get_llm_lite_2, llm_cache_enabled
 from src.logger import logging
 from src.exception import CustomException
+from src.tracing import traced_node
+from src.scheduler import LLMClient, LLMScheduler
+from src.router import ModelRouter, routing_enabled, difficulty
+from src.prompting import count_tokens
 from langgraph.graph import StateGraph, END, START
+from langchain_core.runnables import RunnableLambda
+from concurrent.futures import Future
 from typing import TypedDict
+import asyncio
 import sys
+import os
 
 class AgentState(TypedDict):
 
@@ -12,10 +20,29 @@ class AgentState(TypedDict):
 
 class TestingAgent:
 
-    def __init__(self):
-
-        self.llm = get_llm_2()
-        self.llm_lite = get_llm_lite_2()
+    def __init__(self, use_cache: bool = None):
+
+        # Response caching is opt-in, see LLM_CACHE_AGENTS
+        use_cache = llm_cache_enabled("testing") if use_cache is None else use_cache
+        self.llm = get_llm_2(cached = use_cache)
+        self.llm_lite = get_llm_lite_2(cached = use_cache)
+        # With MODEL_ROUTER=1 each test is pinned to the 8B or 70B client by difficulty instead of going to whichever is free
+        self.router = ModelRouter("testing", small = ("llm", self.llm), large = ("llm_lite", self.llm_lite)) if routing_enabled() else None
+        # Both clients pull from one queue, each within its own concurrency cap and rate budget
+        self.scheduler = LLMScheduler([
+            LLMClient(
+                name = "llm_lite",
+                llm = self.llm_lite,
+                max_concurrency = int(os.getenv("TEST_CONCURRENCY_LITE", "4")),
+                requests_per_minute = int(os.getenv("TEST_RPM_LITE", "30"))
+            ),
+            LLMClient(
+                name = "llm",
+                llm = self.llm,
+                max_concurrency = int(os.getenv("TEST_CONCURRENCY", "4")),
+                requests_per_minute = int(os.getenv("TEST_RPM", "30"))
+            )
+        ], max_retries = int(os.getenv("TEST_MAX_RETRIES", "3")), router = self.router)
         self.graph = self._build_graph()
 
     def _build_graph(self):
@@ -23,13 +50,15 @@ class TestingAgent:
         graph = StateGraph(AgentState)
 
         # Graph Logic and Structure will go here
-        graph.add_node("generate_tests", self._generate_tests)
+        # graph.invoke runs the sync body, graph.ainvoke the async one
+        graph.add_node("generate_tests", RunnableLambda(self._generate_tests, afunc = self._agenerate_tests))
 
         graph.add_edge(START, "generate_tests")
         graph.add_edge("generate_tests", END)
 
         return graph.compile()
 
+    @traced_node("generate_tests")
     def _generate_tests(self, state: AgentState) -> dict:
 
         try:
@@ -37,32 +66,28 @@ class TestingAgent:
             logging.info("Testing Agent is generating tests with solutions...")
 
             lessons = state["lessons"]
-            tests = {}
             lesson_list = list(lessons.keys())
-            lessons_length = len(lesson_list)
 
-            # Common instructions for HTML formatting
-            formatting_instructions = """
-            IMPORTANT FORMATTING INSTRUCTIONS:
-            - Provide the output in strictly HTML format.
-            - Use <b> for questions and headers (e.g., <b>Question 1:</b>).
-            - Use <p> for the question body and solution text.
-            - Use <br> for line breaks where necessary.
-            - Do NOT use asterisks (*) or markdown.
-            - Make the solution and revision notes distinct using <p> tags.
-            """
+            prompts = [self._test_prompt(lesson) for lesson in lesson_list]
+            tests = dict(zip(lesson_list, self.scheduler.map(prompts)))
+
+            logging.info("Testing Agent has generated tests with solutions...")
+
+            return {"tests": tests}
+
+        except Exception as e:
 
-            for lesson in lesson_list[:lessons_length//2]:
+            raise CustomException(e, sys)
 
-                prompt = f"This is the lesson intro: {lesson}. Generate 1 test question as user's question paper along with its solutions based on those lessons in such a way that the lesson can be revised by the user after the test. {formatting_instructions}"
-                test = self.llm_lite.invoke(prompt)
-                tests[lesson] = test.content
+    @traced_node("generate_tests")
+    async def _agenerate_tests(self, state: AgentState) -> dict:
 
-            for lesson in lesson_list[lessons_length//2:]:
+        try:
 
-                prompt = f"This is the lesson intro: {lesson}. Generate 1 test question as user's question paper along with its solutions based on those lessons in such a way that the lesson can be revised by the user after the test. {formatting_instructions}"
-                test = self.llm.invoke(prompt)
-                tests[lesson] = test.content
+            logging.info("Testing Agent is generating tests with solutions...")
+
+            lesson_list = list(state["lessons"].keys())
+            tests = dict(zip(lesson_list, await asyncio.gather(*[self.agenerate(lesson) for lesson in lesson_list])))
 
             logging.info("Testing Agent has generated tests with solutions...")
 
@@ -72,6 +97,45 @@ class TestingAgent:
 
             raise CustomException(e, sys)
 
+    def submit(self, lesson: str, subject: str = None, standard: int = None, subtopics: list = None) -> Future:
+
+        """
+        Queue the test for a single lesson, so tests can start while later lessons are still being written.
+
+        subject, standard and the lesson's planned subtopics only feed the router's difficulty score.
+        """
+
+        prompt = self._test_prompt(lesson)
+        score = difficulty(subject, standard, len(subtopics or []), count_tokens(prompt)) if self.router is not None else 0.0
+
+        return self.scheduler.submit(prompt, score)
+
+    async def agenerate(self, lesson: str, subject: str = None, standard: int = None, subtopics: list = None) -> str:
+
+        """
+        Test for a single lesson, awaited on the event loop.
+
+        Goes through the same scheduler as submit(), so the rate budgets stay process wide; the caller
+        waits on the scheduler's future without holding a thread of its own.
+        """
+
+        return await asyncio.wrap_future(self.submit(lesson, subject, standard, subtopics))
+
+    def _test_prompt(self, lesson: str) -> str:
+
+        # Common instructions for HTML formatting
+        formatting_instructions = """
+        IMPORTANT FORMATTING INSTRUCTIONS:
+        - Provide the output in strictly HTML format.
+        - Use <b> for questions and headers (e.g., <b>Question 1:</b>).
+        - Use <p> for the question body and solution text.
+        - Use <br> for line breaks where necessary.
+        - Do NOT use asterisks (*) or markdown.
+        - Make the solution and revision notes distinct using <p> tags.
+        """
+
+        return f"This is the lesson intro: {lesson}. Generate 1 test question as user's question paper along with its solutions based on those lessons in such a way that the lesson can be revised by the user after the test. {formatting_instructions}"
+
     def run(self, lessons: dict):
 
         try:
@@ -85,6 +149,23 @@ class TestingAgent:
 
             return final_state["tests"]
 
+        except Exception as e:
+
+            raise CustomException(e, sys)
+
+    async def arun(self, lessons: dict):
+
+        try:
+
+            logging.info("Running Testing Agent...")
+
+            initial_state = {"lessons": lessons}
+            final_state = await self.graph.ainvoke(input = initial_state)
+
+            logging.info("Testing Agent's work Finished...")
+
+            return final_state["tests"]
+
         except Exception as e:
 
             raise CustomException(e, sys)
\ No newline at end of file
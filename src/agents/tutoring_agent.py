@@ -1,9 +1,36 @@
-from src.utils import get_llm_1, get_llm_lite_1
+from src.utils import get_llm_1, get_llm_lite_1, llm_cache_enabled
 from src.logger import logging
 from src.exception import CustomException
+from src.tracing import traced_node
+from src.prompting import fit, log_prompt, count_tokens
+from src.router import ModelRouter, routing_enabled, difficulty
+from src.lesson_plan import PLAN_FORMAT, parse_plan, lesson_title, subtopics_by_title, max_plan_lessons
 from langgraph.graph import StateGraph, END, START
+from langchain_core.runnables import RunnableLambda
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import TypedDict
+import contextvars
+import asyncio
 import sys
+import os
+import time
+import re
+
+# Fused answers wrap the two parts in these tags, HTML inside JSON strings breaks too easily
+_FUSED_SECTIONS = re.compile(r"<lesson>(.*?)</lesson>\s*<test>(.*?)(?:</test>|$)", re.DOTALL | re.IGNORECASE)
+
+def split_fused(text: str) -> tuple:
+
+    """(lesson, test) from a fused answer; test is None when the answer did not follow the format."""
+
+    match = _FUSED_SECTIONS.search(text)
+
+    if match is None or not match.group(2).strip():
+
+        # Keep whatever lesson there is, the caller falls back to the Testing Agent for the test
+        return re.sub(r"</?(lesson|test)>", "", text, flags = re.IGNORECASE).strip(), None
+
+    return match.group(1).strip(), match.group(2).strip()
 
 class AgentState(TypedDict):
 
@@ -13,13 +40,24 @@ class AgentState(TypedDict):
     topic: str
     lessons: dict
     plannings: str
+    plan: list
 
 class TutoringAgent:
 
-    def __init__(self):
-
-        self.llm_lite = get_llm_lite_1()
-        self.llm = get_llm_1()
+    def __init__(self, max_concurrency: int = None, max_retries: int = None, use_cache: bool = None, lesson_index = None):
+
+        # Response caching is opt-in, see LLM_CACHE_AGENTS
+        use_cache = llm_cache_enabled("tutoring") if use_cache is None else use_cache
+        self.llm_lite = get_llm_lite_1(cached = use_cache)
+        self.llm = get_llm_1(cached = use_cache)
+        # With MODEL_ROUTER=1 each lesson goes to the 8B or 70B model by difficulty, otherwise always the 8B one
+        self.router = ModelRouter("tutoring", small = ("llm", self.llm), large = ("llm_lite", self.llm_lite)) if routing_enabled() else None
+        # Number of lessons generated at once, 1 restores the old sequential behaviour
+        self.max_concurrency = max_concurrency or int(os.getenv("LESSON_CONCURRENCY", "8"))
+        # Attempts per lesson before the whole node fails
+        self.max_retries = max_retries or int(os.getenv("LESSON_MAX_RETRIES", "3"))
+        # Optional src.rag.LessonIndex, near-duplicate lessons from earlier courses are reused from it
+        self.lesson_index = lesson_index
         self.graph = self._build_graph()
 
     def _build_graph(self):
@@ -27,8 +65,9 @@ class TutoringAgent:
         graph = StateGraph(AgentState)
         
         # Graph Logic and Structure will go here
-        graph.add_node("get_lesson_plannings", self._get_lesson_plannings)
-        graph.add_node("get_lessons", self._get_lessons)
+        # Each node has a sync and an async body: graph.invoke runs the first, graph.ainvoke the second
+        graph.add_node("get_lesson_plannings", RunnableLambda(self._get_lesson_plannings, afunc = self._aget_lesson_plannings))
+        graph.add_node("get_lessons", RunnableLambda(self._get_lessons, afunc = self._aget_lessons))
 
         graph.add_edge(START, "get_lesson_plannings")
         graph.add_edge("get_lesson_plannings", "get_lessons")
@@ -36,67 +75,100 @@ class TutoringAgent:
         
         return graph.compile()
     
+    def _plannings_prompt(self, state: AgentState) -> str:
+
+        # The Assistant's instructions run to several KB, only their budgeted part is pasted in
+        instructions = fit("planning", instructions = state["instructions"])["instructions"]
+        standard = state["standard"]
+        subject = state["subject"]
+        topic = state["topic"]
+
+        prompt = f"""
+
+        You must read the instructions: {instructions} and plan the lessons step by step for the topic: {topic}, subject: {subject}, for the students of standard: {standard} and in comprehensive way so that even user will get time to be comfortable with the topics.
+        Make the length of the lessons for about 35-50 lessons depending on the topic and its difficulty level.
+        Never plan more than {max_plan_lessons()} lessons and never repeat a lesson.
+        Number the lessons chronologically and in a step by step manner, and for each one give its title and all the subtopics we will learn in that specific lesson.
+        Answer with only this JSON and nothing else, no markdown and no explanation:
+        {PLAN_FORMAT}
+
+        """
+
+        return prompt
+
+    @traced_node("get_lesson_plannings")
     def _get_lesson_plannings(self, state: AgentState) -> dict:
 
         try:
 
             logging.info("Planning Agent is generating lesson's planning...")
 
-            instructions = state["instructions"]
-            standard = state["standard"]
-            subject = state["subject"]
-            topic = state["topic"]
+            prompt = self._plannings_prompt(state)
+            log_prompt("planning", prompt)
+            response = self.llm_lite.invoke(prompt)
 
-            prompt = f"""
+            logging.info("Planning Agent has generated lesson's planning...")
 
-            You must read the instructions: {instructions} and plan the lessons step by step for the topic: {topic}, subject: {subject}, for the students of standard: {standard} and in comprehensive way so that even user will get time to be comfortable with the topics.
-            Make the length of the lessons for about 35-50 lessons depending on the topic and its difficulty level.
-            You must only generate the lessons and mark numbers to the lessons chronologically and in a step by step manner.
-            Dont write literally anything else, just write the lesson number, lesson title, all the topics we will learn in that specific lesson and thats it.
-            Just list down lessons in only this manner, no need to write anything else.
+            return {"plannings": response.content, "plan": parse_plan(response.content)}
 
-            """
+        except Exception as e:
 
-            response = self.llm_lite.invoke(prompt)
+            raise CustomException(e, sys)
+
+    @traced_node("get_lesson_plannings")
+    async def _aget_lesson_plannings(self, state: AgentState) -> dict:
+
+        try:
+
+            logging.info("Planning Agent is generating lesson's planning...")
+
+            prompt = self._plannings_prompt(state)
+            log_prompt("planning", prompt)
+            response = await self.llm_lite.ainvoke(prompt)
 
             logging.info("Planning Agent has generated lesson's planning...")
 
-            return {"plannings": response.content}
+            return {"plannings": response.content, "plan": parse_plan(response.content)}
 
         except Exception as e:
 
             raise CustomException(e, sys)
         
+    @traced_node("get_lessons")
     def _get_lessons(self, state: AgentState) -> dict:
 
         try:
 
             logging.info("Planning Agent is generating lessons...")
 
-            plannings = state["plannings"]
+            plan = state["plan"]
             topic = state["topic"]
-            lessons = {}
-            lesson_list = plannings.split("\n")
+            lesson_list = [lesson_title(entry) for entry in plan]
 
-            for lesson in lesson_list:
-    
-                prompt = f"""
-                
-                You must generate comprehensive and detailed lesson contents for the lesson: {lesson}
-                Make it in such a way that nothing else will be needed for the topic.
-                Also if the topic: {topic} is related to or closely depends upon mathematics, then make the lessons more mathematical and less theory based.
-
-                IMPORTANT FORMATTING INSTRUCTIONS:
-                - The output MUST be in HTML format.
-                - Use <h4> for section headers.
-                - Use <b> for bold text (do NOT use asterisks like **text**).
-                - Use <p> for paragraphs.
-                - Use <ul> and <li> for lists.
-                - Do NOT use Markdown.
-                
-                """
-                response = self.llm.invoke(prompt)
-                lessons[lesson] = response.content     
+            # Lessons finish out of order, so re-key them in planning order to keep the course sequence
+            generated = dict(self.stream_lessons(lesson_list, topic, state["subject"], state["standard"], subtopics_by_title(plan)))
+            lessons = {lesson: generated[lesson] for lesson in lesson_list}
+
+            logging.info("Planning Agent has generated lessons...")
+
+            return {"lessons": lessons}
+
+        except Exception as e:
+
+            raise CustomException(e, sys)
+
+    @traced_node("get_lessons")
+    async def _aget_lessons(self, state: AgentState) -> dict:
+
+        try:
+
+            logging.info("Planning Agent is generating lessons...")
+
+            plan = state["plan"]
+            lesson_list = [lesson_title(entry) for entry in plan]
+
+            generated = {title: content async for title, content in self.astream_lessons(lesson_list, state["topic"], state["subject"], state["standard"], subtopics_by_title(plan))}
+            lessons = {lesson: generated[lesson] for lesson in lesson_list}
 
             logging.info("Planning Agent has generated lessons...")
 
@@ -106,6 +178,268 @@ class TutoringAgent:
 
             raise CustomException(e, sys)
 
+    def plan_lessons(self, instructions: str, standard: int, subject: str, topic: str) -> list:
+
+        """The validated lesson plan, [{"number", "title", "subtopics"}] (see src.lesson_plan)."""
+
+        state = {"instructions": instructions, "standard": standard, "subject": subject, "topic": topic}
+
+        return self._get_lesson_plannings(state)["plan"]
+
+    async def aplan_lessons(self, instructions: str, standard: int, subject: str, topic: str) -> list:
+
+        state = {"instructions": instructions, "standard": standard, "subject": subject, "topic": topic}
+
+        return (await self._aget_lesson_plannings(state))["plan"]
+
+    def stream_lessons(self, lesson_list: list, topic: str, subject: str = None, standard: int = None, subtopics: dict = None):
+
+        """Yield (title, content) pairs as soon as each lesson finishes, in completion order."""
+
+        yield from self._stream(self._generate_lesson, lesson_list, topic, subject, standard, subtopics)
+
+    def stream_fused_lessons(self, lesson_list: list, topic: str, subject: str = None, standard: int = None, subtopics: dict = None):
+
+        """
+        Yield (title, content, test) with the lesson and its test written in one call.
+
+        test is None when the lesson was reused or the answer could not be split, the caller then
+        asks the Testing Agent for it.
+        """
+
+        for title, (content, test) in self._stream(self._generate_fused_lesson, lesson_list, topic, subject, standard, subtopics):
+
+            yield title, content, test
+
+    def _stream(self, generate, lesson_list: list, topic: str, subject: str = None, standard: int = None, subtopics: dict = None):
+
+        subtopics = subtopics or {}
+
+        # Each lesson is an independent call, so they are fanned out over a thread pool
+        with ThreadPoolExecutor(max_workers = max(1, self.max_concurrency)) as executor:
+
+            futures = {executor.submit(contextvars.copy_context().run, generate, lesson, topic, subject, standard, subtopics.get(lesson)): lesson for lesson in lesson_list}
+            error = None
+
+            for future in as_completed(futures):
+
+                # The other lessons still finish and are yielded (and checkpointed) before a failure is raised
+                if future.exception() is not None:
+
+                    error = error or future.exception()
+                    continue
+
+                yield futures[future], future.result()
+
+            if error is not None:
+
+                raise error
+
+    async def astream_lessons(self, lesson_list: list, topic: str, subject: str = None, standard: int = None, subtopics: dict = None):
+
+        """stream_lessons() on the event loop - lessons are coroutines capped by a semaphore, not threads."""
+
+        async for title, content in self._astream(self._agenerate_lesson, lesson_list, topic, subject, standard, subtopics):
+
+            yield title, content
+
+    async def astream_fused_lessons(self, lesson_list: list, topic: str, subject: str = None, standard: int = None, subtopics: dict = None):
+
+        """stream_fused_lessons() on the event loop."""
+
+        async for title, (content, test) in self._astream(self._agenerate_fused_lesson, lesson_list, topic, subject, standard, subtopics):
+
+            yield title, content, test
+
+    async def _astream(self, generate, lesson_list: list, topic: str, subject: str = None, standard: int = None, subtopics: dict = None):
+
+        subtopics = subtopics or {}
+        semaphore = asyncio.Semaphore(max(1, self.max_concurrency))
+
+        async def run(lesson):
+
+            async with semaphore:
+
+                return lesson, await generate(lesson, topic, subject, standard, subtopics.get(lesson))
+
+        tasks = [asyncio.ensure_future(run(lesson)) for lesson in lesson_list]
+
+        error = None
+
+        try:
+
+            for task in asyncio.as_completed(tasks):
+
+                # As in _stream(), a failed lesson is raised once the others are done
+                try:
+
+                    result = await task
+
+                except Exception as e:
+
+                    error = error or e
+                    continue
+
+                yield result
+
+            if error is not None:
+
+                raise error
+
+        finally:
+
+            # An abandoned stream must not leave the others running
+            for task in tasks:
+
+                task.cancel()
+
+    def _lesson_prompt(self, lesson: str, topic: str, subtopics: list = None) -> str:
+
+        # The subtopics the plan gave this lesson, so neighbouring lessons do not cover the same ground
+        covers = f"\n        The lesson must cover: {', '.join(subtopics)}" if subtopics else ""
+
+        prompt = f"""
+                
+        You must generate comprehensive and detailed lesson contents for the lesson: {lesson}{covers}
+        Make it in such a way that nothing else will be needed for the topic.
+        Also if the topic: {topic} is related to or closely depends upon mathematics, then make the lessons more mathematical and less theory based.
+
+        IMPORTANT FORMATTING INSTRUCTIONS:
+        - The output MUST be in HTML format.
+        - Use <h4> for section headers.
+        - Use <b> for bold text (do NOT use asterisks like **text**).
+        - Use <p> for paragraphs.
+        - Use <ul> and <li> for lists.
+        - Do NOT use Markdown.
+        
+        """
+
+        return prompt
+
+    def _fused_prompt(self, lesson: str, topic: str, subtopics: list = None) -> str:
+
+        prompt = f"""{self._lesson_prompt(lesson, topic, subtopics)}
+        After the lesson, also write 1 test question for this lesson along with its solution, in such a way that the lesson can be revised by the user after the test.
+        - Use <b> for questions and headers (e.g., <b>Question 1:</b>).
+        - Make the solution and revision notes distinct using <p> tags.
+
+        Wrap the lesson in <lesson></lesson> and the test in <test></test>, and write nothing outside them:
+        <lesson>...lesson HTML...</lesson>
+        <test>...test and solution HTML...</test>
+
+        """
+
+        return prompt
+
+    def _reuse_lesson(self, lesson: str, topic: str, subject: str = None, standard: int = None) -> str:
+
+        if self.lesson_index is not None and subject is not None:
+
+            return self.lesson_index.lookup(subject, standard, topic, lesson)
+
+        return None
+
+    def _generate_lesson(self, lesson: str, topic: str, subject: str = None, standard: int = None, subtopics: list = None) -> str:
+
+        reused = self._reuse_lesson(lesson, topic, subject, standard)
+
+        if reused is not None:
+
+            return reused
+
+        prompt = self._lesson_prompt(lesson, topic, subtopics)
+
+        return self._complete(prompt, self._difficulty(prompt, subject, standard, subtopics))
+
+    async def _agenerate_lesson(self, lesson: str, topic: str, subject: str = None, standard: int = None, subtopics: list = None) -> str:
+
+        reused = self._reuse_lesson(lesson, topic, subject, standard)
+
+        if reused is not None:
+
+            return reused
+
+        prompt = self._lesson_prompt(lesson, topic, subtopics)
+
+        return await self._acomplete(prompt, self._difficulty(prompt, subject, standard, subtopics))
+
+    def _generate_fused_lesson(self, lesson: str, topic: str, subject: str = None, standard: int = None, subtopics: list = None) -> tuple:
+
+        reused = self._reuse_lesson(lesson, topic, subject, standard)
+
+        if reused is not None:
+
+            return reused, None
+
+        prompt = self._fused_prompt(lesson, topic, subtopics)
+
+        return split_fused(self._complete(prompt, self._difficulty(prompt, subject, standard, subtopics)))
+
+    async def _agenerate_fused_lesson(self, lesson: str, topic: str, subject: str = None, standard: int = None, subtopics: list = None) -> tuple:
+
+        reused = self._reuse_lesson(lesson, topic, subject, standard)
+
+        if reused is not None:
+
+            return reused, None
+
+        prompt = self._fused_prompt(lesson, topic, subtopics)
+
+        return split_fused(await self._acomplete(prompt, self._difficulty(prompt, subject, standard, subtopics)))
+
+    def _difficulty(self, prompt: str, subject: str = None, standard: int = None, subtopics: list = None) -> float:
+
+        if self.router is None:
+
+            return 0.0
+
+        return difficulty(subject, standard, len(subtopics or []), count_tokens(prompt))
+
+    def _call(self, prompt: str, score: float):
+
+        return self.router.invoke(prompt, score) if self.router is not None else self.llm.invoke(prompt)
+
+    async def _acall(self, prompt: str, score: float):
+
+        return await self.router.ainvoke(prompt, score) if self.router is not None else await self.llm.ainvoke(prompt)
+
+    def _complete(self, prompt: str, score: float = 0.0) -> str:
+
+        # Only the failing lesson is retried, finished lessons are never regenerated
+        for attempt in range(1, self.max_retries + 1):
+
+            try:
+
+                response = self._call(prompt, score)
+                return response.content
+
+            except Exception as e:
+
+                if attempt == self.max_retries:
+
+                    raise
+
+                logging.info(f"Lesson generation failed (attempt {attempt}/{self.max_retries}): {e}")
+                time.sleep(2 ** (attempt - 1))
+
+    async def _acomplete(self, prompt: str, score: float = 0.0) -> str:
+
+        for attempt in range(1, self.max_retries + 1):
+
+            try:
+
+                response = await self._acall(prompt, score)
+                return response.content
+
+            except Exception as e:
+
+                if attempt == self.max_retries:
+
+                    raise
+
+                logging.info(f"Lesson generation failed (attempt {attempt}/{self.max_retries}): {e}")
+                await asyncio.sleep(2 ** (attempt - 1))
+
     def run(self, instructions: str, standard: int, subject: str, topic: str):
 
         try: 
@@ -119,6 +453,23 @@ class TutoringAgent:
 
             return final_state["lessons"]
 
+        except Exception as e:
+
+            raise CustomException(e, sys)
+
+    async def arun(self, instructions: str, standard: int, subject: str, topic: str):
+
+        try: 
+            
+            logging.info("Running Planning Agent...")
+
+            initial_state = {"instructions": instructions, "standard": standard, "subject": subject, "topic": topic}
+            final_state = await self.graph.ainvoke(input = initial_state)
+
+            logging.info("Planning Agent's work Finished...")
+
+            return final_state["lessons"]
+
         except Exception as e:
 
             raise CustomException(e, sys)
\ No newline at end of file
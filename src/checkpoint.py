@@ -0,0 +1,163 @@
+from src.logger import logging
+import sqlite3
+import json
+import time
+import os
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    item TEXT NOT NULL,
+    value TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (thread_id, item)
+);
+CREATE INDEX IF NOT EXISTS ix_checkpoints_updated_at ON checkpoints (updated_at);
+"""
+
+class CheckpointStore:
+
+    """
+    SQLite store of finished work items per generation thread (one thread per course).
+
+    Unlike a per-step graph checkpoint every lesson and test is its own item, written the moment
+    it finishes, so a generation that dies on lesson 42 resumes with 41 lessons already done.
+    """
+
+    def __init__(self, path: str, ttl: float):
+
+        self.path = path
+        self.ttl = ttl
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+
+        conn = self._connect()
+
+        try:
+
+            conn.executescript(SCHEMA)
+
+        finally:
+
+            conn.close()
+
+        self.purge()
+
+    def _connect(self) -> sqlite3.Connection:
+
+        conn = sqlite3.connect(self.path, timeout = 30)
+        conn.execute("PRAGMA journal_mode=WAL")
+
+        return conn
+
+    def load(self, thread_id: str) -> dict:
+
+        conn = self._connect()
+
+        try:
+
+            rows = conn.execute("SELECT item, value FROM checkpoints WHERE thread_id = ?", (thread_id,)).fetchall()
+
+        finally:
+
+            conn.close()
+
+        return {item: json.loads(value) for item, value in rows}
+
+    def save(self, thread_id: str, item: str, value):
+
+        conn = self._connect()
+
+        try:
+
+            with conn:
+
+                conn.execute(
+                    "INSERT OR REPLACE INTO checkpoints (thread_id, item, value, updated_at) VALUES (?, ?, ?, ?)",
+                    (thread_id, item, json.dumps(value), time.time())
+                )
+
+        finally:
+
+            conn.close()
+
+    def clear(self, thread_id: str):
+
+        conn = self._connect()
+
+        try:
+
+            with conn:
+
+                conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+
+        finally:
+
+            conn.close()
+
+    def purge(self):
+
+        # Threads nobody resumed within the TTL are abandoned
+        conn = self._connect()
+
+        try:
+
+            with conn:
+
+                removed = conn.execute("DELETE FROM checkpoints WHERE updated_at < ?", (time.time() - self.ttl,)).rowcount
+
+        finally:
+
+            conn.close()
+
+        if removed:
+
+            logging.info(f"Purged {removed} abandoned checkpoint items")
+
+    def thread(self, thread_id: str) -> "Checkpoint":
+
+        return Checkpoint(self, thread_id)
+
+class Checkpoint:
+
+    """The checkpoint of one generation thread, loaded once and written through item by item."""
+
+    def __init__(self, store: CheckpointStore, thread_id: str):
+
+        self.store = store
+        self.thread_id = thread_id
+        self.items = store.load(thread_id)
+
+        if self.items:
+
+            logging.info(f"Resuming {thread_id} from {len(self.items)} checkpointed items")
+
+    def get(self, item: str):
+
+        return self.items.get(item)
+
+    def put(self, item: str, value):
+
+        self.items[item] = value
+        self.store.save(self.thread_id, item, value)
+
+    def clear(self):
+
+        self.items = {}
+        self.store.clear(self.thread_id)
+
+class NullCheckpoint:
+
+    """Checkpoint that remembers nothing, for generations run without a store."""
+
+    def get(self, item: str):
+
+        return None
+
+    def put(self, item: str, value):
+
+        pass
+
+    def clear(self):
+
+        pass
@@ -0,0 +1,358 @@
+from sqlalchemy.types import TypeDecorator, LargeBinary
+from sqlalchemy import select, insert, update
+from collections import Counter
+from datetime import datetime
+from src.logger import logging
+import threading
+import struct
+import zlib
+import time
+import re
+import os
+
+try:
+
+    import zstandard
+
+except ImportError:
+
+    zstandard = None
+
+# Stored values start with a codec byte and a 4 byte dictionary id (0 = no dictionary)
+RAW, ZLIB, ZSTD = b"r", b"z", b"s"
+HEADER = struct.Struct(">cI")
+
+# zlib only looks back 32 KB, so a larger preset dictionary would be wasted
+DICTIONARY_SIZE = 32 * 1024
+
+class Dictionaries:
+
+    """
+    Shared compression dictionaries, stored in the database with a local copy in a directory.
+
+    Rows name the dictionary they were compressed with, so old dictionaries stay readable after a new
+    one is trained. Every host sharing the database can read them: a dictionary missing from the local
+    directory (another host trained it, or this is a fresh checkout) is fetched from the table once
+    and kept as a file. The active id is kept in memory and looked up again every `reload_interval`
+    seconds, so a dictionary trained by another process is picked up.
+    """
+
+    def __init__(self, directory: str = None, reload_interval: float = None):
+
+        self.directory = directory
+        self.reload_interval = reload_interval if reload_interval is not None else float(os.getenv("COMPRESSION_DICT_RELOAD_SECONDS", "5"))
+        self.engine = None
+        self.table = None
+        self.loaded = {}
+        self.active_id = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+
+        """Store dictionaries in the app's database, with the local copy in the instance folder (or COMPRESSION_DICT_DIR)."""
+
+        from src.models import db, CompressionDictionary
+
+        self.directory = os.getenv("COMPRESSION_DICT_DIR") or os.path.join(app.instance_path, "dictionaries")
+        self.table = CompressionDictionary.__table__
+
+        with app.app_context():
+
+            self.engine = db.engine
+
+        with self.lock:
+
+            self.active_id = None
+
+    def _path(self, name: str) -> str:
+
+        if self.directory is None:
+
+            raise RuntimeError("Compression dictionaries have no directory, call dictionaries.init_app(app) first")
+
+        return os.path.join(self.directory, name)
+
+    def _read_file(self, dictionary_id: int) -> bytes:
+
+        try:
+
+            with open(self._path(f"{dictionary_id:08x}.dict"), "rb") as f:
+
+                return f.read()
+
+        except FileNotFoundError:
+
+            return None
+
+    def _write_file(self, dictionary_id: int, data: bytes):
+
+        # Written aside and renamed, so a concurrent reader never sees half a dictionary
+        os.makedirs(self.directory, exist_ok = True)
+        path = self._path(f"{dictionary_id:08x}.dict")
+
+        with open(f"{path}.{os.getpid()}.tmp", "wb") as f:
+
+            f.write(data)
+
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+
+    def _read_row(self, dictionary_id: int) -> bytes:
+
+        if self.engine is None:
+
+            return None
+
+        with self.engine.connect() as conn:
+
+            return conn.execute(select(self.table.c.data).where(self.table.c.id == dictionary_id)).scalar()
+
+    def get(self, dictionary_id: int) -> bytes:
+
+        with self.lock:
+
+            if dictionary_id in self.loaded:
+
+                return self.loaded[dictionary_id]
+
+        data = self._read_file(dictionary_id)
+
+        if data is None:
+
+            data = self._read_row(dictionary_id)
+
+            if data is None:
+
+                raise LookupError(f"Compression dictionary {dictionary_id:08x} is neither in the database nor in {self.directory}")
+
+            self._write_file(dictionary_id, data)
+
+        with self.lock:
+
+            self.loaded[dictionary_id] = data
+
+        return data
+
+    def active(self) -> int:
+
+        """Id of the dictionary new values are compressed with, 0 if none was trained."""
+
+        if self.engine is None:
+
+            return 0
+
+        now = time.monotonic()
+
+        with self.lock:
+
+            if self.active_id is not None and now - self.checked_at < self.reload_interval:
+
+                return self.active_id
+
+        with self.engine.connect() as conn:
+
+            active_id = conn.execute(select(self.table.c.id).where(self.table.c.active.is_(True))).scalar()
+
+        with self.lock:
+
+            self.active_id = active_id or 0
+            self.checked_at = now
+
+            return self.active_id
+
+    def add(self, data: bytes, activate: bool = True) -> int:
+
+        dictionary_id = zlib.crc32(data) or 1
+
+        if self.engine is None:
+
+            raise RuntimeError("Compression dictionaries have no database, call dictionaries.init_app(app) first")
+
+        with self.engine.begin() as conn:
+
+            if conn.execute(select(self.table.c.id).where(self.table.c.id == dictionary_id)).scalar() is None:
+
+                conn.execute(insert(self.table).values(id = dictionary_id, data = data, active = False, created_at = datetime.utcnow()))
+
+            if activate:
+
+                conn.execute(update(self.table).values(active = self.table.c.id == dictionary_id))
+
+        self._write_file(dictionary_id, data)
+
+        with self.lock:
+
+            self.loaded[dictionary_id] = data
+
+            if activate:
+
+                self.active_id = dictionary_id
+                self.checked_at = time.monotonic()
+
+        return dictionary_id
+
+    def import_files(self) -> int:
+
+        """Store dictionaries that so far only exist as local files (trained before they were kept in the database)."""
+
+        if self.directory is None or not os.path.isdir(self.directory):
+
+            return 0
+
+        with self.engine.begin() as conn:
+
+            stored = set(conn.execute(select(self.table.c.id)).scalars())
+            imported = 0
+
+            for name in sorted(os.listdir(self.directory)):
+
+                if not re.fullmatch(r"[0-9a-f]{8}\.dict", name) or int(name[:8], 16) in stored:
+
+                    continue
+
+                with open(self._path(name), "rb") as f:
+
+                    conn.execute(insert(self.table).values(id = int(name[:8], 16), data = f.read(), active = False, created_at = datetime.utcnow()))
+
+                imported += 1
+
+            # The active dictionary used to be named by an `active` file
+            if os.path.exists(self._path("active")) and conn.execute(select(self.table.c.id).where(self.table.c.active.is_(True))).scalar() is None:
+
+                with open(self._path("active")) as f:
+
+                    active_id = int(f.read().strip(), 16)
+
+                conn.execute(update(self.table).values(active = self.table.c.id == active_id))
+
+        with self.lock:
+
+            self.active_id = None
+
+        return imported
+
+# The database and local directory are set by init_database() through init_app()
+dictionaries = Dictionaries(os.getenv("COMPRESSION_DICT_DIR"))
+
+def _codec() -> bytes:
+
+    if os.getenv("COMPRESSION_CODEC", "zlib").lower() == "zstd" and zstandard is not None:
+
+        return ZSTD
+
+    return ZLIB
+
+def compress(text: str, dictionary_id: int = None) -> bytes:
+
+    data = text.encode("utf-8")
+    dictionary_id = dictionaries.active() if dictionary_id is None else dictionary_id
+    zdict = dictionaries.get(dictionary_id) if dictionary_id else None
+    codec = _codec()
+
+    if codec == ZSTD:
+
+        params = {"dict_data": zstandard.ZstdCompressionDict(zdict, dict_type = zstandard.DICT_TYPE_RAWCONTENT)} if zdict else {}
+        compressed = zstandard.ZstdCompressor(level = 9, **params).compress(data)
+
+    else:
+
+        compressor = zlib.compressobj(9, zdict = zdict) if zdict else zlib.compressobj(9)
+        compressed = compressor.compress(data) + compressor.flush()
+
+    # Short values can grow when compressed
+    if len(compressed) >= len(data):
+
+        return HEADER.pack(RAW, 0) + data
+
+    return HEADER.pack(codec, dictionary_id) + compressed
+
+def decompress(value: bytes) -> str:
+
+    codec, dictionary_id = HEADER.unpack_from(value)
+    payload = value[HEADER.size:]
+    zdict = dictionaries.get(dictionary_id) if dictionary_id else None
+
+    if codec == ZLIB:
+
+        decompressor = zlib.decompressobj(zdict = zdict) if zdict else zlib.decompressobj()
+        payload = decompressor.decompress(payload) + decompressor.flush()
+
+    elif codec == ZSTD:
+
+        if zstandard is None:
+
+            raise RuntimeError("Value is zstd compressed but the zstandard package is not installed")
+
+        params = {"dict_data": zstandard.ZstdCompressionDict(zdict, dict_type = zstandard.DICT_TYPE_RAWCONTENT)} if zdict else {}
+        payload = zstandard.ZstdDecompressor(**params).decompress(payload)
+
+    return payload.decode("utf-8")
+
+def train_dictionary(samples: list, size: int = DICTIONARY_SIZE) -> bytes:
+
+    """
+    Preset dictionary of the markup and phrases that recur across samples.
+
+    Fragments (tags and the text between them) are scored by how many samples contain them times their
+    length; the best ones fill the dictionary, most valuable last since zlib favours near matches.
+    """
+
+    counts = Counter()
+
+    for sample in samples:
+
+        counts.update(set(fragment for fragment in re.split(r"(<[^>]{1,200}>|\n)", sample) if 3 <= len(fragment) <= 400))
+
+    scored = sorted(
+        ((count * len(fragment), fragment) for fragment, count in counts.items() if count > 1),
+        reverse = True
+    )
+    chosen = []
+    total = 0
+
+    for score, fragment in scored:
+
+        encoded = fragment.encode("utf-8")
+
+        if total + len(encoded) > size:
+
+            continue
+
+        chosen.append(encoded)
+        total += len(encoded)
+
+    return b"".join(reversed(chosen))
+
+class CompressedText(TypeDecorator):
+
+    """
+    Text column stored compressed (zlib, or zstd with COMPRESSION_CODEC=zstd), optionally with a shared dictionary.
+
+    Values written before the column was compressed are still plain TEXT in SQLite and are read as is.
+    """
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+
+        if value is None:
+
+            return None
+
+        return compress(value)
+
+    def process_result_value(self, value, dialect):
+
+        if value is None or isinstance(value, str):
+
+            return value
+
+        return decompress(bytes(value))
+
+def log_ratio(label: str, before: int, after: int):
+
+    ratio = before / after if after else 0.0
+    logging.info(f"{label}: {before} bytes -> {after} bytes (ratio {ratio:.2f}x)")
+
+    return ratio
@@ -0,0 +1,193 @@
+from src.models import db, Course, CourseContent
+from src.logger import logging
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
+import os
+
+# Bump whenever prompts or agents change, so content generated by the old pipeline is no longer reused
+CACHE_VERSION = 1
+
+def normalize(text: str) -> str:
+
+    return " ".join(str(text).lower().split())
+
+def cache_key(topic: str, subject: str, standard: int) -> str:
+
+    return f"v{CACHE_VERSION}:{int(standard)}:{normalize(subject)}:{normalize(topic)}"
+
+class CourseCache:
+
+    """
+    Cross-user cache of generated course content keyed on normalised (topic, subject, standard).
+
+    Entries expire after `ttl`, and beyond `max_entries` the least recently used ones are evicted.
+    Expired or evicted content is only detached from the cache - courses already linked to it keep it.
+    The unique cache key doubles as a single-flight lock: the first request inserts a 'generating'
+    row and starts the job, every concurrent identical request links to that row and waits on it.
+
+    A hit is written by the caller's commit that links its course, and last_used_at only moves once
+    `touch_interval` has passed. Detached content no course links to is deleted once it has been
+    unused for `orphan_grace`, so a request that hit it a moment before it was evicted can still link it.
+
+    A 'generating' reservation is only waited on while its job on `jobs` is queued or running, and for
+    at most `reservation_timeout` (the queue's stale_after); one whose job was never submitted is given
+    up after `submit_grace`. An abandoned reservation is marked failed and detached, so the next
+    request reserves the course again instead of linking to one that never finishes.
+    """
+
+    def __init__(self, ttl: timedelta = None, max_entries: int = None, touch_interval: timedelta = None, orphan_grace: timedelta = None,
+                 jobs = None, reservation_timeout: timedelta = None, submit_grace: timedelta = None):
+
+        self.ttl = ttl or timedelta(days = int(os.getenv("COURSE_CACHE_TTL_DAYS", "30")))
+        self.max_entries = max_entries or int(os.getenv("COURSE_CACHE_MAX_ENTRIES", "1000"))
+        self.touch_interval = touch_interval or timedelta(seconds = int(os.getenv("COURSE_CACHE_TOUCH_SECONDS", "60")))
+        self.orphan_grace = orphan_grace or timedelta(seconds = int(os.getenv("COURSE_CACHE_ORPHAN_GRACE_SECONDS", "3600")))
+        self.jobs = jobs
+        self.reservation_timeout = reservation_timeout or timedelta(seconds = jobs.stale_after if jobs is not None else 1800)
+        self.submit_grace = submit_grace or timedelta(seconds = int(os.getenv("COURSE_CACHE_SUBMIT_GRACE_SECONDS", "60")))
+
+    def get_or_reserve(self, topic: str, subject: str, standard: int):
+
+        """
+        Return (content, created). When created is True the caller must start generation for it.
+
+        The caller links a course to the content and commits, which also records the hit.
+        """
+
+        key = cache_key(topic, subject, standard)
+        content = CourseContent.query.filter_by(cache_key = key).first()
+
+        if content is not None and not self.usable(content):
+
+            self._detach(content)
+            content = None
+
+        if content is not None:
+
+            self._touch(content)
+
+            return content, False
+
+        content = CourseContent(
+            cache_key = key,
+            version = CACHE_VERSION,
+            topic = topic,
+            subject = subject,
+            standard = int(standard),
+            status = 'generating'
+        )
+
+        try:
+
+            db.session.add(content)
+            db.session.commit()
+
+        except IntegrityError:
+
+            # Another request reserved the same key first, so wait on its generation instead
+            db.session.rollback()
+            content = CourseContent.query.filter_by(cache_key = key).first()
+            self._touch(content)
+
+            return content, False
+
+        logging.info(f"Course cache miss for {key}")
+
+        self._evict()
+
+        return content, True
+
+    def usable(self, content: CourseContent) -> bool:
+
+        """Whether `content` may still be served from the cache; the lesson index reuses only such content."""
+
+        if content.status == 'failed':
+
+            return False
+
+        if content.status == 'generating':
+
+            return self.reservation_alive(content)
+
+        return datetime.utcnow() - content.created_at < self.ttl
+
+    def reservation_alive(self, content: CourseContent) -> bool:
+
+        """Whether generation of 'generating' content is still expected to finish."""
+
+        age = datetime.utcnow() - content.created_at
+
+        if age >= self.reservation_timeout:
+
+            return False
+
+        if content.job_id is None:
+
+            # The reserving request submits the job right after committing the reservation
+            return age < self.submit_grace
+
+        if self.jobs is None:
+
+            return True
+
+        job = self.jobs.get(content.job_id)
+
+        return job is not None and job["status"] in ('queued', 'running')
+
+    def _touch(self, content: CourseContent):
+
+        # No commit of its own: the caller commits the course it links, in the same transaction
+        now = datetime.utcnow()
+
+        if content.last_used_at is None or now - content.last_used_at >= self.touch_interval:
+
+            content.last_used_at = now
+
+        content.hits = (content.hits or 0) + 1
+
+        logging.info(f"Course cache hit for {content.cache_key}")
+
+    def _detach(self, content: CourseContent):
+
+        if content.status == 'generating':
+
+            # Courses linked to an abandoned reservation stop waiting on it
+            logging.info(f"Course cache reservation {content.cache_key} abandoned (job {content.job_id})")
+            content.status = 'failed'
+
+        content.cache_key = None
+        db.session.commit()
+
+    def _evict(self):
+
+        cached = CourseContent.query.filter(CourseContent.cache_key.isnot(None))
+        overflow = cached.count() - self.max_entries
+
+        if overflow > 0:
+
+            victims = (cached.filter(CourseContent.status != 'generating')
+                       .order_by(CourseContent.last_used_at.asc())
+                       .limit(overflow).all())
+
+            for content in victims:
+
+                content.cache_key = None
+
+            db.session.commit()
+
+            logging.info(f"Course cache evicted {len(victims)} entries")
+
+        # Detached content that no course links to any more is dead weight. Recently used rows are
+        # spared: a concurrent hit may not have committed the course that links it yet
+        orphans = CourseContent.query.filter(
+            CourseContent.cache_key.is_(None),
+            CourseContent.status != 'generating',
+            CourseContent.last_used_at < datetime.utcnow() - self.orphan_grace,
+            ~db.session.query(Course.id).filter(Course.content_id == CourseContent.id).exists()
+        )
+
+        for content in orphans.all():
+
+            db.session.delete(content)
+
+        db.session.commit()
@@ -0,0 +1,126 @@
+from sqlalchemy import event
+from src.models import db
+from src.compression import dictionaries
+from src.logger import logging
+from contextlib import contextmanager
+import os
+
+try:
+
+    import fcntl
+
+except ImportError:
+
+    # Windows - Windows servers (e.g. waitress) run a single process, so there is no one to lock out
+    fcntl = None
+
+def engine_options(uri: str) -> dict:
+
+    """Engine options for the configured database; pool sizes come from DB_POOL_SIZE / DB_MAX_OVERFLOW."""
+
+    if uri.startswith("sqlite") and (uri.rstrip("/") == "sqlite:" or ":memory:" in uri):
+
+        # In-memory databases live in a single connection, there is no pool to size
+        return {}
+
+    options = {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "20")),
+        "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "30"))
+    }
+
+    if uri.startswith("sqlite"):
+
+        # Connections are handed between the request thread and job worker threads
+        options["connect_args"] = {"check_same_thread": False, "timeout": _busy_timeout() / 1000}
+
+    else:
+
+        # Servers drop idle connections, SQLite files do not
+        options["pool_pre_ping"] = True
+        options["pool_recycle"] = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+    return options
+
+def _busy_timeout() -> int:
+
+    return int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "30000"))
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+
+    cursor = dbapi_connection.cursor()
+
+    try:
+
+        # WAL lets readers run alongside the single writer; NORMAL only syncs at checkpoints in WAL mode,
+        # which is still crash safe for the database file
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={_busy_timeout()}")
+
+    finally:
+
+        cursor.close()
+
+def init_database(app):
+
+    """
+    Configure and bind the models' database to the app.
+
+    The URI comes from DATABASE_URL (default: users.db in the instance folder), so the same models can
+    run against another engine. SQLite connections get WAL, synchronous=NORMAL and a busy timeout, so
+    concurrent gunicorn workers wait for the write lock instead of failing with "database is locked".
+    Compressed columns keep their shared dictionaries in this database, cached in the instance folder.
+    """
+
+    uri = os.getenv("DATABASE_URL", "sqlite:///users.db")
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(uri))
+
+    db.init_app(app)
+    dictionaries.init_app(app)
+
+    with app.app_context():
+
+        if db.engine.dialect.name == "sqlite":
+
+            event.listen(db.engine, "connect", _set_sqlite_pragmas)
+
+        logging.info(f"Database engine {db.engine.dialect.name} with pool {db.engine.pool.status()}")
+
+@contextmanager
+def _schema_lock(app):
+
+    # Workers of one deployment start together; only one may create tables and run migrations at a time
+    if fcntl is None:
+
+        yield
+        return
+
+    os.makedirs(app.instance_path, exist_ok = True)
+
+    with open(os.path.join(app.instance_path, "schema.lock"), "w") as lock_file:
+
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        try:
+
+            yield
+
+        finally:
+
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def init_schema(app, *migrations):
+
+    """Create missing tables, then run each migration in order - one process at a time."""
+
+    with app.app_context(), _schema_lock(app):
+
+        db.create_all()
+
+        for migration in migrations:
+
+            migration()
@@ -0,0 +1,30 @@
+from src.logger import logging
+from concurrent.futures import Future
+import threading
+import asyncio
+
+_loop = None
+_loop_lock = threading.Lock()
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+
+    """Process wide event loop, run forever on a daemon thread and shared by every async course generation."""
+
+    global _loop
+
+    with _loop_lock:
+
+        if _loop is None:
+
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target = _loop.run_forever, name = "event-loop", daemon = True).start()
+
+            logging.info("Shared event loop started")
+
+        return _loop
+
+def run_coroutine(coroutine) -> Future:
+
+    """Schedule a coroutine on the shared loop from any thread."""
+
+    return asyncio.run_coroutine_threadsafe(coroutine, get_event_loop())
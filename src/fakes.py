@@ -0,0 +1,207 @@
+from langchain_core.messages import AIMessage
+import threading
+import json
+import asyncio
+import random
+import zlib
+import math
+import time
+import os
+
+class RateLimitError(Exception):
+
+    """Stand-in for Groq's 429, recognised by the key pool and the scheduler's retries like the real one."""
+
+    status_code = 429
+
+    def __init__(self, retry_after: float):
+
+        super().__init__(f"Rate limit reached (simulated), retry after {retry_after:.1f}s")
+        self.response = type("Response", (), {"headers": {"retry-after": str(retry_after)}})()
+
+class ServiceError(Exception):
+
+    """Stand-in for a failed Groq or Tavily call (5xx, timeout, ...)."""
+
+    status_code = 503
+
+class FakeProfile:
+
+    """
+    Simulated backend behaviour, read from the environment so benchmarks can vary it per run:
+
+    FAKE_LATENCY_MS        median time to first token (log-normal, spread FAKE_LATENCY_SIGMA)
+    FAKE_TOKENS_PER_SECOND output rate after the first token
+    FAKE_OUTPUT_TOKENS     length of each generated answer
+    FAKE_RATE_LIMIT_RATE   share of calls answered with a 429
+    FAKE_FAILURE_RATE      share of calls that fail outright
+    FAKE_PLAN_LESSONS      number of lessons in a generated plan
+    FAKE_SEED              seed for reproducible runs
+    """
+
+    def __init__(self):
+
+        self.latency_ms = float(os.getenv("FAKE_LATENCY_MS", "600"))
+        self.latency_sigma = float(os.getenv("FAKE_LATENCY_SIGMA", "0.4"))
+        self.tokens_per_second = float(os.getenv("FAKE_TOKENS_PER_SECOND", "400"))
+        self.output_tokens = int(os.getenv("FAKE_OUTPUT_TOKENS", "500"))
+        self.rate_limit_rate = float(os.getenv("FAKE_RATE_LIMIT_RATE", "0"))
+        self.failure_rate = float(os.getenv("FAKE_FAILURE_RATE", "0"))
+        self.plan_lessons = int(os.getenv("FAKE_PLAN_LESSONS", "40"))
+        self.search_latency_ms = float(os.getenv("FAKE_SEARCH_LATENCY_MS", "900"))
+        self.random = random.Random(int(os.getenv("FAKE_SEED", "0")) or None)
+        self.lock = threading.Lock()
+
+    def _draw(self) -> tuple:
+
+        with self.lock:
+
+            return self.random.random(), self.random.random(), self.random.gauss(0, 1)
+
+    def outcome(self, output_tokens: int, latency_ms: float = None) -> tuple:
+
+        """(seconds the call takes, exception to raise or None)."""
+
+        roll_limit, roll_failure, noise = self._draw()
+        latency_ms = self.latency_ms if latency_ms is None else latency_ms
+        first_token = latency_ms / 1000 * math.exp(self.latency_sigma * noise)
+
+        if roll_limit < self.rate_limit_rate:
+
+            return first_token / 4, RateLimitError(retry_after = 1.0)
+
+        if roll_failure < self.failure_rate:
+
+            return first_token, ServiceError("Service unavailable (simulated)")
+
+        return first_token + output_tokens / self.tokens_per_second, None
+
+class CallStats:
+
+    """Per-process call counters, so a benchmark can report calls per course."""
+
+    def __init__(self):
+
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def record(self, name: str):
+
+        with self.lock:
+
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def snapshot(self) -> dict:
+
+        with self.lock:
+
+            return dict(self.counts)
+
+profile = FakeProfile()
+stats = CallStats()
+
+def _prompt_text(prompt) -> str:
+
+    return prompt if isinstance(prompt, str) else " ".join(str(getattr(message, "content", message)) for message in prompt)
+
+class FakeChatModel:
+
+    """Local ChatGroq stand-in with simulated latency, output rate, 429s and failures. Selected with LLM_BACKEND=fake."""
+
+    def __init__(self, model: str, temperature: float = 0.1, **kwargs):
+
+        self.model_name = model
+        self.temperature = temperature
+
+    def _answer(self, prompt) -> AIMessage:
+
+        text = _prompt_text(prompt)
+        answer = self._content(text)
+        # Rough 4 characters per token, enough for the token metrics to move
+        usage = {"input_tokens": len(text) // 4, "output_tokens": len(answer) // 4}
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+
+        return AIMessage(content = answer, usage_metadata = usage)
+
+    def _content(self, text: str) -> str:
+
+        if "plan the lessons" in text:
+
+            lessons = [
+                {"number": number, "title": f"Part {number} of the topic", "subtopics": ["key ideas", "worked examples"]}
+                for number in range(1, profile.plan_lessons + 1)
+            ]
+
+            return json.dumps({"lessons": lessons})
+
+        # Distinct per prompt, so caches and de-duplication behave as they would with real answers
+        body = f"<p>Simulated answer {zlib.crc32(text.encode('utf-8')) % 100000}.</p>"
+
+        if "<lesson></lesson>" in text:
+
+            # Fused lesson and test, the output budget shared between the two
+            half = "<p>" + "lorem " * (profile.output_tokens // 2) + "</p>"
+
+            return f"<lesson>{body}{half}</lesson>\n<test><b>Question 1:</b>{half}</test>"
+
+        return body + "<p>" + "lorem " * profile.output_tokens + "</p>"
+
+    def invoke(self, prompt, *args, **kwargs):
+
+        stats.record(f"llm:{self.model_name}")
+        seconds, error = profile.outcome(profile.output_tokens)
+        time.sleep(seconds)
+
+        if error is not None:
+
+            raise error
+
+        return self._answer(prompt)
+
+    async def ainvoke(self, prompt, *args, **kwargs):
+
+        stats.record(f"llm:{self.model_name}")
+        seconds, error = profile.outcome(profile.output_tokens)
+        await asyncio.sleep(seconds)
+
+        if error is not None:
+
+            raise error
+
+        return self._answer(prompt)
+
+class FakeSearch:
+
+    """Local TavilySearch stand-in returning a fixed list of results after a simulated delay."""
+
+    def __init__(self, **kwargs):
+
+        self.max_results = kwargs.get("max_results", 5)
+
+    def _results(self, query: str) -> list:
+
+        return [{"url": f"https://example.com/{zlib.crc32(query.encode('utf-8')) % 1000}/{index}", "title": f"Result {index}"} for index in range(self.max_results)]
+
+    def invoke(self, query, *args, **kwargs):
+
+        stats.record("search")
+        seconds, error = profile.outcome(0, profile.search_latency_ms)
+        time.sleep(seconds)
+
+        if error is not None:
+
+            raise error
+
+        return self._results(str(query))
+
+    async def ainvoke(self, query, *args, **kwargs):
+
+        stats.record("search")
+        seconds, error = profile.outcome(0, profile.search_latency_ms)
+        await asyncio.sleep(seconds)
+
+        if error is not None:
+
+            raise error
+
+        return self._results(str(query))
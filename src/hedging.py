@@ -0,0 +1,327 @@
+from src.logger import logging
+from src.tracing import metrics
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque
+import contextvars
+import threading
+import asyncio
+import time
+import os
+
+def hedging_enabled() -> bool:
+
+    """LLM_HEDGING=1 wraps every chat client in a HedgedLLM."""
+
+    return os.getenv("LLM_HEDGING", "0") == "1"
+
+class LatencyTracker:
+
+    """Rolling window of call latencies, answering "how long does a slow call take" for the hedge delay."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+
+        self.samples = deque(maxlen = window)
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float):
+
+        with self.lock:
+
+            self.samples.append(seconds)
+
+    def percentile(self, share: float) -> float:
+
+        """Latency under which `share` of recent calls finished, or None until enough calls were seen."""
+
+        with self.lock:
+
+            if len(self.samples) < self.min_samples:
+
+                return None
+
+            ordered = sorted(self.samples)
+
+        return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+class HedgeBudget:
+
+    """
+    Caps hedges at a share of calls: every call earns `ratio` of a hedge, up to `burst` saved up.
+
+    With ratio 0.1 at most about one call in ten is ever duplicated, however slow the backend gets,
+    so hedging cannot double the load on a model that is already struggling. An attempt that lost the
+    race but could not be cancelled still holds its share until it finishes (see track()), so slow
+    losers piling up stop new hedges too.
+    """
+
+    def __init__(self, ratio: float, burst: float = 10.0):
+
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+        self.outstanding = 0
+        self.lock = threading.Lock()
+
+    def earn(self):
+
+        with self.lock:
+
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def available(self) -> bool:
+
+        with self.lock:
+
+            return self.tokens - self.outstanding >= 1
+
+    def spend(self) -> bool:
+
+        with self.lock:
+
+            if self.tokens - self.outstanding < 1:
+
+                return False
+
+            self.tokens -= 1
+
+            return True
+
+    def track(self, attempt):
+
+        """Count a losing attempt that is still running against the budget until it finishes."""
+
+        with self.lock:
+
+            self.outstanding += 1
+
+        attempt.add_done_callback(lambda done: self._release())
+
+    def _release(self):
+
+        with self.lock:
+
+            self.outstanding -= 1
+
+# Backup attempts of sync calls run here; hedges are capped by the budget, so a small pool is plenty
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor() -> ThreadPoolExecutor:
+
+    global _executor
+
+    with _executor_lock:
+
+        if _executor is None:
+
+            _executor = ThreadPoolExecutor(max_workers = int(os.getenv("HEDGE_MAX_WORKERS", "16")), thread_name_prefix = "llm-hedge")
+
+        return _executor
+
+# Primaries of sync calls that may be hedged run on a pool of their own, so a backup never queues
+# behind them. A call only goes there when a slot is free, otherwise it runs unhedged on the caller's
+# thread - the pool never queues, and the hedge delay counts from when the call really started.
+_primary_executor = None
+_primary_slots = None
+
+def _get_primary_executor() -> tuple:
+
+    global _primary_executor, _primary_slots
+
+    with _executor_lock:
+
+        if _primary_executor is None:
+
+            workers = int(os.getenv("HEDGE_PRIMARY_WORKERS", "64"))
+            _primary_executor = ThreadPoolExecutor(max_workers = workers, thread_name_prefix = "llm-primary")
+            _primary_slots = threading.BoundedSemaphore(workers)
+
+        return _primary_executor, _primary_slots
+
+class HedgedLLM:
+
+    """
+    Wraps a chat model so a call still running after the tracked latency percentile is duplicated on `backup`.
+
+    `backup` is the same model on the other API key (or the key pool), so its answer is interchangeable.
+    Whichever attempt answers first wins and the other is cancelled - truly for async calls; a sync
+    attempt already on the wire runs to the end in the background and its answer is dropped. If the
+    first attempt to finish failed, the other one is still awaited. Hedges are capped by a HedgeBudget,
+    and counted in llm_hedge_total on /metrics. Sync primaries run on a bounded pool
+    (HEDGE_PRIMARY_WORKERS, default 64); when it is full the call runs unhedged on the caller's thread.
+
+        HEDGE_PERCENTILE          hedge once a call is slower than this share of recent calls (default 0.95)
+        HEDGE_MIN_DELAY_SECONDS   never hedge sooner than this (default 1)
+        HEDGE_BUDGET              extra requests allowed per call (default 0.1)
+    """
+
+    def __init__(self, llm, backup, percentile: float = None, min_delay: float = None, budget: float = None):
+
+        self.llm = llm
+        self.backup = backup
+        self.model_name = getattr(llm, "model_name", None) or getattr(llm, "model", "")
+        self.percentile = percentile if percentile is not None else float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+        self.min_delay = min_delay if min_delay is not None else float(os.getenv("HEDGE_MIN_DELAY_SECONDS", "1"))
+        self.budget = HedgeBudget(budget if budget is not None else float(os.getenv("HEDGE_BUDGET", "0.1")))
+        self.latency = LatencyTracker()
+
+    def _delay(self) -> float:
+
+        # No hedging until the window has enough calls to say what "slow" is
+        threshold = self.latency.percentile(self.percentile)
+
+        return None if threshold is None else max(threshold, self.min_delay)
+
+    def _timed(self, llm, prompt, args, kwargs):
+
+        started = time.perf_counter()
+        response = llm.invoke(prompt, *args, **kwargs)
+        self.latency.record(time.perf_counter() - started)
+
+        return response
+
+    async def _atimed(self, llm, prompt, args, kwargs):
+
+        started = time.perf_counter()
+        response = await llm.ainvoke(prompt, *args, **kwargs)
+        self.latency.record(time.perf_counter() - started)
+
+        return response
+
+    def _should_hedge(self) -> bool:
+
+        if self.budget.spend():
+
+            metrics.hedge(self.model_name, "sent")
+
+            return True
+
+        metrics.hedge(self.model_name, "over_budget")
+
+        return False
+
+    def invoke(self, prompt, *args, **kwargs):
+
+        self.budget.earn()
+        delay = self._delay()
+
+        if delay is None:
+
+            return self._timed(self.llm, prompt, args, kwargs)
+
+        executor, slots = _get_primary_executor()
+        over_budget = not self.budget.available()
+
+        if over_budget or not slots.acquire(blocking = False):
+
+            # No hedge could be sent anyway, so the call simply runs on the caller's thread
+            started = time.perf_counter()
+            response = self._timed(self.llm, prompt, args, kwargs)
+
+            if over_budget and time.perf_counter() - started > delay:
+
+                metrics.hedge(self.model_name, "over_budget")
+
+            return response
+
+        primary = executor.submit(contextvars.copy_context().run, self._timed, self.llm, prompt, args, kwargs)
+        primary.add_done_callback(lambda done: slots.release())
+
+        if not wait([primary], timeout = delay).done and self._should_hedge():
+
+            hedge = _get_executor().submit(contextvars.copy_context().run, self._timed, self.backup, prompt, args, kwargs)
+
+            return self._first([primary, hedge]).result()
+
+        return primary.result()
+
+    def _first(self, attempts: list):
+
+        # The first attempt to succeed, or the last one to fail
+        pending = set(attempts)
+
+        while True:
+
+            done, pending = wait(pending, return_when = FIRST_COMPLETED)
+            succeeded = [attempt for attempt in done if attempt.exception() is None]
+
+            if succeeded or not pending:
+
+                winner = succeeded[0] if succeeded else next(iter(done))
+                self._count(succeeded, winner is attempts[1], pending)
+
+                for attempt in pending:
+
+                    # A sync attempt already on the wire cannot be cancelled, it is charged until it ends
+                    if not attempt.cancel():
+
+                        self.budget.track(attempt)
+
+                return winner
+
+    def _count(self, succeeded: list, hedge_won: bool, losers):
+
+        if not succeeded:
+
+            metrics.hedge(self.model_name, "failed")
+            return
+
+        metrics.hedge(self.model_name, "won" if hedge_won else "lost")
+
+        if hedge_won:
+
+            logging.debug(f"Hedged {self.model_name} call answered first, {len(losers)} slower attempt dropped")
+
+    async def ainvoke(self, prompt, *args, **kwargs):
+
+        self.budget.earn()
+        delay = self._delay()
+
+        if delay is None:
+
+            return await self._atimed(self.llm, prompt, args, kwargs)
+
+        primary = asyncio.ensure_future(self._atimed(self.llm, prompt, args, kwargs))
+        attempts = [primary]
+
+        try:
+
+            try:
+
+                await asyncio.wait_for(asyncio.shield(primary), timeout = delay)
+
+            except Exception:
+
+                # Still running (hedged below) or failed (raised below, the caller's to retry)
+                pass
+
+            if primary.done() or not self._should_hedge():
+
+                return await primary
+
+            attempts.append(asyncio.ensure_future(self._atimed(self.backup, prompt, args, kwargs)))
+            pending = set(attempts)
+
+            while True:
+
+                done, pending = await asyncio.wait(pending, return_when = asyncio.FIRST_COMPLETED)
+                succeeded = [attempt for attempt in done if attempt.exception() is None]
+
+                if succeeded or not pending:
+
+                    winner = succeeded[0] if succeeded else next(iter(done))
+                    self._count(succeeded, winner is attempts[1], pending)
+
+                    return winner.result()
+
+        finally:
+
+            # Also when the caller is cancelled, no attempt is left running
+            for attempt in attempts:
+
+                attempt.cancel()
+
+    def __getattr__(self, name):
+
+        return getattr(self.llm, name)
@@ -0,0 +1,418 @@
+from src.logger import logging, log_context
+from src.pipeline import PipelineProgress
+from src.event_loop import run_coroutine
+import threading
+import asyncio
+import inspect
+import sqlite3
+import json
+import time
+import uuid
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    user_id INTEGER,
+    status TEXT NOT NULL,
+    stage TEXT,
+    params TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_jobs_status_created ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS job_lessons (
+    job_id TEXT NOT NULL,
+    ordinal INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    lesson_done INTEGER NOT NULL DEFAULT 0,
+    test_done INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (job_id, ordinal)
+);
+CREATE TABLE IF NOT EXISTS job_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    event TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_job_events_job_id ON job_events (job_id, id);
+"""
+
+class JobProgress(PipelineProgress):
+
+    """Records pipeline progress of one job into the job store, and publishes it as job events."""
+
+    def __init__(self, queue: "JobQueue", job_id: str):
+
+        self.queue = queue
+        self.job_id = job_id
+        self.ordinals = {}
+
+    def stage(self, name: str):
+
+        self.queue._execute("UPDATE jobs SET stage = ?, updated_at = ? WHERE id = ?", (name, time.time(), self.job_id))
+        self.queue.publish(self.job_id, "stage", {"stage": name})
+
+    def overview(self, topic_intro: str, study_links: str):
+
+        self.queue.publish(self.job_id, "overview", {"intro": topic_intro, "links": study_links})
+
+    def plan(self, lesson_list: list):
+
+        for ordinal, title in enumerate(lesson_list):
+
+            self.ordinals.setdefault(title, ordinal)
+
+        rows = [(self.job_id, ordinal, title) for ordinal, title in enumerate(lesson_list)]
+        self.queue._executemany("INSERT OR REPLACE INTO job_lessons (job_id, ordinal, title) VALUES (?, ?, ?)", rows)
+        self.queue.publish(self.job_id, "plan", {"lessons": lesson_list})
+
+    def lesson(self, title: str, content: str):
+
+        self.queue._execute("UPDATE job_lessons SET lesson_done = 1 WHERE job_id = ? AND title = ?", (self.job_id, title))
+        self.queue.publish(self.job_id, "lesson", {"ordinal": self.ordinals.get(title), "title": title, "content": content})
+        self.heartbeat()
+
+    def test(self, title: str, test: str):
+
+        self.queue._execute("UPDATE job_lessons SET test_done = 1 WHERE job_id = ? AND title = ?", (self.job_id, title))
+        self.queue.publish(self.job_id, "test", {"ordinal": self.ordinals.get(title), "title": title, "test": test})
+        self.heartbeat()
+
+    def heartbeat(self):
+
+        # Keeps long running jobs from being mistaken for ones orphaned by a dead process
+        self.queue._execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (time.time(), self.job_id))
+
+class JobQueue:
+
+    """
+    SQLite backed job queue with a local pool of worker threads.
+
+    Jobs are claimed atomically, so several web processes can share the same database file
+    and each process' workers only pick up jobs nobody else is running.
+    `handler(params, progress)` does the work and returns a JSON serialisable result. When it is a
+    coroutine function, one dispatcher thread claims jobs and runs up to `max_in_flight` of them
+    concurrently on the shared event loop instead of one per worker thread.
+    """
+
+    def __init__(self, db_path: str, handler, workers: int = 2, poll_interval: float = 1.0, stale_after: float = 1800, max_in_flight: int = 100):
+
+        self.db_path = db_path
+        self.handler = handler
+        self.is_async = inspect.iscoroutinefunction(handler)
+        self.workers = max(1, workers)
+        self.max_in_flight = max(1, max_in_flight)
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        # Idle workers requeue stale jobs and purge old events this often, not only at start()
+        self.maintenance_interval = poll_interval * 60
+        self.maintained_at = 0.0
+        self.wakeup = threading.Event()
+        self.started = False
+        self.lock = threading.Lock()
+
+        conn = self._connect()
+
+        try:
+
+            conn.executescript(SCHEMA)
+
+        finally:
+
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+
+        conn = sqlite3.connect(self.db_path, timeout = 30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+
+        return conn
+
+    def _execute(self, sql: str, args: tuple = ()):
+
+        conn = self._connect()
+
+        try:
+
+            with conn:
+
+                conn.execute(sql, args)
+
+        finally:
+
+            conn.close()
+
+    def _executemany(self, sql: str, rows: list):
+
+        conn = self._connect()
+
+        try:
+
+            with conn:
+
+                conn.executemany(sql, rows)
+
+        finally:
+
+            conn.close()
+
+    def start(self):
+
+        with self.lock:
+
+            if self.started:
+
+                return
+
+            self.started = True
+
+        self._maintain()
+
+        if self.is_async:
+
+            threading.Thread(target = self._dispatcher, name = "job-dispatcher", daemon = True).start()
+
+            logging.info(f"Job queue started with up to {self.max_in_flight} jobs in flight on the event loop")
+
+            return
+
+        for index in range(self.workers):
+
+            threading.Thread(target = self._worker, name = f"job-worker-{index}", daemon = True).start()
+
+        logging.info(f"Job queue started with {self.workers} workers")
+
+    def submit(self, params: dict, user_id: int = None) -> str:
+
+        job_id = uuid.uuid4().hex
+        now = time.time()
+
+        self._execute(
+            "INSERT INTO jobs (id, user_id, status, stage, params, created_at, updated_at) VALUES (?, ?, 'queued', 'queued', ?, ?, ?)",
+            (job_id, user_id, json.dumps(params), now, now)
+        )
+        self.wakeup.set()
+
+        logging.info(f"Job {job_id} submitted")
+
+        return job_id
+
+    def get(self, job_id: str) -> dict:
+
+        conn = self._connect()
+
+        try:
+
+            job = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+            if job is None:
+
+                return None
+
+            lessons = conn.execute(
+                "SELECT title, lesson_done, test_done FROM job_lessons WHERE job_id = ? ORDER BY ordinal", (job_id,)
+            ).fetchall()
+
+        finally:
+
+            conn.close()
+
+        return {
+            "id": job["id"],
+            "user_id": job["user_id"],
+            "status": job["status"],
+            "stage": job["stage"],
+            "params": json.loads(job["params"]),
+            "result": json.loads(job["result"]) if job["result"] else None,
+            "error": job["error"],
+            "total_lessons": len(lessons),
+            "completed_lessons": sum(row["lesson_done"] for row in lessons),
+            "completed_tests": sum(row["test_done"] for row in lessons),
+            "lessons": [dict(row) for row in lessons]
+        }
+
+    def publish(self, job_id: str, event: str, data: dict):
+
+        self._execute("INSERT INTO job_events (job_id, event, data) VALUES (?, ?, ?)", (job_id, event, json.dumps(data)))
+
+    def events(self, job_id: str, after: int = 0) -> list:
+
+        """Events of a job newer than the event id `after`, oldest first."""
+
+        conn = self._connect()
+
+        try:
+
+            rows = conn.execute(
+                "SELECT id, event, data FROM job_events WHERE job_id = ? AND id > ? ORDER BY id", (job_id, after)
+            ).fetchall()
+
+        finally:
+
+            conn.close()
+
+        return [(row["id"], row["event"], row["data"]) for row in rows]
+
+    def _purge_events(self):
+
+        # Streamed events are only needed while a job runs, and briefly after for late subscribers
+        cutoff = time.time() - self.stale_after
+        self._execute(
+            "DELETE FROM job_events WHERE job_id IN (SELECT id FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?)",
+            (cutoff,)
+        )
+
+    def _claim(self) -> sqlite3.Row:
+
+        conn = self._connect()
+
+        try:
+
+            # BEGIN IMMEDIATE takes the write lock up front, so two workers can never claim the same job
+            conn.execute("BEGIN IMMEDIATE")
+            job = conn.execute("SELECT id, params FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1").fetchone()
+
+            if job is not None:
+
+                conn.execute("UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ?", (time.time(), job["id"]))
+
+            conn.execute("COMMIT")
+
+            return job
+
+        finally:
+
+            conn.close()
+
+    def _requeue_stale(self):
+
+        # Jobs left running by a process that died are handed back to the queue
+        cutoff = time.time() - self.stale_after
+        self._execute("UPDATE jobs SET status = 'queued' WHERE status = 'running' AND updated_at < ?", (cutoff,))
+
+    def _maintain(self):
+
+        # Called by idle workers; only one of them does the work per maintenance_interval
+        with self.lock:
+
+            now = time.monotonic()
+
+            if self.maintained_at and now - self.maintained_at < self.maintenance_interval:
+
+                return
+
+            self.maintained_at = now
+
+        try:
+
+            # Live jobs heartbeat well within stale_after, so only jobs of a dead worker or process are requeued
+            self._requeue_stale()
+            self._purge_events()
+
+        except sqlite3.OperationalError as e:
+
+            logging.info(f"Job queue maintenance failed, retrying later: {e}")
+
+    def _worker(self):
+
+        while True:
+
+            try:
+
+                job = self._claim()
+
+            except sqlite3.OperationalError as e:
+
+                logging.info(f"Job claim failed, retrying: {e}")
+                job = None
+
+            if job is None:
+
+                self._maintain()
+                self.wakeup.wait(self.poll_interval)
+                self.wakeup.clear()
+                continue
+
+            self._run(job["id"], json.loads(job["params"]))
+
+    def _dispatcher(self):
+
+        slots = threading.BoundedSemaphore(self.max_in_flight)
+
+        while True:
+
+            # Only claim a job when it can start right away, queued jobs stay claimable by other processes
+            slots.acquire()
+
+            try:
+
+                job = self._claim()
+
+            except sqlite3.OperationalError as e:
+
+                logging.info(f"Job claim failed, retrying: {e}")
+                job = None
+
+            if job is None:
+
+                slots.release()
+                self._maintain()
+                self.wakeup.wait(self.poll_interval)
+                self.wakeup.clear()
+                continue
+
+            future = run_coroutine(self._arun(job["id"], json.loads(job["params"])))
+            future.add_done_callback(lambda done: slots.release())
+
+    def _run(self, job_id: str, params: dict):
+
+        with log_context(job_id = job_id):
+
+            logging.info(f"Job {job_id} started")
+
+            try:
+
+                result = self.handler(params, JobProgress(self, job_id))
+                self._finished(job_id, result)
+
+            except Exception as e:
+
+                self._failed(job_id, e)
+
+    async def _arun(self, job_id: str, params: dict):
+
+        with log_context(job_id = job_id):
+
+            logging.info(f"Job {job_id} started")
+
+            try:
+
+                result = await self.handler(params, JobProgress(self, job_id))
+                await asyncio.to_thread(self._finished, job_id, result)
+
+            except Exception as e:
+
+                await asyncio.to_thread(self._failed, job_id, e)
+
+    def _finished(self, job_id: str, result):
+
+        self._execute(
+            "UPDATE jobs SET status = 'done', stage = 'done', result = ?, updated_at = ? WHERE id = ?",
+            (json.dumps(result), time.time(), job_id)
+        )
+        self.publish(job_id, "done", result)
+
+        logging.info(f"Job {job_id} finished")
+
+    def _failed(self, job_id: str, error: Exception):
+
+        logging.info(f"Job {job_id} failed: {error}")
+
+        self._execute(
+            "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE id = ?",
+            (str(error), time.time(), job_id)
+        )
+        self.publish(job_id, "failed", {"error": str(error)})
@@ -0,0 +1,423 @@
+from src.logger import logging
+import threading
+import asyncio
+import random
+import httpx
+import time
+import re
+
+def parse_reset(value: str) -> float:
+
+    """Seconds until a Groq rate limit resets, from header values like "7.66s", "2m59.56s" or "120ms"."""
+
+    if not value:
+
+        return 0.0
+
+    seconds = 0.0
+
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value):
+
+        seconds += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+
+    return seconds
+
+class TokenBucket:
+
+    """Refills `per_minute` units per minute; take() reports how long to wait when the bucket is short."""
+
+    def __init__(self, per_minute: int):
+
+        self.capacity = float(max(1, per_minute))
+        self.tokens = self.capacity
+        self.refill_rate = self.capacity / 60.0
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+
+        self._refill()
+
+        return max(0.0, (min(amount, self.capacity) - self.tokens) / self.refill_rate)
+
+    def take(self, amount: float):
+
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def sync(self, remaining: float):
+
+        # The server's count is authoritative, other processes spend from the same key
+        self._refill()
+        self.tokens = min(self.tokens, remaining)
+
+class ModelBudget:
+
+    """
+    Rate limits of one model on one key - Groq counts them separately for every (key, model) pair.
+
+    Requests per minute are paced locally only. Tokens per minute and requests per day are re-synced
+    from the x-ratelimit-* headers: "requests" there is the daily count, "tokens" the per-minute one.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        # Unknown until the first response says so
+        self.requests_today = None
+        self.day_resets_at = 0.0
+        self.cooldown_until = 0.0
+        self.synced_at = 0.0
+        self.calls = 0
+
+    def wait_time(self, estimated_tokens: int, now: float) -> float:
+
+        waits = [self.cooldown_until - now, self.requests.wait_time(1), self.tokens.wait_time(estimated_tokens)]
+
+        if self.requests_today is not None and self.requests_today <= 0:
+
+            waits.append(self.day_resets_at - now)
+
+        return max(waits)
+
+class KeyState:
+
+    """Live load of one API key, and the budgets of each model used with it."""
+
+    def __init__(self, slot: int, api_key: str):
+
+        self.slot = slot
+        self.api_key = api_key
+        self.models = {}
+        self.in_flight = 0
+        self.rate_limited = 0
+        self.calls = 0
+
+class KeyPool:
+
+    """
+    Pool of N Groq API keys that routes every call to the least-loaded key.
+
+    Each (key, model) pair has its own ModelBudget, as Groq limits them: requests-per-minute and
+    tokens-per-minute token buckets that pace calls locally, re-synced from the x-ratelimit-* response
+    headers so usage by other processes is accounted for, and the daily request count from the headers.
+    A 429 puts the key's model on cooldown for its retry-after time and the call moves to another key.
+    """
+
+    def __init__(self, api_keys: list, client_factory, requests_per_minute: int = 30, tokens_per_minute: int = 6000):
+
+        if not api_keys:
+
+            raise ValueError("KeyPool needs at least one API key")
+
+        self.keys = [KeyState(slot, key) for slot, key in enumerate(api_keys)]
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.client_factory = client_factory
+        self.clients = {}
+        self.lock = threading.Lock()
+
+    def budget(self, state: KeyState, model: str) -> ModelBudget:
+
+        # Called with self.lock held
+        if model not in state.models:
+
+            state.models[model] = ModelBudget(self.requests_per_minute, self.tokens_per_minute)
+
+        return state.models[model]
+
+    def try_acquire(self, model: str, estimated_tokens: int) -> tuple:
+
+        """Reserve the least-loaded key with budget for a call to `model`: (state, 0), or (None, seconds to wait)."""
+
+        with self.lock:
+
+            now = time.monotonic()
+            best = None
+            shortest_wait = None
+
+            for state in self.keys:
+
+                budget = self.budget(state, model)
+                wait = budget.wait_time(estimated_tokens, now)
+
+                if wait > 0:
+
+                    shortest_wait = wait if shortest_wait is None else min(shortest_wait, wait)
+                    continue
+
+                # Fewest calls in flight first, then the most token budget left
+                load = (state.in_flight, -budget.tokens.tokens)
+
+                if best is None or load < best[0]:
+
+                    best = (load, state)
+
+            if best is None:
+
+                return None, min(shortest_wait, 5.0)
+
+            state = best[1]
+            budget = self.budget(state, model)
+            budget.requests.take(1)
+            budget.tokens.take(estimated_tokens)
+            budget.calls += 1
+
+            if budget.requests_today is not None:
+
+                budget.requests_today -= 1
+
+            state.in_flight += 1
+            state.calls += 1
+
+            return state, 0.0
+
+    def acquire(self, model: str, estimated_tokens: int) -> KeyState:
+
+        """Block until some key has budget for the call, then reserve it on the least-loaded such key."""
+
+        while True:
+
+            state, wait = self.try_acquire(model, estimated_tokens)
+
+            if state is not None:
+
+                return state
+
+            time.sleep(wait)
+
+    async def aacquire(self, model: str, estimated_tokens: int) -> KeyState:
+
+        """acquire() for the event loop, waits without holding a thread."""
+
+        while True:
+
+            state, wait = self.try_acquire(model, estimated_tokens)
+
+            if state is not None:
+
+                return state
+
+            await asyncio.sleep(wait)
+
+    def release(self, state: KeyState):
+
+        with self.lock:
+
+            state.in_flight -= 1
+
+    def rate_limited(self, state: KeyState, model: str, retry_after: float):
+
+        with self.lock:
+
+            budget = self.budget(state, model)
+            state.rate_limited += 1
+            budget.cooldown_until = max(budget.cooldown_until, time.monotonic() + retry_after)
+
+        logging.info(f"Groq key slot {state.slot} rate limited for {model}, cooling down for {retry_after:.1f}s")
+
+    def settle(self, state: KeyState, model: str, estimated_tokens: int, actual_tokens: int, started: float):
+
+        """Correct the token bucket by what the call really used, unless the server's headers already did."""
+
+        with self.lock:
+
+            budget = self.budget(state, model)
+
+            if budget.synced_at < started:
+
+                budget.tokens.take(actual_tokens - estimated_tokens)
+
+    def _record_headers(self, state: KeyState, model: str, headers):
+
+        with self.lock:
+
+            budget = self.budget(state, model)
+            now = time.monotonic()
+
+            # The "requests" headers count the day, not the minute
+            if "x-ratelimit-remaining-requests" in headers:
+
+                budget.requests_today = float(headers["x-ratelimit-remaining-requests"])
+                budget.day_resets_at = now + parse_reset(headers.get("x-ratelimit-reset-requests"))
+
+            if "x-ratelimit-remaining-tokens" in headers:
+
+                budget.tokens.sync(float(headers["x-ratelimit-remaining-tokens"]))
+                budget.synced_at = now
+
+                # Out of tokens for this window: park the model on this key until it resets
+                if float(headers["x-ratelimit-remaining-tokens"]) <= 0:
+
+                    reset = parse_reset(headers.get("x-ratelimit-reset-tokens"))
+                    budget.cooldown_until = max(budget.cooldown_until, now + reset)
+
+    def client(self, state: KeyState, model: str, temperature: float):
+
+        """Chat client for one key and model, built once with a hook that reads rate limit headers."""
+
+        cache_key = (state.slot, model, temperature)
+
+        with self.lock:
+
+            if cache_key not in self.clients:
+
+                def record(response):
+
+                    self._record_headers(state, model, response.headers)
+
+                async def arecord(response):
+
+                    self._record_headers(state, model, response.headers)
+
+                http_client = httpx.Client(event_hooks = {"response": [record]})
+                http_async_client = httpx.AsyncClient(event_hooks = {"response": [arecord]})
+                self.clients[cache_key] = self.client_factory(model, temperature, state.api_key, http_client, http_async_client)
+
+            return self.clients[cache_key]
+
+    def stats(self) -> list:
+
+        with self.lock:
+
+            return [
+                {
+                    "slot": state.slot,
+                    "in_flight": state.in_flight,
+                    "calls": state.calls,
+                    "rate_limited": state.rate_limited,
+                    "models": {
+                        model: {
+                            "calls": budget.calls,
+                            "requests_left": round(budget.requests.tokens, 1),
+                            "tokens_left": round(budget.tokens.tokens),
+                            "requests_left_today": budget.requests_today
+                        }
+                        for model, budget in state.models.items()
+                    }
+                }
+                for state in self.keys
+            ]
+
+def _is_rate_limit(error: Exception) -> bool:
+
+    return getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError"
+
+def _retry_after(error: Exception) -> float:
+
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+
+    try:
+
+        return float(headers.get("retry-after", 0))
+
+    except ValueError:
+
+        return 0.0
+
+class PooledLLM:
+
+    """
+    Chat model facade that draws a key from the KeyPool for every call, with backoff on 429s.
+
+    Calls are budgeted at the prompt's size plus the expected output, which starts at
+    `expected_output_tokens` and follows the output sizes the model actually reports.
+    """
+
+    def __init__(self, pool: KeyPool, model: str, temperature: float, max_attempts: int = 5, expected_output_tokens: int = 1500):
+
+        self.pool = pool
+        self.model_name = model
+        self.temperature = temperature
+        self.max_attempts = max_attempts
+        self.expected_output_tokens = expected_output_tokens
+
+    def _estimate_tokens(self, prompt) -> int:
+
+        text = prompt if isinstance(prompt, str) else " ".join(str(getattr(message, "content", message)) for message in prompt)
+
+        # ~4 characters per token is close enough for budgeting
+        return len(text) // 4 + int(self.expected_output_tokens)
+
+    def _settle(self, state: KeyState, estimated_tokens: int, response, started: float):
+
+        usage = getattr(response, "usage_metadata", None) or {}
+
+        if not usage.get("total_tokens"):
+
+            return
+
+        self.pool.settle(state, self.model_name, estimated_tokens, usage["total_tokens"], started)
+
+        # Moving average, so one long answer does not swing the budget of the next calls
+        if usage.get("output_tokens"):
+
+            self.expected_output_tokens = 0.8 * self.expected_output_tokens + 0.2 * usage["output_tokens"]
+
+    def invoke(self, prompt, *args, **kwargs):
+
+        estimated_tokens = self._estimate_tokens(prompt)
+
+        for attempt in range(1, self.max_attempts + 1):
+
+            state = self.pool.acquire(self.model_name, estimated_tokens)
+            started = time.monotonic()
+
+            try:
+
+                response = self.pool.client(state, self.model_name, self.temperature).invoke(prompt, *args, **kwargs)
+                response.response_metadata["key_slot"] = state.slot
+                self._settle(state, estimated_tokens, response, started)
+
+                return response
+
+            except Exception as e:
+
+                if not _is_rate_limit(e) or attempt == self.max_attempts:
+
+                    raise
+
+                # Exponential backoff with jitter, never shorter than what the server asked for
+                backoff = max(_retry_after(e), 2 ** (attempt - 1) + random.random())
+                self.pool.rate_limited(state, self.model_name, backoff)
+
+            finally:
+
+                self.pool.release(state)
+
+    async def ainvoke(self, prompt, *args, **kwargs):
+
+        estimated_tokens = self._estimate_tokens(prompt)
+
+        for attempt in range(1, self.max_attempts + 1):
+
+            state = await self.pool.aacquire(self.model_name, estimated_tokens)
+            started = time.monotonic()
+
+            try:
+
+                response = await self.pool.client(state, self.model_name, self.temperature).ainvoke(prompt, *args, **kwargs)
+                response.response_metadata["key_slot"] = state.slot
+                self._settle(state, estimated_tokens, response, started)
+
+                return response
+
+            except Exception as e:
+
+                if not _is_rate_limit(e) or attempt == self.max_attempts:
+
+                    raise
+
+                backoff = max(_retry_after(e), 2 ** (attempt - 1) + random.random())
+                self.pool.rate_limited(state, self.model_name, backoff)
+
+            finally:
+
+                self.pool.release(state)
@@ -0,0 +1,154 @@
+from src.logger import logging
+import json
+import re
+import os
+
+# What the planning prompt asks for, and what parse_plan() returns after validation
+PLAN_FORMAT = '{"lessons": [{"number": 1, "title": "...", "subtopics": ["...", "..."]}]}'
+
+# "Lesson 3: ...", "3. ...", "**Unit 3 -** ..." - a number needs a separator and a space, so "3D shapes" is a title
+_NUMBERED = re.compile(r"^\s*[#*\s]*(?:(?:lesson|chapter|unit|module)\s*(\d+)\s*[:.)\-–—]?|(\d+)\s*[:.)\-–—])\s+(.+)$", re.IGNORECASE)
+_BULLET = re.compile(r"^\s*(?:[-*•]|[a-z][.)])\s+(.+)$", re.IGNORECASE)
+_FENCE = re.compile(r"```(?:json)?", re.IGNORECASE)
+
+def max_plan_lessons() -> int:
+
+    return int(os.getenv("PLAN_MAX_LESSONS", "50"))
+
+def lesson_title(entry: dict) -> str:
+
+    """The title a planned lesson is generated, stored and shown under, e.g. "Lesson 3: Fractions"."""
+
+    return f"Lesson {entry['number']}: {entry['title']}"
+
+def subtopics_by_title(plan: list) -> dict:
+
+    return {lesson_title(entry): entry["subtopics"] for entry in plan or []}
+
+def _clean(text) -> str:
+
+    return " ".join(str(text).replace("**", "").split()).strip(" *#:-")
+
+def _strip_number(title: str) -> str:
+
+    match = _NUMBERED.match(title)
+
+    return _clean(match.group(3)) if match else title
+
+def _load_json(text: str):
+
+    text = _FENCE.sub("", text)
+    decoder = json.JSONDecoder()
+
+    # The model sometimes writes a sentence before the JSON, decode from the first bracket that parses
+    for index, char in enumerate(text):
+
+        if char in "{[":
+
+            try:
+
+                return decoder.raw_decode(text, index)[0]
+
+            except ValueError:
+
+                continue
+
+    return None
+
+def _from_json(data) -> list:
+
+    items = data.get("lessons", []) if isinstance(data, dict) else data if isinstance(data, list) else []
+    entries = []
+
+    for item in items:
+
+        if isinstance(item, str):
+
+            item = {"title": item}
+
+        # A null or numeric title would otherwise become the lesson "None" or "3"
+        if not isinstance(item, dict) or not isinstance(item.get("title"), str) or not _clean(item["title"]):
+
+            continue
+
+        subtopics = item.get("subtopics") or []
+
+        if isinstance(subtopics, str):
+
+            subtopics = subtopics.split(",")
+
+        elif not isinstance(subtopics, list):
+
+            subtopics = []
+
+        entries.append({
+            "title": _strip_number(_clean(item["title"])),
+            "subtopics": [_clean(subtopic) for subtopic in subtopics if isinstance(subtopic, str) and _clean(subtopic)]
+        })
+
+    return entries
+
+def _from_lines(text: str) -> list:
+
+    # Plain numbered lines, as older prompts and some models produce; preamble and blank lines are dropped
+    entries = []
+
+    for line in text.replace("**", "").splitlines():
+
+        numbered = _NUMBERED.match(line)
+
+        if numbered:
+
+            entries.append({"title": _clean(numbered.group(3)), "subtopics": []})
+
+        elif entries and _BULLET.match(line):
+
+            entries[-1]["subtopics"].append(_clean(_BULLET.match(line).group(1)))
+
+    return [entry for entry in entries if entry["title"]]
+
+def parse_plan(text: str, max_lessons: int = None) -> list:
+
+    """
+    The lessons of a planning answer as [{"number", "title", "subtopics"}], in order.
+
+    The answer is read as PLAN_FORMAT JSON when it has any, otherwise as numbered lines. Repeated
+    titles are dropped, the rest is capped at `max_lessons` (PLAN_MAX_LESSONS) and renumbered 1..N,
+    so the numbers always match the lessons generated. Raises ValueError when no lesson is found.
+    """
+
+    max_lessons = max_lessons or max_plan_lessons()
+    entries = _from_json(_load_json(text))
+    source = "json"
+
+    if not entries:
+
+        entries = _from_lines(text)
+        source = "lines"
+
+    plan = []
+    seen = set()
+
+    for entry in entries:
+
+        key = re.sub(r"\W+", " ", entry["title"].lower()).strip()
+
+        if key in seen:
+
+            continue
+
+        seen.add(key)
+        plan.append({"number": len(plan) + 1, "title": entry["title"], "subtopics": entry["subtopics"]})
+
+    if not plan:
+
+        raise ValueError(f"Lesson plan has no lessons: {text[:200]!r}")
+
+    if len(plan) > max_lessons:
+
+        logging.info(f"Lesson plan capped at {max_lessons} of {len(plan)} lessons")
+        plan = plan[:max_lessons]
+
+    logging.info(f"Parsed lesson plan from {source}: {len(plan)} lessons, {len(entries) - len(seen)} duplicates dropped")
+
+    return plan
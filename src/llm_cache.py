@@ -0,0 +1,234 @@
+from src.logger import logging
+from langchain_core.messages import AIMessage
+import threading
+import asyncio
+import hashlib
+import sqlite3
+import json
+import time
+import os
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_llm_cache_accessed_at ON llm_cache (accessed_at);
+"""
+
+def _serialize_prompt(prompt) -> str:
+
+    if isinstance(prompt, str):
+
+        return prompt
+
+    # Lists of messages, e.g. [SystemMessage(...)]
+    return json.dumps([[getattr(message, "type", ""), getattr(message, "content", str(message))] for message in prompt])
+
+class LLMCache:
+
+    """
+    On-disk SQLite store of LLM responses keyed on model, temperature and prompt hash.
+
+    When the stored responses grow past `max_bytes` the least recently read ones are evicted.
+    Hit and miss counters are kept per process.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+
+        conn = self._connect()
+
+        try:
+
+            conn.executescript(SCHEMA)
+            self.size = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+
+        finally:
+
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+
+        conn = sqlite3.connect(self.path, timeout = 30)
+        conn.execute("PRAGMA journal_mode=WAL")
+
+        return conn
+
+    @staticmethod
+    def make_key(model: str, temperature: float, prompt) -> str:
+
+        payload = json.dumps([model, temperature, _serialize_prompt(prompt)])
+
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str, count: bool = True) -> str:
+
+        conn = self._connect()
+
+        try:
+
+            with conn:
+
+                row = conn.execute("SELECT response FROM llm_cache WHERE key = ?", (key,)).fetchone()
+
+                if row is not None:
+
+                    conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+
+        finally:
+
+            conn.close()
+
+        if count:
+
+            with self.lock:
+
+                if row is None:
+
+                    self.misses += 1
+
+                else:
+
+                    self.hits += 1
+
+        return row[0] if row is not None else None
+
+    def put(self, key: str, model: str, response: str):
+
+        size = len(response.encode("utf-8"))
+        now = time.time()
+        conn = self._connect()
+
+        try:
+
+            with conn:
+
+                # A replaced row no longer counts towards the size, only the difference is added
+                old = conn.execute("SELECT size FROM llm_cache WHERE key = ?", (key,)).fetchone()
+                conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, model, response, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, model, response, size, now, now)
+                )
+
+        finally:
+
+            conn.close()
+
+        with self.lock:
+
+            self.size += size - (old[0] if old is not None else 0)
+            evict = self.size > self.max_bytes
+
+        if evict:
+
+            self._evict()
+
+    def _evict(self):
+
+        conn = self._connect()
+
+        try:
+
+            with conn:
+
+                # Recount first, other processes write to the same file
+                total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+                target = int(self.max_bytes * 0.9)
+                removed = 0
+
+                for key, size in conn.execute("SELECT key, size FROM llm_cache ORDER BY accessed_at").fetchall():
+
+                    if total <= target:
+
+                        break
+
+                    conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    total -= size
+                    removed += 1
+
+        finally:
+
+            conn.close()
+
+        with self.lock:
+
+            self.size = total
+
+        logging.info(f"LLM cache evicted {removed} responses")
+
+    def stats(self) -> dict:
+
+        with self.lock:
+
+            return {"hits": self.hits, "misses": self.misses, "bytes": self.size}
+
+class CachedLLM:
+
+    """Wraps a chat model so identical prompts are answered from the LLMCache instead of the network."""
+
+    def __init__(self, llm, cache: LLMCache):
+
+        self.llm = llm
+        self.cache = cache
+        self.model_name = getattr(llm, "model_name", None) or getattr(llm, "model", "")
+        self.temperature = getattr(llm, "temperature", None)
+
+    def peek(self, prompt) -> str:
+
+        """Cached response for the prompt, or None, without calling the model."""
+
+        key = self.cache.make_key(self.model_name, self.temperature, prompt)
+        cached = self.cache.get(key, count = False)
+
+        if cached is not None:
+
+            with self.cache.lock:
+
+                self.cache.hits += 1
+
+        return cached
+
+    def invoke(self, prompt, *args, **kwargs):
+
+        key = self.cache.make_key(self.model_name, self.temperature, prompt)
+        cached = self.cache.get(key)
+
+        if cached is not None:
+
+            return AIMessage(content = cached)
+
+        response = self.llm.invoke(prompt, *args, **kwargs)
+        self.cache.put(key, self.model_name, response.content)
+
+        return response
+
+    async def ainvoke(self, prompt, *args, **kwargs):
+
+        # The SQLite lookups are short but blocking, so they run off the event loop
+        key = self.cache.make_key(self.model_name, self.temperature, prompt)
+        cached = await asyncio.to_thread(self.cache.get, key)
+
+        if cached is not None:
+
+            return AIMessage(content = cached)
+
+        response = await self.llm.ainvoke(prompt, *args, **kwargs)
+        await asyncio.to_thread(self.cache.put, key, self.model_name, response.content)
+
+        return response
+
+    def __getattr__(self, name):
+
+        return getattr(self.llm, name)
@@ -1,18 +1,281 @@
+"""
+Process wide logging setup, imported everywhere as `from src.logger import logging`.
+
+Records are put on an in-memory queue by a QueueHandler and written by a QueueListener thread, so
+request and job threads never wait on the disk. Every worker process appends to the same file;
+rotation happens under an fcntl lock so processes never rotate over each other.
+
+    LOG_LEVEL          minimum level, e.g. WARNING to quieten busy workers (default INFO)
+    LOG_FORMAT         "json" (one object per line) or "text" (default json)
+    LOG_DIR            directory of the log file (default ./logs)
+    LOG_FILE           file name (default app.log)
+    LOG_MAX_BYTES      rotate once the file reaches this size, 0 disables (default 10 MB)
+    LOG_ROTATE         also rotate "hourly" or "daily" (default off)
+    LOG_BACKUP_COUNT   rotated files kept as app.log.1 ... app.log.N (default 5)
+"""
+
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import logging.handlers
+import contextvars
 import logging
+import atexit
+import queue
+import json
 import os
-from datetime import datetime
 
-LOG_FILE = f"{datetime.now().strftime('%m_%d_%Y_%H_%M_%S')}.log"
-logs_path = os.path.join(os.getcwd(),"logs",LOG_FILE)
-os.makedirs(logs_path, exist_ok=True)
+try:
+
+    import fcntl
+
+except ImportError:
+
+    # Windows - a single process is safe without it
+    fcntl = None
+
+_context = contextvars.ContextVar("log_context", default = {})
+
+@contextmanager
+def log_context(**ids):
+
+    """Attach ids (request_id, course_id, job_id, ...) to every record logged in this context, and contexts copied from it."""
+
+    token = _context.set({**_context.get(), **ids})
+
+    try:
+
+        yield
+
+    finally:
+
+        _context.reset(token)
+
+def bind_log_context(**ids):
+
+    """Replace the ids of the current thread or task, for code with separate start and end hooks (e.g. Flask requests)."""
+
+    _context.set(ids)
+
+class ContextFilter(logging.Filter):
+
+    """Copies the current log context onto the record, in the logging thread, before it is queued."""
+
+    def filter(self, record):
+
+        record.context = _context.get()
+
+        return True
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec = "milliseconds"),
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "module": record.module,
+            "line": record.lineno,
+            "process": record.process,
+            "thread": record.threadName,
+            **getattr(record, "context", {})
+        }
+
+        if record.exc_info:
+
+            entry["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default = str)
+
+class TextFormatter(logging.Formatter):
+
+    def __init__(self):
+
+        super().__init__("[%(asctime)s] %(lineno)d %(name)s - %(levelname)s - %(message)s%(ids)s")
+
+    def format(self, record):
+
+        context = getattr(record, "context", {})
+        record.ids = "".join(f" {name}={value}" for name, value in context.items())
+
+        return super().format(record)
+
+class SharedRotatingFileHandler(logging.FileHandler):
+
+    """
+    Appends to one file shared by several processes, rotating by size and/or time.
+
+    The rotation check and the write happen under an exclusive fcntl lock on a side file, and a
+    process whose file was rotated by another process reopens it before writing.
+    """
+
+    def __init__(self, filename: str, max_bytes: int = 0, rotate: str = "", backup_count: int = 5):
+
+        super().__init__(filename, "a", encoding = "utf-8", delay = False)
+        self.max_bytes = max_bytes
+        self.period = {"hourly": "%Y%m%d%H", "daily": "%Y%m%d"}.get(rotate, "")
+        self.backup_count = backup_count
+        self.lock_file = open(self.baseFilename + ".lock", "a")
+
+    def reopen(self):
+
+        # flock locks belong to the open file, which a forked child shares with its parent
+        self.lock_file.close()
+        self.lock_file = open(self.baseFilename + ".lock", "a")
+        self.stream.close()
+        self.stream = self._open()
+
+    def emit(self, record):
+
+        try:
+
+            message = self.format(record) + self.terminator
+
+            if fcntl is not None:
+
+                fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+
+            try:
+
+                self._reopen_if_rotated()
+
+                if self._should_rotate(len(message.encode("utf-8"))):
+
+                    self._rotate()
+
+                self.stream.write(message)
+                self.stream.flush()
+
+            finally:
 
-LOG_FILE_PATH = os.path.join(logs_path, LOG_FILE)
+                if fcntl is not None:
 
-logging.basicConfig(
-    filename=LOG_FILE_PATH,
-    format = "[%(asctime)s] %(lineno)d %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO
-)
+                    fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+        except Exception:
+
+            self.handleError(record)
+
+    def _reopen_if_rotated(self):
+
+        try:
+
+            on_disk = os.stat(self.baseFilename).st_ino
+
+        except FileNotFoundError:
+
+            on_disk = None
+
+        if on_disk != os.fstat(self.stream.fileno()).st_ino:
+
+            self.stream.close()
+            self.stream = self._open()
+
+    def _should_rotate(self, size: int) -> bool:
+
+        # The file on disk decides, not this process's writes, so every process agrees
+        status = os.fstat(self.stream.fileno())
+
+        if status.st_size == 0:
+
+            return False
+
+        if self.max_bytes and status.st_size + size > self.max_bytes:
+
+            return True
+
+        if self.period:
+
+            modified = datetime.fromtimestamp(status.st_mtime)
+
+            return modified.strftime(self.period) != datetime.now().strftime(self.period)
+
+        return False
+
+    def _rotate(self):
+
+        self.stream.close()
+
+        if self.backup_count > 0:
+
+            for index in range(self.backup_count - 1, 0, -1):
+
+                source = f"{self.baseFilename}.{index}"
+
+                if os.path.exists(source):
+
+                    os.replace(source, f"{self.baseFilename}.{index + 1}")
+
+            os.replace(self.baseFilename, f"{self.baseFilename}.1")
+
+        else:
+
+            open(self.baseFilename, "w").close()
+
+        self.stream = self._open()
+
+    def close(self):
+
+        super().close()
+        self.lock_file.close()
+
+def _configure() -> logging.handlers.QueueHandler:
+
+    log_dir = os.getenv("LOG_DIR", os.path.join(os.getcwd(), "logs"))
+    os.makedirs(log_dir, exist_ok = True)
+
+    file_handler = SharedRotatingFileHandler(
+        os.path.join(log_dir, os.getenv("LOG_FILE", "app.log")),
+        max_bytes = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+        rotate = os.getenv("LOG_ROTATE", "").lower(),
+        backup_count = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+    )
+    file_handler.setFormatter(TextFormatter() if os.getenv("LOG_FORMAT", "json").lower() == "text" else JsonFormatter())
+
+    queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.file_handler = file_handler
+
+    root = logging.getLogger()
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    root.addHandler(queue_handler)
+
+    return queue_handler
+
+_queue_handler = _configure()
+_listener = None
+
+def _start_listener():
+
+    global _listener
+
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, _queue_handler.file_handler, respect_handler_level = True)
+    _listener.start()
+
+def _stop_listener():
+
+    # Drains the queue, so records logged just before exit still reach the file
+    if _listener is not None and _listener._thread is not None:
+
+        _listener.stop()
+
+def _after_fork():
+
+    # A forked worker (e.g. gunicorn --preload) inherits the queue, with the parent's pending records,
+    # but not the listener thread - start over with an empty queue and a thread of its own
+    _queue_handler.queue = queue.SimpleQueue()
+    _queue_handler.file_handler.reopen()
+    _start_listener()
+
+_start_listener()
+
+# Windows has no fork, and no os.register_at_fork
+if hasattr(os, "register_at_fork"):
+
+    os.register_at_fork(after_in_child = _after_fork)
+
+atexit.register(_stop_listener)
 
 if __name__ == "__main__":
-    logging.info("Logging has started")
\ No newline at end of file
+
+    logging.info("Logging has started")
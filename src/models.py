@@ -0,0 +1,201 @@
+from flask_sqlalchemy import SQLAlchemy
+from src.compression import CompressedText, dictionaries, decompress, train_dictionary, log_ratio
+from src.logger import logging
+from datetime import datetime
+import json
+
+db = SQLAlchemy()
+
+# --- Database Models ---
+class User(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(150), unique=True, nullable=False)
+    password = db.Column(db.String(150), nullable=False)
+    # Relationship to access courses easily
+    courses = db.relationship('Course', backref='author', lazy=True)
+
+class CourseContent(db.Model):
+    """Generated course content, stored once and shared by every user who requests the same course."""
+    id = db.Column(db.Integer, primary_key=True)
+    # Normalised (version, standard, subject, topic) - NULL once expired or evicted from the cache
+    cache_key = db.Column(db.String(400), unique=True, nullable=True)
+    version = db.Column(db.Integer, nullable=False)
+    topic = db.Column(db.String(150), nullable=False)
+    subject = db.Column(db.String(150), nullable=False)
+    standard = db.Column(db.Integer, nullable=False)
+
+    # Storing large text content (compressed)
+    intro = db.Column(CompressedText, nullable=True)
+    links = db.Column(CompressedText, nullable=True)
+
+    # Legacy JSON blobs, moved into Lesson rows by migrate_lessons_to_rows()
+    lessons_json = db.deferred(db.Column(CompressedText, nullable=True))
+    tests_json = db.deferred(db.Column(CompressedText, nullable=True))
+
+    # JSON spans of the run that generated the course, kept when TRACE_COURSES=1
+    trace = db.deferred(db.Column(CompressedText, nullable=True))
+
+    # JSON lesson plan [{"number", "title", "subtopics"}], lesson N of the plan is the Lesson row with ordinal N - 1
+    plan = db.deferred(db.Column(CompressedText, nullable=True))
+
+    # Generation state - 'generating', 'failed' or 'ready'
+    status = db.Column(db.String(20), nullable=False, default='generating')
+    job_id = db.Column(db.String(32), nullable=True)
+    # 'separate' or 'fused' (see src.pipeline.generation_mode), to compare the two when A/B testing
+    generation_mode = db.Column(db.String(20), nullable=True)
+
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    hits = db.Column(db.Integer, nullable=False, default=0)
+
+    lessons = db.relationship('Lesson', backref='owner_content', lazy='dynamic', cascade='all, delete-orphan')
+
+class Course(db.Model):
+    __table_args__ = (
+        # Dashboard listing (newest first, keyset paginated) and the history lookup in product()
+        db.Index('ix_course_user_id_id', 'user_id', 'id'),
+        db.Index('ix_course_user_id_topic_subject_standard', 'user_id', 'topic', 'subject', 'standard'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    topic = db.Column(db.String(150), nullable=False)
+    subject = db.Column(db.String(150), nullable=False)
+    standard = db.Column(db.Integer, nullable=False)
+
+    # Storing large text content (courses saved before the shared cache keep it inline).
+    # Deferred, so listing courses never reads it - it is loaded on first access instead
+    intro = db.deferred(db.Column(CompressedText, nullable=True))
+    links = db.deferred(db.Column(CompressedText, nullable=True))
+
+    # Legacy JSON blobs, moved into Lesson rows by migrate_lessons_to_rows()
+    lessons_json = db.deferred(db.Column(CompressedText, nullable=True))
+    tests_json = db.deferred(db.Column(CompressedText, nullable=True))
+
+    # Shared content this course links to
+    content_id = db.Column(db.Integer, db.ForeignKey('course_content.id'), nullable=True)
+    content = db.relationship('CourseContent', lazy=True)
+
+    @property
+    def source(self):
+        """Where this course's intro/links/lessons/tests live - shared content, or the row itself."""
+        return self.content if self.content_id else self
+
+    @property
+    def status(self):
+        return self.content.status if self.content_id else 'ready'
+
+    def lesson_query(self):
+        """Lessons of this course in order - the shared content's, or the course's own for older courses."""
+        if self.content_id:
+            query = Lesson.query.filter_by(content_id=self.content_id)
+        else:
+            query = Lesson.query.filter_by(course_id=self.id)
+        return query.order_by(Lesson.ordinal)
+
+class Lesson(db.Model):
+    """One lesson and its test, so a course page can load lessons one at a time."""
+    __table_args__ = (
+        db.Index('ix_lesson_content_id_ordinal', 'content_id', 'ordinal'),
+        db.Index('ix_lesson_course_id_ordinal', 'course_id', 'ordinal'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    # Exactly one of these is set - shared content, or a course saved before shared content existed
+    content_id = db.Column(db.Integer, db.ForeignKey('course_content.id'), nullable=True)
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=True)
+    ordinal = db.Column(db.Integer, nullable=False)
+    title = db.Column(db.Text, nullable=False)
+    content = db.Column(CompressedText, nullable=True)
+    test = db.Column(CompressedText, nullable=True)
+
+class CompressionDictionary(db.Model):
+    """Shared compression dictionary (see src.compression.Dictionaries), stored with the rows that use it."""
+    # crc32 of the dictionary, which compressed values name in their header
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    # New values are compressed with the one active dictionary
+    active = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+def add_missing_columns():
+    """db.create_all() never alters existing tables, so add columns introduced since a table was created."""
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                db.session.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+    db.session.commit()
+
+def add_missing_indexes():
+    """db.create_all() only creates indexes with their table, so create ones added to existing tables."""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
+def migrate_lessons_to_rows():
+    """Moves lessons and tests still stored as JSON blobs into Lesson rows. Idempotent, one row at a time."""
+    for model, owner in ((CourseContent, 'content_id'), (Course, 'course_id')):
+        ids = [row.id for row in db.session.query(model.id).filter(model.lessons_json.isnot(None))]
+        for row_id in ids:
+            row = db.session.get(model, row_id)
+            lessons = json.loads(row.lessons_json) if row.lessons_json else {}
+            tests = json.loads(row.tests_json) if row.tests_json else {}
+            for ordinal, (title, content) in enumerate(lessons.items()):
+                db.session.add(Lesson(ordinal=ordinal, title=title, content=content, test=tests.get(title), **{owner: row_id}))
+            row.lessons_json = None
+            row.tests_json = None
+            db.session.commit()
+
+def import_compression_dictionaries():
+    """Stores compression dictionaries trained before they were kept in the database. Idempotent."""
+    imported = dictionaries.import_files()
+    if imported:
+        logging.info(f"Imported {imported} compression dictionaries into the database")
+
+def compress_stored_content(train=False, recompress=False, batch_size=500, sample_size=2000):
+    """Rewrites stored course text in compressed form and returns {column: (bytes before, bytes after)}.
+
+    Rows written before compression are plain TEXT and are always rewritten; recompress=True also
+    rewrites compressed rows, e.g. with a newly trained dictionary.
+    """
+    columns = [
+        (table.name, column.name)
+        for table in db.metadata.sorted_tables
+        for column in table.columns
+        if isinstance(column.type, CompressedText)
+    ]
+
+    if train:
+        # Lesson bodies dominate storage, so they make the best samples
+        samples = [row.content for row in Lesson.query.options(db.load_only(Lesson.content)).filter(Lesson.content.isnot(None)).limit(sample_size)]
+        if samples:
+            dictionary_id = dictionaries.add(train_dictionary(samples))
+            logging.info(f"Trained compression dictionary {dictionary_id:08x} on {len(samples)} lessons")
+
+    report = {}
+    for table, column in columns:
+        type_filter = '' if recompress else f" AND typeof({column}) = 'text'"
+        column_type = db.metadata.tables[table].c[column].type
+        before = after = 0
+        last_id = 0
+        while True:
+            rows = db.session.execute(db.text(
+                f"SELECT id, {column} FROM {table} WHERE id > :last_id AND {column} IS NOT NULL{type_filter} ORDER BY id LIMIT :limit"
+            ), {'last_id': last_id, 'limit': batch_size}).fetchall()
+            if not rows:
+                break
+            for row_id, value in rows:
+                text = value if isinstance(value, str) else decompress(bytes(value))
+                stored = column_type.process_bind_param(text, db.engine.dialect)
+                before += len(text.encode('utf-8'))
+                after += len(stored)
+                db.session.execute(db.text(f"UPDATE {table} SET {column} = :value WHERE id = :id"), {'value': stored, 'id': row_id})
+                last_id = row_id
+            db.session.commit()
+        if before:
+            log_ratio(f"{table}.{column}", before, after)
+        report[f"{table}.{column}"] = (before, after)
+    return report
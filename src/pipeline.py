@@ -0,0 +1,496 @@
+from src.agents.registry import registry
+from src.logger import logging
+from src.exception import CustomException
+from src.tracing import span, add_span
+from src.checkpoint import NullCheckpoint
+from src.lesson_plan import lesson_title, subtopics_by_title
+from langgraph.graph import StateGraph, END, START
+from langchain_core.runnables import RunnableLambda
+from concurrent.futures import Future, wait
+from typing import TypedDict
+import asyncio
+import zlib
+import time
+import sys
+import os
+
+class PipelineProgress:
+
+    """No-op progress listener, subclass it to observe a course while it is being generated."""
+
+    def stage(self, name: str):
+
+        pass
+
+    def overview(self, topic_intro: str, study_links: str):
+
+        pass
+
+    def plan(self, lesson_list: list):
+
+        pass
+
+    def lesson(self, title: str, content: str):
+
+        pass
+
+    def test(self, title: str, test: str):
+
+        pass
+
+class MultiProgress(PipelineProgress):
+
+    """Fans progress out to several listeners, e.g. the job store and the course row."""
+
+    def __init__(self, *listeners):
+
+        self.listeners = listeners
+
+    def stage(self, name: str):
+
+        for listener in self.listeners:
+
+            listener.stage(name)
+
+    def overview(self, topic_intro: str, study_links: str):
+
+        for listener in self.listeners:
+
+            listener.overview(topic_intro, study_links)
+
+    def plan(self, lesson_list: list):
+
+        for listener in self.listeners:
+
+            listener.plan(lesson_list)
+
+    def lesson(self, title: str, content: str):
+
+        for listener in self.listeners:
+
+            listener.lesson(title, content)
+
+    def test(self, title: str, test: str):
+
+        for listener in self.listeners:
+
+            listener.test(title, test)
+
+def generation_mode(topic: str, subject: str, standard: int) -> str:
+
+    """
+    "separate" (a Tutoring call and a Testing call per lesson) or "fused" (one call writes both).
+
+    GENERATION_MODE picks one for every course; "ab" splits courses between them, FUSED_SHARE of
+    them fused, decided by the course itself so a regenerated course keeps its arm.
+    """
+
+    mode = os.getenv("GENERATION_MODE", "separate").lower()
+
+    if mode == "ab":
+
+        share = float(os.getenv("FUSED_SHARE", "0.5"))
+        bucket = zlib.crc32(f"{standard}|{subject}|{topic}".lower().encode("utf-8")) % 1000
+
+        return "fused" if bucket < share * 1000 else "separate"
+
+    return "fused" if mode == "fused" else "separate"
+
+class CourseState(TypedDict):
+
+    topic: str
+    subject: str
+    standard: int
+    mode: str
+    instructions: str
+    topic_intro: str
+    study_links: str
+    plan: list
+    lesson_list: list
+    lessons: dict
+    tests: dict
+
+def _options(config) -> tuple:
+
+    # Per-run listeners travel in the config, so one compiled graph serves every course
+    configurable = (config or {}).get("configurable", {})
+
+    return configurable.get("progress") or PipelineProgress(), configurable.get("checkpoint") or NullCheckpoint()
+
+def _ready(result) -> Future:
+
+    future = Future()
+    future.set_result(result)
+
+    return future
+
+def _finish_test(future, title: str, progress: PipelineProgress, checkpoint):
+
+    # Failed tests are surfaced by the final result() call, only successes are saved and streamed
+    if future.exception() is None:
+
+        if checkpoint.get(f"test:{title}") is None:
+
+            checkpoint.put(f"test:{title}", future.result())
+
+        progress.test(title, future.result())
+
+def _research(state: CourseState, config) -> dict:
+
+    progress, checkpoint = _options(config)
+    progress.stage("research")
+
+    output = checkpoint.get("research")
+
+    if output is None:
+
+        assistant_output = registry.assistant.graph.invoke({"standard": str(state["standard"]), "subject": state["subject"], "topic": state["topic"]})
+        output = {
+            "instructions": assistant_output['instructions'],
+            "topic_intro": assistant_output.get('topic_intro', 'No intro generated.'),
+            "study_links": assistant_output.get('study_links', 'No links found.')
+        }
+        checkpoint.put("research", output)
+
+    progress.overview(output["topic_intro"], output["study_links"])
+
+    return output
+
+async def _aresearch(state: CourseState, config) -> dict:
+
+    progress, checkpoint = _options(config)
+    await asyncio.to_thread(progress.stage, "research")
+
+    output = checkpoint.get("research")
+
+    if output is None:
+
+        assistant_output = await registry.assistant.graph.ainvoke({"standard": str(state["standard"]), "subject": state["subject"], "topic": state["topic"]})
+        output = {
+            "instructions": assistant_output['instructions'],
+            "topic_intro": assistant_output.get('topic_intro', 'No intro generated.'),
+            "study_links": assistant_output.get('study_links', 'No links found.')
+        }
+        await asyncio.to_thread(checkpoint.put, "research", output)
+
+    await asyncio.to_thread(progress.overview, output["topic_intro"], output["study_links"])
+
+    return output
+
+def _plan(state: CourseState, config) -> dict:
+
+    progress, checkpoint = _options(config)
+    progress.stage("planning")
+
+    # A resumed course keeps the plan, and the mode, it started with
+    plan = checkpoint.get("plan")
+
+    if plan is None:
+
+        entries = registry.tutor.plan_lessons(state["instructions"], state["standard"], state["subject"], state["topic"])
+        plan = {
+            "plan": entries,
+            "lesson_list": [lesson_title(entry) for entry in entries],
+            "mode": state.get("mode") or generation_mode(state["topic"], state["subject"], state["standard"])
+        }
+        checkpoint.put("plan", plan)
+
+    progress.plan(plan["lesson_list"])
+
+    return plan
+
+async def _aplan(state: CourseState, config) -> dict:
+
+    progress, checkpoint = _options(config)
+    await asyncio.to_thread(progress.stage, "planning")
+
+    plan = checkpoint.get("plan")
+
+    if plan is None:
+
+        entries = await registry.tutor.aplan_lessons(state["instructions"], state["standard"], state["subject"], state["topic"])
+        plan = {
+            "plan": entries,
+            "lesson_list": [lesson_title(entry) for entry in entries],
+            "mode": state.get("mode") or generation_mode(state["topic"], state["subject"], state["standard"])
+        }
+        await asyncio.to_thread(checkpoint.put, "plan", plan)
+
+    await asyncio.to_thread(progress.plan, plan["lesson_list"])
+
+    return plan
+
+def _lessons(state: CourseState, config) -> dict:
+
+    progress, checkpoint = _options(config)
+    progress.stage("lessons")
+
+    tutor = registry.tutor
+    tester = registry.tester
+    topic, subject, standard, mode = state["topic"], state["subject"], state["standard"], state["mode"]
+    lesson_list = state["lesson_list"]
+    # Checkpoints written before plans were structured have no subtopics, their lessons go by title alone
+    subtopics = subtopics_by_title(state.get("plan"))
+    generated_lessons = {}
+    test_futures = {}
+    tests_started = None
+
+    def finished(title, content, test):
+
+        nonlocal tests_started
+
+        generated_lessons[title] = content
+        progress.lesson(title, content)
+
+        if title not in test_futures:
+
+            tests_started = tests_started or time.perf_counter()
+            # Written by the fused call or saved by an earlier attempt, otherwise the Testing Agent writes it
+            test = test or checkpoint.get(f"test:{title}")
+            future = tester.submit(title, subject, standard, subtopics.get(title)) if test is None else _ready(test)
+            future.add_done_callback(lambda done, title = title: _finish_test(done, title, progress, checkpoint))
+            test_futures[title] = future
+
+    # Lessons finished by an earlier attempt are replayed, only the rest are generated
+    pending = []
+
+    for title in dict.fromkeys(lesson_list):
+
+        saved = checkpoint.get(f"lesson:{title}")
+
+        if saved is None:
+
+            pending.append(title)
+
+        else:
+
+            finished(title, saved, None)
+
+    if mode == "fused":
+
+        lesson_stream = tutor.stream_fused_lessons(pending, topic, subject, standard, subtopics)
+
+    else:
+
+        lesson_stream = ((title, content, None) for title, content in tutor.stream_lessons(pending, topic, subject, standard, subtopics))
+
+    with span("get_lessons", mode = mode):
+
+        for title, content, test in lesson_stream:
+
+            checkpoint.put(f"lesson:{title}", content)
+            finished(title, content, test)
+
+    progress.stage("tests")
+
+    wait(list(test_futures.values()))
+
+    # Tests overlap the lessons, so their stage runs from the first submission to the last result
+    if tests_started is not None:
+
+        failed = any(future.exception() is not None for future in test_futures.values())
+        add_span("generate_tests", time.perf_counter() - tests_started, outcome = "error" if failed else "ok")
+
+    # Restore planning order, items were streamed in completion order
+    return {
+        "lessons": {title: generated_lessons[title] for title in lesson_list},
+        "tests": {title: test_futures[title].result() for title in lesson_list}
+    }
+
+async def _alessons(state: CourseState, config) -> dict:
+
+    progress, checkpoint = _options(config)
+    await asyncio.to_thread(progress.stage, "lessons")
+
+    tutor = registry.tutor
+    tester = registry.tester
+    topic, subject, standard, mode = state["topic"], state["subject"], state["standard"], state["mode"]
+    lesson_list = state["lesson_list"]
+    # Checkpoints written before plans were structured have no subtopics, their lessons go by title alone
+    subtopics = subtopics_by_title(state.get("plan"))
+    generated_lessons = {}
+    test_tasks = {}
+    tests_started = None
+
+    async def test(title, result = None):
+
+        result = result or checkpoint.get(f"test:{title}")
+
+        if result is None:
+
+            result = await tester.agenerate(title, subject, standard, subtopics.get(title))
+
+        if checkpoint.get(f"test:{title}") is None:
+
+            await asyncio.to_thread(checkpoint.put, f"test:{title}", result)
+
+        await asyncio.to_thread(progress.test, title, result)
+
+        return result
+
+    async def finished(title, content, result):
+
+        nonlocal tests_started
+
+        generated_lessons[title] = content
+        await asyncio.to_thread(progress.lesson, title, content)
+
+        if title not in test_tasks:
+
+            tests_started = tests_started or time.perf_counter()
+            test_tasks[title] = asyncio.ensure_future(test(title, result))
+
+    async def separate_lessons(titles):
+
+        async for title, content in tutor.astream_lessons(titles, topic, subject, standard, subtopics):
+
+            yield title, content, None
+
+    try:
+
+        pending = []
+
+        for title in dict.fromkeys(lesson_list):
+
+            saved = checkpoint.get(f"lesson:{title}")
+
+            if saved is None:
+
+                pending.append(title)
+
+            else:
+
+                await finished(title, saved, None)
+
+        lesson_stream = tutor.astream_fused_lessons(pending, topic, subject, standard, subtopics) if mode == "fused" else separate_lessons(pending)
+
+        with span("get_lessons", mode = mode):
+
+            async for title, content, result in lesson_stream:
+
+                await asyncio.to_thread(checkpoint.put, f"lesson:{title}", content)
+                await finished(title, content, result)
+
+        await asyncio.to_thread(progress.stage, "tests")
+
+        tests = dict(zip(test_tasks, await asyncio.gather(*test_tasks.values())))
+
+        if tests_started is not None:
+
+            add_span("generate_tests", time.perf_counter() - tests_started)
+
+    except Exception:
+
+        # Tests already under way still finish and are checkpointed, the retry then skips them
+        await asyncio.gather(*test_tasks.values(), return_exceptions = True)
+        raise
+
+    finally:
+
+        for task in test_tasks.values():
+
+            task.cancel()
+
+    return {
+        "lessons": {title: generated_lessons[title] for title in lesson_list},
+        "tests": {title: tests[title] for title in lesson_list}
+    }
+
+def _build_course_graph():
+
+    graph = StateGraph(CourseState)
+
+    # research (Assistant Agent) -> plan (Tutoring Agent) -> lessons (Tutoring and Testing Agents, pipelined)
+    graph.add_node("research", RunnableLambda(_research, afunc = _aresearch))
+    graph.add_node("plan", RunnableLambda(_plan, afunc = _aplan))
+    graph.add_node("lessons", RunnableLambda(_lessons, afunc = _alessons))
+
+    graph.add_edge(START, "research")
+    graph.add_edge("research", "plan")
+    graph.add_edge("plan", "lessons")
+    graph.add_edge("lessons", END)
+
+    return graph.compile()
+
+_course_graph = None
+
+def course_graph():
+
+    """The course generation graph, compiled once per process."""
+
+    global _course_graph
+
+    if _course_graph is None:
+
+        _course_graph = _build_course_graph()
+
+    return _course_graph
+
+def _run_config(progress: PipelineProgress, checkpoint) -> dict:
+
+    return {"configurable": {"progress": progress or PipelineProgress(), "checkpoint": checkpoint or NullCheckpoint()}}
+
+def _result(state: CourseState) -> dict:
+
+    return {
+        "topic_intro": state["topic_intro"],
+        "study_links": state["study_links"],
+        "lessons": state["lessons"],
+        "tests": state["tests"],
+        "plan": state.get("plan") or [],
+        "mode": state["mode"]
+    }
+
+def generate_course(topic: str, subject: str, standard: int, progress: PipelineProgress = None, mode: str = None, checkpoint = None) -> dict:
+
+    """
+    Run the Assistant -> Tutoring -> Testing chain as one streaming graph.
+
+    Each lesson is handed to the Testing Agent the moment the Tutoring Agent finishes it,
+    so test generation overlaps lesson generation instead of waiting for the whole course.
+    In "fused" mode (see generation_mode) the lesson call writes the test too, and the Testing
+    Agent only covers lessons without one.
+    `progress` is notified of every stage and of each lesson and test as it completes.
+    The result's "plan" is the validated lesson plan (src.lesson_plan) its lessons were generated from.
+    With a `checkpoint` (src.checkpoint) every finished step, lesson and test is saved as it
+    completes, and a later run with the same checkpoint resumes after the last of them.
+    """
+
+    try:
+
+        logging.info("Running course generation pipeline...")
+
+        initial_state = {"topic": topic, "subject": subject, "standard": int(standard), "mode": mode}
+        final_state = course_graph().invoke(initial_state, config = _run_config(progress, checkpoint))
+
+        logging.info("Course generation pipeline finished...")
+
+        return _result(final_state)
+
+    except Exception as e:
+
+        raise CustomException(e, sys)
+
+async def agenerate_course(topic: str, subject: str, standard: int, progress: PipelineProgress = None, mode: str = None, checkpoint = None) -> dict:
+
+    """
+    generate_course() on the event loop.
+
+    LLM and search calls are awaited instead of each holding a thread, so one process can keep many
+    courses in flight. Progress listeners and checkpoints write to disk, so they are called off the loop.
+    """
+
+    try:
+
+        logging.info("Running async course generation pipeline...")
+
+        initial_state = {"topic": topic, "subject": subject, "standard": int(standard), "mode": mode}
+        final_state = await course_graph().ainvoke(initial_state, config = _run_config(progress, checkpoint))
+
+        logging.info("Async course generation pipeline finished...")
+
+        return _result(final_state)
+
+    except Exception as e:
+
+        raise CustomException(e, sys)
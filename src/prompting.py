@@ -0,0 +1,212 @@
+from src.logger import logging
+import re
+import os
+
+try:
+
+    import tiktoken
+
+except ImportError:
+
+    tiktoken = None
+
+# Context tokens each stage may spend on pasted-in material (search results, intro, instructions),
+# on top of its own fixed wording. Overridden per stage with PROMPT_BUDGET_<STAGE>, e.g. PROMPT_BUDGET_PLANNING.
+DEFAULT_BUDGETS = {
+    "user_interaction": 1200,
+    "instructions": 1600,
+    "planning": 1500,
+}
+
+_PIECES = re.compile(r"\w+|[^\w\s]")
+
+_encoding = None
+
+def _get_encoding():
+
+    global _encoding
+
+    if _encoding is None and tiktoken is not None:
+
+        try:
+
+            _encoding = tiktoken.get_encoding("cl100k_base")
+
+        except Exception:
+
+            # The encoding is downloaded on first use, offline workers fall back to the estimate
+            _encoding = False
+
+    return _encoding or None
+
+def count_tokens(text: str) -> int:
+
+    """
+    Local token count of `text`.
+
+    Uses tiktoken's cl100k encoding when it is installed. Otherwise it estimates: one token per
+    punctuation mark and one per 4 characters of each word, within ~10% of Llama's tokenizer on
+    English prose and HTML.
+    """
+
+    if not text:
+
+        return 0
+
+    encoding = _get_encoding()
+
+    if encoding is not None:
+
+        return len(encoding.encode(text, disallowed_special = ()))
+
+    return sum((len(piece) + 3) // 4 for piece in _PIECES.findall(text))
+
+def budget(stage: str) -> int:
+
+    return int(os.getenv(f"PROMPT_BUDGET_{stage.upper()}", str(DEFAULT_BUDGETS.get(stage, 1500))))
+
+def truncate(text: str, max_tokens: int) -> str:
+
+    """Cut `text` to about `max_tokens`, at the last line or sentence end before the limit when there is one."""
+
+    if count_tokens(text) <= max_tokens:
+
+        return text
+
+    # Token positions from the estimate are close enough to find the cut
+    used = 0
+    end = len(text)
+
+    for match in _PIECES.finditer(text):
+
+        used += (len(match.group()) + 3) // 4
+
+        if used > max_tokens:
+
+            end = match.start()
+            break
+
+    cut = text[:end]
+    boundary = max(cut.rfind("\n"), cut.rfind(". "))
+
+    if boundary > len(cut) * 0.7:
+
+        cut = cut[:boundary + 1]
+
+    return cut.rstrip() + " ..."
+
+def dedupe(*sections: str) -> list:
+
+    """
+    Drop lines that already appeared earlier, in the same or an earlier section.
+
+    Search results, the intro written from them and the instructions written from both repeat the
+    same links and sentences; each is kept once, where it first appears.
+    """
+
+    seen = set()
+    compacted = []
+
+    for section in sections:
+
+        lines = []
+
+        for line in (section or "").splitlines():
+
+            key = " ".join(line.split()).lower()
+
+            if key and key in seen:
+
+                continue
+
+            if key:
+
+                seen.add(key)
+
+            lines.append(line)
+
+        compacted.append("\n".join(lines).strip())
+
+    return compacted
+
+def fit(stage: str, **sections: str) -> dict:
+
+    """
+    De-duplicate the context sections of a prompt and trim them to the stage's budget.
+
+    Sections are given in priority order; when they do not fit, the budget is shared out so a section
+    smaller than its share is kept whole and the rest is split between the larger ones.
+    """
+
+    names = list(sections)
+    texts = dict(zip(names, dedupe(*sections.values())))
+    sizes = {name: count_tokens(text) for name, text in texts.items()}
+    remaining = budget(stage)
+
+    if sum(sizes.values()) <= remaining:
+
+        return texts
+
+    # Smallest first, each takes at most an equal share of what is left
+    for index, name in enumerate(sorted(names, key = lambda name: sizes[name])):
+
+        share = remaining // (len(names) - index)
+
+        if sizes[name] > share:
+
+            texts[name] = truncate(texts[name], share)
+
+        remaining -= min(sizes[name], share)
+
+    return texts
+
+def compact_search_results(response, max_results: int = 5, snippet_tokens: int = 60) -> str:
+
+    """
+    Search results as one short line each - title, URL and the start of the snippet.
+
+    Tavily returns a dict with a "results" list whose "content" (and sometimes "raw_content") runs to
+    several KB per result, far more than a prompt needs to cite a link.
+    """
+
+    if isinstance(response, dict):
+
+        response = response.get("results", [])
+
+    if isinstance(response, str):
+
+        return truncate(response, max_results * snippet_tokens)
+
+    lines = []
+
+    for item in list(response)[:max_results]:
+
+        if not isinstance(item, dict):
+
+            lines.append(str(item))
+            continue
+
+        line = item.get("url", "")
+
+        if item.get("title"):
+
+            line = f"{item['title']} - {line}"
+
+        if item.get("content"):
+
+            line += ": " + truncate(" ".join(item["content"].split()), snippet_tokens)
+
+        lines.append(line)
+
+    return "\n".join(lines)
+
+def log_prompt(stage: str, prompt) -> int:
+
+    """Log the token count of a prompt (a string or a list of messages) going to the LLM, and return it."""
+
+    text = prompt if isinstance(prompt, str) else "\n".join(str(getattr(message, "content", message)) for message in prompt)
+    tokens = count_tokens(text)
+
+    logging.info(f"Prompt tokens for {stage}: {tokens}")
+
+    return tokens
@@ -0,0 +1,267 @@
+from src.logger import logging
+from src.course_cache import CACHE_VERSION
+import numpy as np
+import threading
+import zlib
+import re
+import os
+
+STOP_WORDS = {"a", "an", "and", "the", "of", "to", "in", "on", "for", "with", "is", "its", "their", "by", "as"}
+ALIASES = {"intro": "introduction", "basics": "basic", "maths": "mathematics", "math": "mathematics"}
+
+# Leading "Lesson 3:", "2 -", "**Lesson 12.**" style numbering, which differs between courses for the same lesson
+NUMBERING = re.compile(r"^[\s\*#\-]*(lesson|chapter|unit|module|day)?\s*\d+\s*[:.)\-–—]*\s*", re.IGNORECASE)
+
+def tokenize(title: str) -> list:
+
+    title = NUMBERING.sub("", title.lower())
+
+    return [ALIASES.get(word, word) for word in re.findall(r"[a-z0-9]+", title) if word not in STOP_WORDS]
+
+def _bucket(feature: str, dims: int) -> int:
+
+    # crc32 is stable across processes, unlike hash()
+    return zlib.crc32(feature.encode("utf-8")) % dims
+
+class LessonIndex:
+
+    """
+    Local similarity index over previously generated lessons, partitioned by (version, subject, standard, topic).
+
+    Lesson titles are turned into hashed TF-IDF vectors of words and character trigrams, which makes
+    "Lesson 3: Introduction to Fractions" and "Lesson 2 - Intro to fractions" land on the same vector,
+    and searched with a NumPy cosine similarity. Sources (e.g. saved courses) are added incrementally,
+    each at most once. A lesson is only reused within the same course topic: generic titles such as
+    "Lesson 1: Introduction" or "Revision and Practice Test" read alike in every course. Lessons of
+    an older CACHE_VERSION are never reused, and a source is removed again once its content expires.
+    """
+
+    def __init__(self, dims: int = 2048, threshold: float = None):
+
+        self.dims = dims
+        self.threshold = threshold or float(os.getenv("LESSON_REUSE_THRESHOLD", "0.85"))
+        self.partitions = {}
+        self.document_frequency = np.zeros(dims, dtype = np.float32)
+        self.documents = 0
+        self.sources = set()
+        self.lock = threading.Lock()
+
+    def _vectorize(self, title: str) -> np.ndarray:
+
+        vector = np.zeros(self.dims, dtype = np.float32)
+
+        for word in tokenize(title):
+
+            # Numbers tell "part 1" from "part 2", so they weigh more than ordinary words
+            vector[_bucket("w:" + word, self.dims)] += 2.0 if word.isdigit() else 1.0
+            padded = f"#{word}#"
+
+            for start in range(len(padded) - 2):
+
+                vector[_bucket("c:" + padded[start:start + 3], self.dims)] += 0.3
+
+        return vector
+
+    @staticmethod
+    def _partition_key(subject: str, standard, topic: str, version: int = None) -> tuple:
+
+        # Topics are normalised like titles, so "Intro to Fractions" and "introduction to fractions" match
+        return (
+            CACHE_VERSION if version is None else int(version),
+            " ".join(str(subject).lower().split()),
+            int(standard),
+            " ".join(tokenize(str(topic or "")))
+        )
+
+    def add(self, subject: str, standard, topic: str, title: str, content: str, version: int = None, source: str = None):
+
+        vector = self._vectorize(title)
+
+        if not vector.any() or not content:
+
+            return
+
+        with self.lock:
+
+            partition = self.partitions.setdefault(
+                self._partition_key(subject, standard, topic, version),
+                {"rows": [], "matrix": None, "titles": [], "contents": [], "sources": []}
+            )
+            # The stacked matrix is rebuilt lazily on the next search, so bulk adds stay linear
+            partition["rows"].append(vector)
+            partition["matrix"] = None
+            partition["titles"].append(title)
+            partition["contents"].append(content)
+            partition["sources"].append(source)
+            self.document_frequency += vector > 0
+            self.documents += 1
+
+    def add_source(self, source: str, subject: str, standard, topic: str, lessons: dict, version: int = None) -> bool:
+
+        """Index every lesson of one saved course, unless that source was already indexed."""
+
+        with self.lock:
+
+            if source in self.sources:
+
+                return False
+
+            self.sources.add(source)
+
+        for title, content in lessons.items():
+
+            self.add(subject, standard, topic, title, content, version, source)
+
+        return True
+
+    def remove_source(self, source: str) -> bool:
+
+        """Drop every lesson of one source, e.g. content that expired or was evicted from the course cache."""
+
+        with self.lock:
+
+            if source not in self.sources:
+
+                return False
+
+            self.sources.discard(source)
+
+            for key, partition in list(self.partitions.items()):
+
+                keep = [index for index, owner in enumerate(partition["sources"]) if owner != source]
+
+                if len(keep) == len(partition["sources"]):
+
+                    continue
+
+                for index in set(range(len(partition["sources"]))) - set(keep):
+
+                    self.document_frequency -= partition["rows"][index] > 0
+                    self.documents -= 1
+
+                if not keep:
+
+                    del self.partitions[key]
+                    continue
+
+                for field in ("rows", "titles", "contents", "sources"):
+
+                    partition[field] = [partition[field][index] for index in keep]
+
+                partition["matrix"] = None
+
+        return True
+
+    def search(self, subject: str, standard, topic: str, title: str, k: int = 1, version: int = None) -> list:
+
+        """Top `k` (score, title, content) matches within the same version, subject, standard and topic."""
+
+        query = self._vectorize(title)
+
+        with self.lock:
+
+            partition = self.partitions.get(self._partition_key(subject, standard, topic, version))
+
+            if partition is None or not query.any():
+
+                return []
+
+            if partition["matrix"] is None:
+
+                partition["matrix"] = np.vstack(partition["rows"])
+
+            vectors = partition["matrix"]
+            idf = np.log((self.documents + 1) / (self.document_frequency + 1)) + 1
+            titles = list(partition["titles"])
+            contents = list(partition["contents"])
+
+        weighted = vectors * idf
+        query = query * idf
+        norms = np.linalg.norm(weighted, axis = 1) * np.linalg.norm(query)
+        scores = (weighted @ query) / np.maximum(norms, 1e-9)
+        best = np.argsort(-scores)[:k]
+
+        return [(float(scores[i]), titles[i], contents[i]) for i in best]
+
+    def lookup(self, subject: str, standard, topic: str, title: str) -> str:
+
+        """Content of the closest previously generated lesson, if it clears the similarity threshold."""
+
+        matches = self.search(subject, standard, topic, title)
+
+        if matches and matches[0][0] >= self.threshold:
+
+            score, match, content = matches[0]
+            logging.debug(f"Reusing lesson '{match}' for '{title}' (similarity {score:.2f})")
+
+            return content
+
+        return None
+
+_lesson_index = None
+_lesson_index_lock = threading.Lock()
+
+def get_lesson_index() -> LessonIndex:
+
+    """Process wide lesson index, or None when reuse is turned off with LESSON_REUSE=0."""
+
+    global _lesson_index
+
+    if os.getenv("LESSON_REUSE", "1") == "0":
+
+        return None
+
+    with _lesson_index_lock:
+
+        if _lesson_index is None:
+
+            _lesson_index = LessonIndex()
+
+        return _lesson_index
+
+def _lessons(condition) -> dict:
+
+    from src.models import db, Lesson
+
+    rows = db.session.query(Lesson.title, Lesson.content).filter(condition).order_by(Lesson.ordinal)
+
+    return {title: content for title, content in rows}
+
+def sync_from_database(index: LessonIndex, cache) -> int:
+
+    """
+    Bring the index in line with the content `cache` (a CourseCache) still serves (needs an app context).
+
+    Only finished content of the current CACHE_VERSION that is still attached to the cache and not
+    expired is indexed; sources whose content was since detached, evicted or expired are removed.
+    Lessons of courses saved before the shared content table are not reused, their version is unknown.
+    Only ids and dates are read for content already indexed, so repeated syncs stay cheap.
+    """
+
+    from src.models import db, CourseContent, Lesson
+
+    candidates = CourseContent.query.options(
+        db.load_only(CourseContent.id, CourseContent.status, CourseContent.created_at, CourseContent.job_id)
+    ).filter(
+        CourseContent.status == 'ready',
+        CourseContent.cache_key.isnot(None),
+        CourseContent.version == CACHE_VERSION
+    )
+    live = {f"content:{content.id}": content.id for content in candidates if cache.usable(content)}
+
+    removed = sum(index.remove_source(source) for source in list(index.sources) if source not in live)
+    new_ids = [content_id for source, content_id in live.items() if source not in index.sources]
+    added = 0
+
+    for content in CourseContent.query.filter(CourseContent.id.in_(new_ids)).all() if new_ids else []:
+
+        added += index.add_source(
+            f"content:{content.id}", content.subject, content.standard, content.topic,
+            _lessons(Lesson.content_id == content.id), content.version
+        )
+
+    if added or removed:
+
+        logging.info(f"Lesson index synced {added} new courses, removed {removed} expired ones")
+
+    return added
@@ -0,0 +1,263 @@
+from src.logger import logging
+from src.key_pool import _is_rate_limit, _retry_after
+from src.tracing import metrics
+from collections import deque
+import threading
+import time
+import os
+
+# Subjects whose lessons and tests lean on worked reasoning, where the larger model earns its cost
+STEM_SUBJECTS = ("math", "physics", "chemistry", "biology", "computer", "statistics", "economics", "accountancy", "engineering")
+
+def routing_enabled() -> bool:
+
+    """MODEL_ROUTER=1 lets each agent pick its model per call, otherwise every call keeps its fixed model."""
+
+    return os.getenv("MODEL_ROUTER", "0") == "1"
+
+def difficulty(subject: str = None, standard: int = None, subtopics: int = 0, prompt_tokens: int = 0) -> float:
+
+    """
+    Cheap 0..1 estimate of how hard a lesson or test is to write well.
+
+    Only what goes beyond a typical lesson counts: standards above 8, a STEM subject, more than the
+    usual 3 subtopics and a prompt over 1000 tokens; no model call is needed to compute it. A typical
+    lesson scores under the default threshold of 0.6 even at standard 12 in a STEM subject (0.5), so
+    the large model only gets upper-standard STEM lessons with 5+ subtopics or unusually long prompts.
+    """
+
+    score = 0.3 * min(max(int(standard or 0) - 8, 0), 4) / 4
+
+    if subject and any(name in subject.lower() for name in STEM_SUBJECTS):
+
+        score += 0.2
+
+    score += 0.3 * min(max((subtopics or 0) - 3, 0), 5) / 5
+    score += 0.2 * min(max((prompt_tokens or 0) - 1000, 0), 2000) / 2000
+
+    return round(min(score, 1.0), 3)
+
+def _is_throttled(error: Exception) -> bool:
+
+    # 429s and timeouts both mean the model is saturated right now, another one may answer
+    return _is_rate_limit(error) or "timeout" in type(error).__name__.lower()
+
+class ModelStats:
+
+    """Live view of one model as seen by a router: recent latencies, calls in the last minute and cooldown."""
+
+    def __init__(self, window: int = 100):
+
+        self.latencies = deque(maxlen = window)
+        self.call_times = deque()
+        self.cooldown_until = 0.0
+        self.calls = 0
+        self.throttled = 0
+
+    def p90(self) -> float:
+
+        if len(self.latencies) < 10:
+
+            return 0.0
+
+        ordered = sorted(self.latencies)
+
+        return ordered[int(len(ordered) * 0.9) - 1]
+
+    def calls_last_minute(self, now: float) -> int:
+
+        while self.call_times and self.call_times[0] < now - 60:
+
+            self.call_times.popleft()
+
+        return len(self.call_times)
+
+class ModelRouter:
+
+    """
+    Picks the model for each call from a difficulty score and live per-model stats.
+
+    Calls scoring at least `threshold` go to the large model, the rest to the small one. A model that
+    is cooling down after a 429, has used its requests-per-minute share, or whose p90 latency is over
+    `max_p90` is skipped while the other one is not. The result is a chain, best model first; when a
+    call is throttled the next model in the chain takes it.
+
+    `small` and `large` are (name, llm) pairs; the names are what choose() returns, so an LLMScheduler
+    can route to its clients of the same name.
+    """
+
+    def __init__(self, name: str, small: tuple, large: tuple, threshold: float = None, requests_per_minute: dict = None, max_p90: float = None, cooldown: float = None):
+
+        self.name = name
+        self.tiers = {"small": small, "large": large}
+        self.tier_of = {small[0]: "small", large[0]: "large"}
+        self.threshold = threshold if threshold is not None else float(os.getenv("ROUTER_LARGE_THRESHOLD", "0.6"))
+        self.requests_per_minute = requests_per_minute or {
+            tier: int(os.getenv(f"ROUTER_RPM_{tier.upper()}", "30")) for tier in self.tiers
+        }
+        # 0 disables the latency check
+        self.max_p90 = max_p90 if max_p90 is not None else float(os.getenv("ROUTER_MAX_P90_SECONDS", "0"))
+        self.cooldown = cooldown if cooldown is not None else float(os.getenv("ROUTER_COOLDOWN_SECONDS", "10"))
+        self.stats = {tier: ModelStats() for tier in self.tiers}
+        self.lock = threading.Lock()
+
+    def _unavailable(self, tier: str, now: float) -> str:
+
+        # Called with self.lock held; the reason a tier should be skipped, or None
+        stats = self.stats[tier]
+
+        if stats.cooldown_until > now:
+
+            return "throttled"
+
+        if stats.calls_last_minute(now) >= self.requests_per_minute[tier]:
+
+            return "quota"
+
+        if self.max_p90 and stats.p90() > self.max_p90:
+
+            return "slow"
+
+        return None
+
+    def choose(self, score: float) -> list:
+
+        """Model names to try in order, for a call of difficulty `score` (see difficulty())."""
+
+        preferred = "large" if score >= self.threshold else "small"
+        other = "small" if preferred == "large" else "large"
+
+        with self.lock:
+
+            now = time.monotonic()
+            reason = self._unavailable(preferred, now)
+
+            if reason is not None and self._unavailable(other, now) is None:
+
+                chain = [other, preferred]
+
+            else:
+
+                chain, reason = [preferred, other], "difficulty"
+
+            stats = self.stats[chain[0]]
+            stats.call_times.append(now)
+            stats.calls += 1
+
+        metrics.route(self.name, chain[0], reason)
+
+        return [self.tiers[tier][0] for tier in chain]
+
+    def record(self, name: str, seconds: float = None, error: Exception = None) -> bool:
+
+        """Feed back the outcome of a call to model `name`; True when it was throttled and should fall back."""
+
+        tier = self.tier_of[name]
+        throttled = error is not None and _is_throttled(error)
+
+        with self.lock:
+
+            stats = self.stats[tier]
+
+            if error is None and seconds is not None:
+
+                stats.latencies.append(seconds)
+
+            if throttled:
+
+                stats.throttled += 1
+                stats.cooldown_until = max(stats.cooldown_until, time.monotonic() + max(_retry_after(error), self.cooldown))
+
+        if throttled:
+
+            logging.info(f"{self.name} router: {name} throttled ({type(error).__name__}), falling back")
+
+        return throttled
+
+    def fallback(self, chain: list) -> list:
+
+        """The chain with its first model moved to the end, after that model was throttled."""
+
+        chain = chain[1:] + chain[:1]
+
+        with self.lock:
+
+            stats = self.stats[self.tier_of[chain[0]]]
+            stats.call_times.append(time.monotonic())
+            stats.calls += 1
+
+        metrics.route(self.name, self.tier_of[chain[0]], "fallback")
+
+        return chain
+
+    def _llm(self, name: str):
+
+        return self.tiers[self.tier_of[name]][1]
+
+    def invoke(self, prompt, score: float, *args, **kwargs):
+
+        chain = self.choose(score)
+
+        for attempt in range(len(chain)):
+
+            started = time.perf_counter()
+
+            try:
+
+                response = self._llm(chain[0]).invoke(prompt, *args, **kwargs)
+
+            except Exception as e:
+
+                if not self.record(chain[0], error = e) or attempt == len(chain) - 1:
+
+                    raise
+
+                chain = self.fallback(chain)
+                continue
+
+            self.record(chain[0], time.perf_counter() - started)
+
+            return response
+
+    async def ainvoke(self, prompt, score: float, *args, **kwargs):
+
+        chain = self.choose(score)
+
+        for attempt in range(len(chain)):
+
+            started = time.perf_counter()
+
+            try:
+
+                response = await self._llm(chain[0]).ainvoke(prompt, *args, **kwargs)
+
+            except Exception as e:
+
+                if not self.record(chain[0], error = e) or attempt == len(chain) - 1:
+
+                    raise
+
+                chain = self.fallback(chain)
+                continue
+
+            self.record(chain[0], time.perf_counter() - started)
+
+            return response
+
+    def snapshot(self) -> dict:
+
+        with self.lock:
+
+            now = time.monotonic()
+
+            return {
+                tier: {
+                    "model": self.tiers[tier][0],
+                    "calls": stats.calls,
+                    "throttled": stats.throttled,
+                    "calls_last_minute": stats.calls_last_minute(now),
+                    "p90_seconds": round(stats.p90(), 3),
+                    "cooling_down": stats.cooldown_until > now
+                }
+                for tier, stats in self.stats.items()
+            }
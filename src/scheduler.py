@@ -0,0 +1,192 @@
+from src.logger import logging
+from concurrent.futures import Future
+from collections import deque
+import contextvars
+import threading
+import time
+
+class RateLimiter:
+
+    """Token bucket that paces calls to a fixed number of requests per minute."""
+
+    def __init__(self, requests_per_minute: int):
+
+        self.capacity = max(1, requests_per_minute)
+        self.tokens = float(self.capacity)
+        self.refill_rate = self.capacity / 60.0
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+
+        while True:
+
+            with self.lock:
+
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_rate)
+                self.updated_at = now
+
+                if self.tokens >= 1:
+
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.refill_rate
+
+            time.sleep(wait)
+
+class LLMClient:
+
+    """One LLM client registered with the scheduler, with its own concurrency cap and rate budget."""
+
+    def __init__(self, name: str, llm, max_concurrency: int, requests_per_minute: int):
+
+        self.name = name
+        self.llm = llm
+        self.max_concurrency = max(1, max_concurrency)
+        self.rate_limiter = RateLimiter(requests_per_minute)
+        self.workers = 0
+        self.completed = 0
+
+class LLMScheduler:
+
+    """
+    Dispatches prompts across several LLM clients in parallel.
+
+    All prompts go into one shared queue and every client runs up to `max_concurrency`
+    worker threads pulling from it, so work goes to whichever client frees up first.
+    A failed prompt is put back on the queue and may be picked up by another client.
+    Workers exit after `idle_timeout` seconds without work and are respawned on demand.
+
+    With a `router` (src.router.ModelRouter over the clients' names) each prompt is pinned to the
+    client the router picks for its difficulty, and a throttled prompt moves to the next one.
+    """
+
+    def __init__(self, clients: list, max_retries: int = 3, idle_timeout: float = 5.0, router = None):
+
+        self.clients = clients
+        self.max_retries = max(1, max_retries)
+        self.idle_timeout = idle_timeout
+        self.router = router
+        # (prompt, future, attempt, context, route) - route is None, or the client names to try in order
+        self.queue = deque()
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+
+    def submit(self, prompt, score: float = 0.0) -> Future:
+
+        future = Future()
+
+        # A response cached under any client's model answers the prompt without queueing it
+        for client in self.clients:
+
+            cached = client.llm.peek(prompt) if hasattr(client.llm, "peek") else None
+
+            if cached is not None:
+
+                future.set_result(cached)
+                return future
+
+        route = self.router.choose(score) if self.router is not None else None
+
+        with self.lock:
+
+            # The caller's context travels with the prompt, so the call lands in the caller's trace
+            self._put((prompt, future, 1, contextvars.copy_context(), route))
+
+        return future
+
+    def map(self, prompts: list) -> list:
+
+        futures = [self.submit(prompt) for prompt in prompts]
+
+        return [future.result() for future in futures]
+
+    def _put(self, item: tuple):
+
+        # Called with self.lock held
+        self.queue.append(item)
+        self._spawn_workers()
+        self.ready.notify_all()
+
+    def _take(self, client: LLMClient) -> tuple:
+
+        # Called with self.lock held; the oldest prompt this client may run, unrouted or routed to it
+        for index, item in enumerate(self.queue):
+
+            if item[4] is None or item[4][0] == client.name:
+
+                del self.queue[index]
+
+                return item
+
+        return None
+
+    def _spawn_workers(self):
+
+        # Called with self.lock held
+        for client in self.clients:
+
+            while client.workers < client.max_concurrency:
+
+                client.workers += 1
+                threading.Thread(target = self._worker, args = (client,), daemon = True).start()
+
+    def _worker(self, client: LLMClient):
+
+        while True:
+
+            with self.lock:
+
+                item = self._take(client)
+
+                if item is None and not self.ready.wait(timeout = self.idle_timeout):
+
+                    item = self._take(client)
+
+                    if item is None:
+
+                        client.workers -= 1
+                        return
+
+            if item is None:
+
+                continue
+
+            prompt, future, attempt, context, route = item
+
+            if attempt == 1 and not future.set_running_or_notify_cancel():
+
+                continue
+
+            try:
+
+                client.rate_limiter.acquire()
+                started = time.perf_counter()
+                response = context.run(client.llm.invoke, prompt)
+                client.completed += 1
+                future.set_result(response.content)
+
+                if route is not None:
+
+                    self.router.record(client.name, time.perf_counter() - started)
+
+            except Exception as e:
+
+                # A throttled routed prompt moves on to the next model in its route, others retry where they were
+                if route is not None and self.router.record(client.name, error = e) and attempt < self.max_retries:
+
+                    route = self.router.fallback(route)
+
+                if attempt >= self.max_retries:
+
+                    future.set_exception(e)
+                    continue
+
+                logging.info(f"{client.name} failed a request (attempt {attempt}/{self.max_retries}), requeueing: {e}")
+
+                # Hand the prompt back to the pool so a different client may pick it up
+                with self.lock:
+
+                    self._put((prompt, future, attempt + 1, context, route))
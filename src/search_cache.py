@@ -0,0 +1,379 @@
+from src.logger import logging
+import threading
+import asyncio
+import hashlib
+import sqlite3
+import json
+import time
+import os
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS search_cache (
+    key TEXT PRIMARY KEY,
+    query TEXT NOT NULL,
+    results TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_search_cache_accessed_at ON search_cache (accessed_at);
+"""
+
+class SearchReplayMiss(LookupError):
+
+    """Raised in replay mode for a query the snapshot has no results for."""
+
+def normalize_query(query) -> str:
+
+    # The study links query is built from topic, subject and standard; case and spacing do not change it
+    return " ".join(str(query).split()).lower()
+
+def is_failed(results) -> bool:
+
+    """
+    True for a search that found nothing or failed.
+
+    TavilySearch does not raise on network or API errors, it returns {"error": <exception>}.
+    """
+
+    if isinstance(results, dict):
+
+        return "error" in results or not results.get("results", results)
+
+    return not results
+
+def make_key(query) -> str:
+
+    return hashlib.sha256(normalize_query(query).encode("utf-8")).hexdigest()
+
+class SearchCache:
+
+    """
+    On-disk SQLite store of search results keyed on the normalized query.
+
+    Entries younger than `ttl` seconds are fresh; up to `stale_ttl` seconds more they are still served
+    while a refresh runs in the background. Past `max_entries` the least recently read ones are evicted.
+    """
+
+    def __init__(self, path: str, ttl: float, stale_ttl: float, max_entries: int):
+
+        self.path = path
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+
+        conn = self._connect()
+
+        try:
+
+            conn.executescript(SCHEMA)
+
+        finally:
+
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+
+        conn = sqlite3.connect(self.path, timeout = 30)
+        conn.execute("PRAGMA journal_mode=WAL")
+
+        return conn
+
+    def get(self, key: str) -> tuple:
+
+        """(results, state) where state is "fresh", "stale" or "miss"; expired entries count as misses."""
+
+        conn = self._connect()
+
+        try:
+
+            with conn:
+
+                row = conn.execute("SELECT results, created_at FROM search_cache WHERE key = ?", (key,)).fetchone()
+
+                if row is not None:
+
+                    conn.execute("UPDATE search_cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+
+        finally:
+
+            conn.close()
+
+        age = time.time() - row[1] if row is not None else None
+        state = "miss" if age is None or age > self.ttl + self.stale_ttl else "fresh" if age <= self.ttl else "stale"
+
+        with self.lock:
+
+            if state == "fresh":
+
+                self.hits += 1
+
+            elif state == "stale":
+
+                self.stale_hits += 1
+
+            else:
+
+                self.misses += 1
+
+        return (json.loads(row[0]) if state != "miss" else None), state
+
+    def latest(self, key: str):
+
+        """The stored results whatever their age, or None - the last resort when a live search fails."""
+
+        conn = self._connect()
+
+        try:
+
+            row = conn.execute("SELECT results FROM search_cache WHERE key = ?", (key,)).fetchone()
+
+        finally:
+
+            conn.close()
+
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, key: str, query: str, results):
+
+        now = time.time()
+        conn = self._connect()
+
+        try:
+
+            with conn:
+
+                conn.execute(
+                    "INSERT OR REPLACE INTO search_cache (key, query, results, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, normalize_query(query), json.dumps(results), now, now)
+                )
+
+                # Counted in the database, other processes write to the same file
+                excess = conn.execute("SELECT COUNT(*) FROM search_cache").fetchone()[0] - self.max_entries
+
+                if excess > 0:
+
+                    conn.execute(
+                        "DELETE FROM search_cache WHERE key IN (SELECT key FROM search_cache ORDER BY accessed_at LIMIT ?)",
+                        (excess,)
+                    )
+
+                    logging.info(f"Search cache evicted {excess} entries")
+
+        finally:
+
+            conn.close()
+
+    def stats(self) -> dict:
+
+        with self.lock:
+
+            return {"hits": self.hits, "stale_hits": self.stale_hits, "misses": self.misses}
+
+class SearchSnapshot:
+
+    """
+    Search results saved to a JSON file, {key: {"query": ..., "results": ...}}.
+
+    Filled in record mode and the only source in replay mode, so course generation can run without
+    network access (tests, benchmarks, demos) and return the same links every time.
+    """
+
+    def __init__(self, path: str):
+
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = None
+
+    def _load(self) -> dict:
+
+        if self.entries is None:
+
+            try:
+
+                with open(self.path) as f:
+
+                    self.entries = json.load(f)
+
+            except FileNotFoundError:
+
+                self.entries = {}
+
+        return self.entries
+
+    def get(self, key: str):
+
+        with self.lock:
+
+            entry = self._load().get(key)
+
+        return entry["results"] if entry is not None else None
+
+    def put(self, key: str, query: str, results):
+
+        with self.lock:
+
+            self._load()[key] = {"query": normalize_query(query), "results": results}
+
+            # Written whole and swapped in, a reader never sees half a file
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok = True)
+            temporary = f"{self.path}.{os.getpid()}.tmp"
+
+            with open(temporary, "w") as f:
+
+                json.dump(self.entries, f, indent = 1)
+
+            os.replace(temporary, self.path)
+
+class CachedSearch:
+
+    """
+    Wraps a search tool with the SearchCache, or a SearchSnapshot in record/replay mode.
+
+    mode "live" serves fresh results from the cache and stale ones while refreshing them in the
+    background, "record" searches live and saves every result to the snapshot, "replay" answers only
+    from the snapshot.
+    Failed or empty searches (see is_failed) are never stored; the caller gets the last stored results
+    for the query, however old, or else the failed result as the search tool returned it.
+    """
+
+    def __init__(self, tool, cache: SearchCache, snapshot: SearchSnapshot = None, mode: str = "live"):
+
+        self.tool = tool
+        self.cache = cache
+        self.snapshot = snapshot
+        self.mode = mode
+        self.refreshing = set()
+        self.lock = threading.Lock()
+
+    def invoke(self, query, *args, **kwargs):
+
+        key = make_key(query)
+
+        if self.mode == "replay":
+
+            return self._replay(key, query)
+
+        if self.mode == "live":
+
+            results, state = self.cache.get(key)
+
+            if state == "stale":
+
+                self._refresh_in_background(key, query)
+
+            if results is not None:
+
+                return results
+
+        results = self.tool.invoke(query, *args, **kwargs)
+
+        if is_failed(results):
+
+            return self._fallback(key, query, results)
+
+        self._store(key, query, results)
+
+        return results
+
+    async def ainvoke(self, query, *args, **kwargs):
+
+        key = make_key(query)
+
+        if self.mode == "replay":
+
+            return self._replay(key, query)
+
+        if self.mode == "live":
+
+            # The SQLite lookups are short but blocking, so they run off the event loop
+            results, state = await asyncio.to_thread(self.cache.get, key)
+
+            if state == "stale":
+
+                self._refresh_in_background(key, query)
+
+            if results is not None:
+
+                return results
+
+        results = await self.tool.ainvoke(query, *args, **kwargs)
+
+        if is_failed(results):
+
+            return await asyncio.to_thread(self._fallback, key, query, results)
+
+        await asyncio.to_thread(self._store, key, query, results)
+
+        return results
+
+    def _replay(self, key: str, query):
+
+        results = self.snapshot.get(key)
+
+        if results is None:
+
+            raise SearchReplayMiss(f"No recorded search results for '{normalize_query(query)}' in {self.snapshot.path}")
+
+        return results
+
+    def _fallback(self, key: str, query, results):
+
+        # A failed search is never cached or recorded; an expired entry beats no links at all
+        logging.info(f"Search for '{normalize_query(query)}' failed or found nothing, not cached: {str(results)[:200]}")
+        saved = self.cache.latest(key)
+
+        return saved if saved is not None else results
+
+    def _store(self, key: str, query, results):
+
+        self.cache.put(key, query, results)
+
+        if self.mode == "record":
+
+            self.snapshot.put(key, query, results)
+
+    def _refresh_in_background(self, key: str, query):
+
+        with self.lock:
+
+            # One refresh per query, however many requests see it stale meanwhile
+            if key in self.refreshing:
+
+                return
+
+            self.refreshing.add(key)
+
+        threading.Thread(target = self._refresh, args = (key, query), name = "search-refresh", daemon = True).start()
+
+    def _refresh(self, key: str, query):
+
+        try:
+
+            results = self.tool.invoke(query)
+
+            if is_failed(results):
+
+                raise RuntimeError(str(results)[:200])
+
+            self._store(key, query, results)
+
+        except Exception as e:
+
+            # The stale entry keeps being served until a refresh succeeds or it expires
+            logging.info(f"Search cache refresh failed for '{normalize_query(query)}': {e}")
+
+        finally:
+
+            with self.lock:
+
+                self.refreshing.discard(key)
+
+    def __getattr__(self, name):
+
+        return getattr(self.tool, name)
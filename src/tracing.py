@@ -0,0 +1,322 @@
+from contextlib import contextmanager
+import contextvars
+import threading
+import functools
+import inspect
+import json
+import time
+
+# Upper bounds in seconds, from quick search calls up to whole-course stages
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+class Histogram:
+
+    """Prometheus style histogram, one series per label set."""
+
+    def __init__(self, name: str, help_text: str, labels: tuple):
+
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.series = {}
+
+    def observe(self, value: float, **labels):
+
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        series = self.series.setdefault(key, {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0})
+
+        for index, bound in enumerate(BUCKETS):
+
+            if value <= bound:
+
+                series["buckets"][index] += 1
+
+        series["sum"] += value
+        series["count"] += 1
+
+    def render(self) -> list:
+
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+
+        for key, series in sorted(self.series.items()):
+
+            labels = ",".join(f'{label}="{value}"' for label, value in zip(self.labels, key))
+            prefix = labels + "," if labels else ""
+
+            for bound, count in zip(BUCKETS, series["buckets"]):
+
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {count}')
+
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {series["count"]}')
+            lines.append(f"{self.name}_sum{{{labels}}} {series['sum']:.6f}")
+            lines.append(f"{self.name}_count{{{labels}}} {series['count']}")
+
+        return lines
+
+class Counter:
+
+    def __init__(self, name: str, help_text: str, labels: tuple):
+
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.series = {}
+
+    def inc(self, amount: float = 1, **labels):
+
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        self.series[key] = self.series.get(key, 0) + amount
+
+    def render(self) -> list:
+
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+
+        for key, value in sorted(self.series.items()):
+
+            labels = ",".join(f'{label}="{value}"' for label, value in zip(self.labels, key))
+            lines.append(f"{self.name}{{{labels}}} {value}")
+
+        return lines
+
+class Metrics:
+
+    """Process wide metrics, rendered in the Prometheus text format by /metrics."""
+
+    def __init__(self):
+
+        self.lock = threading.Lock()
+        self.node_seconds = Histogram("agent_node_duration_seconds", "Duration of agent graph nodes and pipeline stages.", ("node", "outcome"))
+        self.llm_seconds = Histogram("llm_call_duration_seconds", "Duration of individual LLM calls.", ("model", "key_slot", "outcome"))
+        self.llm_tokens = Counter("llm_tokens_total", "Tokens sent to and received from LLMs.", ("model", "direction"))
+        self.search_seconds = Histogram("search_call_duration_seconds", "Duration of individual web search calls.", ("tool", "outcome"))
+        self.hedges = Counter("llm_hedge_total", "Hedged LLM calls: sent, won or lost by the duplicate, failed on both attempts, or skipped over budget.", ("model", "outcome"))
+        self.routes = Counter("llm_route_total", "Model tier picked by a router per call, and why.", ("router", "tier", "reason"))
+
+    def record(self, span: dict):
+
+        with self.lock:
+
+            if span["kind"] == "node":
+
+                self.node_seconds.observe(span["seconds"], node = span["name"], outcome = span["outcome"])
+
+            elif span["kind"] == "llm":
+
+                self.llm_seconds.observe(span["seconds"], model = span.get("model"), key_slot = span.get("key_slot", ""), outcome = span["outcome"])
+                self.llm_tokens.inc(span.get("input_tokens", 0), model = span.get("model"), direction = "input")
+                self.llm_tokens.inc(span.get("output_tokens", 0), model = span.get("model"), direction = "output")
+
+            elif span["kind"] == "search":
+
+                self.search_seconds.observe(span["seconds"], tool = span["name"], outcome = span["outcome"])
+
+    def route(self, router: str, tier: str, reason: str):
+
+        with self.lock:
+
+            self.routes.inc(router = router, tier = tier, reason = reason)
+
+    def hedge(self, model: str, outcome: str):
+
+        with self.lock:
+
+            self.hedges.inc(model = model, outcome = outcome)
+
+    def render(self) -> str:
+
+        with self.lock:
+
+            lines = []
+
+            for metric in (self.node_seconds, self.llm_seconds, self.llm_tokens, self.search_seconds, self.routes, self.hedges):
+
+                lines.extend(metric.render())
+
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+class Trace:
+
+    """Every span recorded while one course was generated, with offsets from the start of the course."""
+
+    def __init__(self):
+
+        self.started = time.perf_counter()
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def add(self, span: dict):
+
+        with self.lock:
+
+            self.spans.append(span)
+
+    def to_json(self) -> str:
+
+        with self.lock:
+
+            return json.dumps({"seconds": round(time.perf_counter() - self.started, 3), "spans": self.spans})
+
+_current_trace = contextvars.ContextVar("current_trace", default = None)
+
+@contextmanager
+def start_trace():
+
+    """Collect the spans of everything run in this context (and contexts copied from it) into a Trace."""
+
+    trace = Trace()
+    token = _current_trace.set(trace)
+
+    try:
+
+        yield trace
+
+    finally:
+
+        _current_trace.reset(token)
+
+@contextmanager
+def span(name: str, kind: str = "node", **attributes):
+
+    """Time a block; the yielded dict can take more attributes (model, key_slot, tokens) before it closes."""
+
+    record = {"name": name, "kind": kind, **attributes}
+    trace = _current_trace.get()
+    started = time.perf_counter()
+
+    if trace is not None:
+
+        record["offset"] = round(started - trace.started, 3)
+
+    try:
+
+        yield record
+        record["outcome"] = "ok"
+
+    except BaseException as e:
+
+        record["outcome"] = "error"
+        record["error"] = type(e).__name__
+        raise
+
+    finally:
+
+        record["seconds"] = round(time.perf_counter() - started, 4)
+        metrics.record(record)
+
+        if trace is not None:
+
+            trace.add(record)
+
+def add_span(name: str, seconds: float, kind: str = "node", outcome: str = "ok", **attributes):
+
+    """Record a span measured by the caller, for work that does not fit in one `with span(...)` block."""
+
+    record = {"name": name, "kind": kind, "seconds": round(seconds, 4), "outcome": outcome, **attributes}
+    trace = _current_trace.get()
+
+    if trace is not None:
+
+        record["offset"] = round(time.perf_counter() - seconds - trace.started, 3)
+
+    metrics.record(record)
+
+    if trace is not None:
+
+        trace.add(record)
+
+def traced_node(name: str):
+
+    """Decorator timing an agent node, sync or async, as span `name`."""
+
+    def decorate(function):
+
+        if inspect.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+
+                with span(name):
+
+                    return await function(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+
+            with span(name):
+
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+def _record_response(record: dict, response):
+
+    usage = getattr(response, "usage_metadata", None) or {}
+    metadata = getattr(response, "response_metadata", None) or {}
+    record["input_tokens"] = usage.get("input_tokens", 0)
+    record["output_tokens"] = usage.get("output_tokens", 0)
+
+    if "key_slot" in metadata:
+
+        record["key_slot"] = metadata["key_slot"]
+
+class TracedLLM:
+
+    """Wraps a chat model so every call becomes an "llm" span with model, key slot and token usage."""
+
+    def __init__(self, llm):
+
+        self.llm = llm
+        self.model_name = getattr(llm, "model_name", None) or getattr(llm, "model", "")
+
+    def invoke(self, prompt, *args, **kwargs):
+
+        with span(self.model_name, kind = "llm", model = self.model_name) as record:
+
+            response = self.llm.invoke(prompt, *args, **kwargs)
+            _record_response(record, response)
+
+            return response
+
+    async def ainvoke(self, prompt, *args, **kwargs):
+
+        with span(self.model_name, kind = "llm", model = self.model_name) as record:
+
+            response = await self.llm.ainvoke(prompt, *args, **kwargs)
+            _record_response(record, response)
+
+            return response
+
+    def __getattr__(self, name):
+
+        return getattr(self.llm, name)
+
+class TracedTool:
+
+    """Wraps a search tool so every call becomes a "search" span."""
+
+    def __init__(self, tool, name: str):
+
+        self.tool = tool
+        self.name = name
+
+    def invoke(self, query, *args, **kwargs):
+
+        with span(self.name, kind = "search"):
+
+            return self.tool.invoke(query, *args, **kwargs)
+
+    async def ainvoke(self, query, *args, **kwargs):
+
+        with span(self.name, kind = "search"):
+
+            return await self.tool.ainvoke(query, *args, **kwargs)
+
+    def __getattr__(self, name):
+
+        return getattr(self.tool, name)
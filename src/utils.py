@@ -1,84 +1,193 @@
 from langchain_groq.chat_models import ChatGroq
+from langchain_tavily import TavilySearch
 from src.logger import logging
 from src.exception import CustomException
+from src.llm_cache import LLMCache, CachedLLM
+from src.search_cache import SearchCache, SearchSnapshot, CachedSearch
+from src.key_pool import KeyPool, PooledLLM
+from src.tracing import TracedLLM, TracedTool
+from src.hedging import HedgedLLM, hedging_enabled
+import threading
 import sys
 import os
 
-def get_llm_1():
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+_key_pool = None
+_key_pool_lock = threading.Lock()
+_search_cache = None
+_search_cache_lock = threading.Lock()
 
-    if os.getenv("GROQ_API_KEY_1") is None:
+def get_llm_cache():
 
-        raise Exception("GROQ_API_KEY is not set")
+    """Process wide LLM response cache, created on first use."""
 
-    try:
+    global _llm_cache
 
-        logging.info("Initializing LLM")
+    with _llm_cache_lock:
 
-        llm = ChatGroq(
-            model = "llama-3.1-8b-instant", 
-            temperature = 0.1,
-            api_key = os.getenv("GROQ_API_KEY_1")
-        )
+        if _llm_cache is None:
 
-        logging.info("LLM initialized")
+            _llm_cache = LLMCache(
+                path = os.getenv("LLM_CACHE_PATH", os.path.join(os.getcwd(), "instance", "llm_cache.db")),
+                max_bytes = int(os.getenv("LLM_CACHE_MAX_MB", "256")) * 1024 * 1024
+            )
 
-        return llm
-    
-    except Exception as e:
+        return _llm_cache
 
-        raise CustomException(e, sys)
-        
-def get_llm_lite_1():
+def get_search_cache():
 
-    if os.getenv("GROQ_API_KEY_1") is None:
+    """Process wide search result cache, created on first use."""
 
-        raise Exception("GROQ_API_KEY is not set")
+    global _search_cache
 
-    try:
+    with _search_cache_lock:
 
-        logging.info("Initializing LLM")
+        if _search_cache is None:
 
-        llm = ChatGroq(
-            model = "llama-3.3-70b-versatile", 
-            temperature = 0.1,
-            api_key = os.getenv("GROQ_API_KEY_1")
-        )
+            _search_cache = SearchCache(
+                path = os.getenv("SEARCH_CACHE_PATH", os.path.join(os.getcwd(), "instance", "search_cache.db")),
+                ttl = float(os.getenv("SEARCH_CACHE_TTL_HOURS", "72")) * 3600,
+                stale_ttl = float(os.getenv("SEARCH_CACHE_STALE_HOURS", "336")) * 3600,
+                max_entries = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "5000"))
+            )
 
-        logging.info("LLM initialized")
+        return _search_cache
 
-        return llm
-    
-    except Exception as e:
+def search_mode() -> str:
 
-        raise CustomException(e, sys)
-    
-def get_llm_2():
+    """SEARCH_MODE - "live" (default), "record" or "replay", see src.search_cache.CachedSearch. "off" skips the cache."""
 
-    if os.getenv("GROQ_API_KEY_2") is None:
+    return os.getenv("SEARCH_MODE", "live").lower()
 
-        raise Exception("GROQ_API_KEY is not set")
+def llm_cache_enabled(agent: str) -> bool:
 
-    try:
+    """Response caching is opt-in per agent, e.g. LLM_CACHE_AGENTS="testing,tutoring"."""
 
-        logging.info("Initializing LLM")
+    agents = os.getenv("LLM_CACHE_AGENTS", "")
 
-        llm = ChatGroq(
-            model = "llama-3.1-8b-instant", 
-            temperature = 0.1,
-            api_key = os.getenv("GROQ_API_KEY_2")
-        )
+    return agent in [name.strip().lower() for name in agents.split(",")]
 
-        logging.info("LLM initialized")
+def get_api_keys() -> list:
 
-        return llm
-    
-    except Exception as e:
+    """All configured Groq keys - GROQ_API_KEYS="k1,k2,..." or GROQ_API_KEY_1, GROQ_API_KEY_2, ..."""
 
-        raise CustomException(e, sys)
-        
-def get_llm_lite_2():
+    if os.getenv("GROQ_API_KEYS"):
+
+        return [key.strip() for key in os.getenv("GROQ_API_KEYS").split(",") if key.strip()]
+
+    keys = []
+
+    while os.getenv(f"GROQ_API_KEY_{len(keys) + 1}"):
+
+        keys.append(os.getenv(f"GROQ_API_KEY_{len(keys) + 1}"))
+
+    return keys
+
+def fake_backends() -> bool:
+
+    """LLM_BACKEND=fake swaps ChatGroq and TavilySearch for the local simulations in src/fakes.py."""
+
+    return os.getenv("LLM_BACKEND", "groq").lower() == "fake"
+
+def key_pool_enabled() -> bool:
+
+    return os.getenv("GROQ_KEY_POOL", "0") == "1"
+
+def _build_chat_model(model: str, temperature: float, api_key: str, http_client = None, http_async_client = None):
+
+    if fake_backends():
+
+        from src.fakes import FakeChatModel
+
+        return FakeChatModel(model, temperature)
+
+    # Retries are left to the key pool, which can move a throttled call to another key
+    return ChatGroq(
+        model = model,
+        temperature = temperature,
+        api_key = api_key,
+        http_client = http_client,
+        http_async_client = http_async_client,
+        max_retries = 0 if http_client is not None else 2
+    )
+
+def get_key_pool() -> KeyPool:
+
+    """Process wide pool over every configured key, created on first use."""
+
+    global _key_pool
 
-    if os.getenv("GROQ_API_KEY_2") is None:
+    with _key_pool_lock:
+
+        if _key_pool is None:
+
+            api_keys = get_api_keys()
+
+            if fake_backends() and not api_keys:
+
+                # Simulated keys, so the pool itself can be benchmarked offline
+                api_keys = [f"fake-key-{slot}" for slot in range(int(os.getenv("FAKE_KEYS", "4")))]
+
+            _key_pool = KeyPool(
+                api_keys,
+                _build_chat_model,
+                requests_per_minute = int(os.getenv("GROQ_KEY_RPM", "30")),
+                tokens_per_minute = int(os.getenv("GROQ_KEY_TPM", "6000"))
+            )
+
+        return _key_pool
+
+def get_search_tool(max_results: int = 5):
+
+    mode = search_mode()
+
+    if mode == "replay":
+
+        # Served from the snapshot alone, no search client (or API key) is needed
+        tool = None
+
+    elif fake_backends():
+
+        from src.fakes import FakeSearch
+
+        tool = TracedTool(FakeSearch(max_results = max_results), "fake_search")
+
+    else:
+
+        tool = TracedTool(TavilySearch(
+            max_results = max_results,
+            topic = "general",
+            api_key = os.getenv("TAVILY_API_KEY")
+        ), "tavily")
+
+    if mode == "off":
+
+        return tool
+
+    snapshot = SearchSnapshot(os.getenv("SEARCH_SNAPSHOT_PATH", os.path.join(os.getcwd(), "instance", "search_snapshot.json")))
+
+    return CachedSearch(tool, get_search_cache(), snapshot, mode)
+
+def _build_llm(model: str, key_env: str):
+
+    if key_pool_enabled():
+
+        return PooledLLM(get_key_pool(), model, 0.1)
+
+    return _build_chat_model(model, 0.1, os.getenv(key_env))
+
+def _backup_key_env(key_env: str) -> str:
+
+    # Hedges go to the other key, so a throttled or slow key is not asked twice; with one key, to that key
+    other = "GROQ_API_KEY_2" if key_env == "GROQ_API_KEY_1" else "GROQ_API_KEY_1"
+
+    return other if os.getenv(other) else key_env
+
+def _get_llm(model: str, key_env: str, cached: bool):
+
+    # With GROQ_KEY_POOL=1 every factory draws from the shared key pool instead of its fixed key
+    if not key_pool_enabled() and not fake_backends() and os.getenv(key_env) is None:
 
         raise Exception("GROQ_API_KEY is not set")
 
@@ -86,16 +195,36 @@ def get_llm_lite_2():
 
         logging.info("Initializing LLM")
 
-        llm = ChatGroq(
-            model = "llama-3.3-70b-versatile", 
-            temperature = 0.1,
-            api_key = os.getenv("GROQ_API_KEY_2")
-        )
+        llm = _build_llm(model, key_env)
 
         logging.info("LLM initialized")
 
-        return llm
+        # Traced inside the cache, so cache hits do not show up as LLM calls
+        llm = TracedLLM(llm)
+
+        if hedging_enabled():
+
+            # Both attempts of a hedged call are traced; with the key pool the duplicate draws its own key
+            llm = HedgedLLM(llm, TracedLLM(_build_llm(model, _backup_key_env(key_env))))
+
+        return CachedLLM(llm, get_llm_cache()) if cached else llm
     
     except Exception as e:
 
         raise CustomException(e, sys)
+
+def get_llm_1(cached: bool = False):
+
+    return _get_llm("llama-3.1-8b-instant", "GROQ_API_KEY_1", cached)
+
+def get_llm_lite_1(cached: bool = False):
+
+    return _get_llm("llama-3.3-70b-versatile", "GROQ_API_KEY_1", cached)
+
+def get_llm_2(cached: bool = False):
+
+    return _get_llm("llama-3.1-8b-instant", "GROQ_API_KEY_2", cached)
+
+def get_llm_lite_2(cached: bool = False):
+
+    return _get_llm("llama-3.3-70b-versatile", "GROQ_API_KEY_2", cached)
@@ -246,20 +246,212 @@ document.addEventListener('DOMContentLoaded', function() {
     }
     
     // ===================================
-    // LESSON ACCORDION & OTHER UI
+    // COURSE GENERATION STREAM
     // ===================================
-    const lessonHeaders = document.querySelectorAll('.lesson-header');
-    lessonHeaders.forEach((header, index) => {
-        header.style.setProperty('--index', index);
-        header.addEventListener('click', function() {
-            const lessonCard = this.parentElement;
-            const isActive = lessonCard.classList.contains('active');
-            document.querySelectorAll('.lesson-card').forEach(card => card.classList.remove('active'));
-            if (!isActive) {
-                lessonCard.classList.add('active');
-                setTimeout(() => lessonCard.scrollIntoView({ behavior: 'smooth', block: 'nearest' }), 100);
+    const generationStatus = document.getElementById('generation-status');
+    if (generationStatus && window.EventSource) {
+        const stageLabels = {
+            queued: 'Waiting for a free agent...',
+            research: '🔍 Researching your topic and gathering resources...',
+            planning: '📝 Planning comprehensive lessons...',
+            lessons: '✍️ Generating detailed content...',
+            tests: '🧪 Creating quizzes and tests...',
+            saving: '💾 Saving your course...'
+        };
+        const stageText = document.getElementById('generation-stage');
+        const countsText = document.getElementById('generation-counts');
+        const fill = document.getElementById('generation-fill');
+        const lessonList = document.getElementById('lesson-list');
+        const lessonCards = [];
+        let lessonsDone = 0;
+        let testsDone = 0;
+
+        function updateCounts() {
+            if (!lessonCards.length) return;
+            countsText.textContent = `${lessonsDone} / ${lessonCards.length} lessons, ${testsDone} / ${lessonCards.length} quizzes`;
+            fill.style.width = ((lessonsDone + testsDone) / (2 * lessonCards.length) * 100) + '%';
+        }
+
+        function createLessonCard(title, index) {
+            const card = document.createElement('div');
+            card.className = 'lesson-card';
+            card.dataset.title = title;
+            card.style.setProperty('--index', index);
+
+            const header = document.createElement('div');
+            header.className = 'lesson-header';
+            const heading = document.createElement('h3');
+            heading.style.cssText = 'margin: 0; font-size: 1.1rem;';
+            heading.textContent = title;
+            const wrapper = document.createElement('div');
+            wrapper.appendChild(heading);
+            const toggle = document.createElement('span');
+            toggle.className = 'lesson-toggle';
+            toggle.textContent = '▼';
+            header.append(wrapper, toggle);
+
+            const content = document.createElement('div');
+            content.className = 'lesson-content';
+            const body = document.createElement('div');
+            body.className = 'lesson-body';
+            body.style.cssText = 'color: var(--light-grey); line-height: 1.8;';
+            body.innerHTML = '<p><em>Generating lesson...</em></p>';
+            content.appendChild(body);
+
+            card.append(header, content);
+            return card;
+        }
+
+        function cardFor(data) {
+            let card = lessonCards[data.ordinal] || lessonCards.find(c => c.dataset.title === data.title);
+            if (!card) {
+                // Plan not received (e.g. reconnect), append in arrival order
+                card = createLessonCard(data.title, lessonCards.length);
+                lessonCards.push(card);
+                lessonList.appendChild(card);
+            }
+            return card;
+        }
+
+        function renderLinks(links) {
+            const container = document.getElementById('course-links');
+            container.innerHTML = '';
+            links.split('\n').forEach(link => {
+                if (!link.trim()) return;
+                let item;
+                if (link.includes('http')) {
+                    item = document.createElement('a');
+                    item.href = link.trim();
+                    item.target = '_blank';
+                    item.className = 'study-link';
+                    item.textContent = '📚 Resource Link';
+                } else {
+                    item = document.createElement('span');
+                    item.style.cssText = 'color: var(--light-grey); display: block; margin: 0.5rem 0;';
+                    item.textContent = link;
+                }
+                container.appendChild(item);
+            });
+        }
+
+        const source = new EventSource(generationStatus.dataset.streamUrl);
+
+        source.addEventListener('stage', e => {
+            const data = JSON.parse(e.data);
+            stageText.textContent = stageLabels[data.stage] || 'Agents are collaborating...';
+        });
+
+        source.addEventListener('overview', e => {
+            const data = JSON.parse(e.data);
+            document.getElementById('course-intro').innerHTML = data.intro;
+            renderLinks(data.links);
+        });
+
+        source.addEventListener('plan', e => {
+            const data = JSON.parse(e.data);
+            if (lessonCards.length) return;
+            data.lessons.forEach((title, index) => {
+                const card = createLessonCard(title, index);
+                lessonCards.push(card);
+                lessonList.appendChild(card);
+            });
+            updateCounts();
+        });
+
+        source.addEventListener('lesson', e => {
+            const data = JSON.parse(e.data);
+            const card = cardFor(data);
+            card.querySelector('.lesson-body').innerHTML = data.content;
+            // A resumed or requeued job publishes saved lessons again, count each lesson once
+            if (!card.classList.contains('ready')) {
+                card.classList.add('ready');
+                lessonsDone++;
+            }
+            updateCounts();
+        });
+
+        source.addEventListener('test', e => {
+            const data = JSON.parse(e.data);
+            const card = cardFor(data);
+            let quiz = card.querySelector('.quiz-section');
+            if (quiz) {
+                // Republished test, replace the quiz already shown
+                quiz.querySelector('.quiz-body').innerHTML = data.test;
+                return;
             }
+            quiz = document.createElement('div');
+            quiz.className = 'quiz-section';
+            quiz.innerHTML = '<h4 class="quiz-title">📝 Practice Quiz</h4>';
+            const body = document.createElement('div');
+            body.className = 'quiz-body';
+            body.style.cssText = 'color: var(--light-grey); line-height: 1.8;';
+            body.innerHTML = data.test;
+            quiz.appendChild(body);
+            card.querySelector('.lesson-content').appendChild(quiz);
+            testsDone++;
+            updateCounts();
         });
+
+        source.addEventListener('done', () => {
+            source.close();
+            generationStatus.classList.remove('active');
+        });
+
+        source.addEventListener('failed', e => {
+            const data = JSON.parse(e.data);
+            source.close();
+            stageText.textContent = 'An error occurred during generation.';
+            countsText.textContent = data.error || '';
+        });
+    }
+    
+    // ===================================
+    // LESSON ACCORDION & OTHER UI
+    // ===================================
+    // Saved courses ship only the first lesson, the others are fetched when opened
+    function loadLesson(card) {
+        if (!card.dataset.lessonUrl || card.classList.contains('loaded')) return;
+        card.classList.add('loaded');
+        fetch(card.dataset.lessonUrl)
+            .then(response => {
+                if (!response.ok) throw new Error(response.statusText);
+                return response.json();
+            })
+            .then(data => {
+                card.querySelector('.lesson-body').innerHTML = data.content || '';
+                if (data.test) {
+                    const quiz = document.createElement('div');
+                    quiz.className = 'quiz-section';
+                    quiz.innerHTML = '<h4 class="quiz-title">📝 Practice Quiz</h4>';
+                    const body = document.createElement('div');
+                    body.style.cssText = 'color: var(--light-grey); line-height: 1.8;';
+                    body.innerHTML = data.test;
+                    quiz.appendChild(body);
+                    card.querySelector('.lesson-content').appendChild(quiz);
+                }
+            })
+            .catch(() => {
+                // Let the next click retry
+                card.classList.remove('loaded');
+                card.querySelector('.lesson-body').innerHTML = '<p><em>Could not load this lesson. Click to try again.</em></p>';
+            });
+    }
+
+    // Delegated, so lesson cards streamed in after page load work too
+    document.addEventListener('click', function(e) {
+        const header = e.target.closest('.lesson-header');
+        if (!header) return;
+        const lessonCard = header.parentElement;
+        const isActive = lessonCard.classList.contains('active');
+        document.querySelectorAll('.lesson-card').forEach(card => card.classList.remove('active'));
+        if (!isActive) {
+            loadLesson(lessonCard);
+            lessonCard.classList.add('active');
+            setTimeout(() => lessonCard.scrollIntoView({ behavior: 'smooth', block: 'nearest' }), 100);
+        }
+    });
+    document.querySelectorAll('.lesson-header').forEach((header, index) => {
+        header.style.setProperty('--index', index);
     });
 
     document.querySelectorAll('.lesson-card').forEach((card, index) => {